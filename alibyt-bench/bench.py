@@ -0,0 +1,418 @@
+"""End-to-end benchmark: fake pixlet -> mqtt_publisher.py -> broker -> M x mqtt_client.py.
+
+    python3 bench.py --apps 20 --devices 3 --duration 120 --frames 4 --bytes 8000 -o results.json
+
+Runs fully offline on one host. Apps are rendered by fake_pixlet.py, clients draw on the stub
+rgbmatrix package in this directory, and the broker is mosquitto (configured from
+alibyt-mqtt/mosquitto.conf, with a private port and persistence directory) when installed,
+or broker.py otherwise. Needs the client's and publisher's own dependencies (paho-mqtt, Pillow).
+
+Prints one JSON object with the parameters, the git commit and the results, so runs can
+be compared across commits:
+
+    renders           fake pixlet renders, per second, and mean render time
+    publishes         image messages seen on the broker, their bytes, and how many were deltas
+    latency           seconds from an image reaching the broker to its first frame on a panel
+    clients           per device: CPU per frame shown, peak RSS, fps, late/dropped frames, decode time,
+                      time from start to the first frame
+    publisher         CPU seconds and peak RSS of mqtt_publisher.py
+"""
+import argparse
+import importlib.util
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from io import BytesIO
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+SERVER_DIR = os.path.join(REPO_DIR, "alibyt-server")
+CLIENT_DIR = os.path.join(REPO_DIR, "alibyt-client")
+MOSQUITTO_CONF = os.path.join(REPO_DIR, "alibyt-mqtt", "mosquitto.conf")
+FAKE_PIXLET = os.path.join(BENCH_DIR, "fake_pixlet.py")
+
+sys.path.insert(0, SERVER_DIR)
+
+import paho.mqtt.client as mqtt  # noqa: E402
+from PIL import Image  # noqa: E402
+
+import payload  # noqa: E402
+import raw_frames  # noqa: E402
+from broker import Broker  # noqa: E402
+from database import Database  # noqa: E402
+from fake_pixlet import app_id  # noqa: E402
+from rgbmatrix import read_marker  # noqa: E402
+
+# The client's raw_frames applies deltas; it shares its module name with the server's
+_spec = importlib.util.spec_from_file_location("client_raw_frames", os.path.join(CLIENT_DIR, "raw_frames.py"))
+client_raw_frames = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(client_raw_frames)
+
+STOP_TIMEOUT = 15  # Seconds to wait for a process to exit after SIGINT before killing it
+STATS_INTERVAL = 2  # Seconds between client stats reports during a run
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def start_broker(kind, port, workdir):
+    """Starts mosquitto or the in-process broker. Returns (name, stop function)."""
+    if kind in ("auto", "mosquitto") and shutil.which("mosquitto"):
+        persistence = os.path.join(workdir, "mosquitto")
+        os.makedirs(persistence, exist_ok=True)
+        lines = []
+        with open(MOSQUITTO_CONF, encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("listener"):
+                    line = f"listener {port} 127.0.0.1\n"
+                elif line.startswith("persistence_location"):
+                    line = f"persistence_location {persistence}/\n"
+                lines.append(line)
+        lines.append(f"log_dest file {os.path.join(workdir, 'mosquitto.log')}\n")
+        conf_path = os.path.join(workdir, "mosquitto.conf")
+        with open(conf_path, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+        proc = subprocess.Popen(["mosquitto", "-c", conf_path],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if not wait_for_port(port):
+            proc.kill()
+            raise RuntimeError("mosquitto did not start")
+        return "mosquitto", lambda: (proc.terminate(), proc.wait())
+    if kind == "mosquitto":
+        raise RuntimeError("mosquitto is not installed")
+    broker = Broker(port=port).start()
+    return "in-process", broker.stop
+
+
+def setup_server(server_dir, apps, devices, refresh_rate):
+    """Writes a catalog of fake apps and a database subscribing every device to every app."""
+    apps_dir = os.path.join(server_dir, "apps")
+    catalog = {}
+    for name in apps:
+        app_dir = os.path.join(apps_dir, name)
+        os.makedirs(app_dir, exist_ok=True)
+        with open(os.path.join(app_dir, f"{name}.star"), "w", encoding="utf-8") as f:
+            f.write(f'def main(config):\n    return render.Root(child = render.Text("{name}"))\n')
+        catalog[name] = {
+            "path": app_dir,
+            "app_name": f"{name}.star",
+            "photo_name": f"{name}.webp",
+            "refresh_rate": refresh_rate,
+            "config_settings": [],
+        }
+    with open(os.path.join(server_dir, "apps_config.json"), "w", encoding="utf-8") as f:
+        json.dump(catalog, f, indent=4)
+
+    db = Database(os.path.join(server_dir, "alibyt.db"))
+    db.migrate_from_json(os.path.join(server_dir, "none.json"), os.path.join(server_dir, "none.json"))
+    for device in devices:
+        db.register_device(device, name=device)
+        db.set_subscriptions(apps, device)
+
+
+def first_frame(body):
+    """First frame of a published WebP or raw frame bundle, as an RGB image."""
+    if not raw_frames.is_bundle(body):
+        return Image.open(BytesIO(body)).convert("RGB")
+    _, frame_format, codec, width, height, count = raw_frames.HEADER.unpack_from(body)
+    pixels = body[raw_frames.HEADER.size + 2 * count:]
+    if codec == raw_frames.CODEC_ZLIB:
+        pixels = zlib.decompress(pixels)
+    raw_mode = "RGB" if frame_format == raw_frames.FORMAT_RGB888 else "BGR;16"
+    return Image.frombuffer("RGB", (width, height), pixels, "raw", raw_mode, 0, 1)
+
+
+class Observer:
+    """Watches the broker: when each render reached it, per device, and each client's stats."""
+
+    def __init__(self, port):
+        self.lock = threading.Lock()
+        self.arrivals = {}  # (device, app id, seq) -> first time seen
+        self.messages = 0
+        self.bytes = 0
+        self.deltas = 0
+        self.bundles = {}  # topic -> last raw bundle, the base of the next delta
+        self.stats = {}  # device -> last stats message
+        self.client = mqtt.Client()
+        self.client.on_connect = lambda client, userdata, flags, rc: client.subscribe(
+            [("alibyt/+/live/+", 0), ("alibyt/+/stats", 0)]  # What connected devices receive
+        )
+        self.client.on_message = self.on_message
+        self.client.connect("127.0.0.1", port)
+        self.client.loop_start()
+
+    def on_message(self, client, userdata, message):
+        now = time.time()
+        parts = message.topic.split("/")
+        device = parts[1]
+        if parts[2] == "stats":
+            with self.lock:
+                self.stats[device] = json.loads(message.payload)
+            return
+        if not message.payload:
+            return
+        _, body, _, _, flags = payload.decode(message.payload)
+        body = bytes(body)
+        with self.lock:
+            self.messages += 1
+            self.bytes += len(message.payload)
+            if flags & payload.FLAG_DELTA:
+                self.deltas += 1
+                try:
+                    body = client_raw_frames.apply(body, self.bundles.get(message.topic))
+                except ValueError:
+                    return  # The client asks for a keyframe, which is observed when it arrives
+            if raw_frames.is_bundle(body):
+                self.bundles[message.topic] = body
+        marker = read_marker(first_frame(body))
+        if marker is None:
+            return
+        with self.lock:
+            self.arrivals.setdefault((device,) + marker, now)
+
+    def stop(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def stop_process(proc):
+    """Interrupts a process like Ctrl-C would and returns its resource usage."""
+    proc.send_signal(signal.SIGINT)
+    deadline = time.monotonic() + STOP_TIMEOUT
+    while True:
+        pid, status, usage = os.wait4(proc.pid, os.WNOHANG)
+        if pid:
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            return usage
+        if time.monotonic() > deadline:
+            proc.kill()
+            _, status, usage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            return usage
+        time.sleep(0.1)
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+
+    def pick(q):
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": pick(0.5),
+        "p90": pick(0.9),
+        "p99": pick(0.99),
+        "max": values[-1],
+    }
+
+
+def read_jsonl(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "-C", REPO_DIR, "rev-parse", "HEAD"],
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "-C", REPO_DIR, "status", "--porcelain", "--untracked-files=no"],
+                                    capture_output=True, text=True).stdout.strip())
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="alibyt-bench-")
+    server_dir = os.path.join(workdir, "server")
+    os.makedirs(server_dir)
+    apps = [f"app{i}" for i in range(args.apps)]
+    devices = [f"bench-{i}" for i in range(args.devices)]
+    setup_server(server_dir, apps, devices, args.refresh)
+
+    port = free_port()
+    broker_name, stop_broker = start_broker(args.broker, port, workdir)
+    observer = Observer(port)
+
+    base_env = dict(os.environ, ALIBYT_MQTT_BROKER="127.0.0.1", ALIBYT_MQTT_PORT=str(port),
+                    ALIBYT_LOG_LEVEL=args.log_level)
+    pixlet_log = os.path.join(workdir, "renders.jsonl")
+    publisher_env = dict(
+        base_env,
+        ALIBYT_SERVER_DIR=server_dir,
+        PIXLET_BIN=FAKE_PIXLET,
+        FAKE_PIXLET_FRAMES=str(args.frames),
+        FAKE_PIXLET_BYTES=str(args.bytes),
+        FAKE_PIXLET_DELAY=str(args.render_delay),
+        FAKE_PIXLET_CHANGE_INTERVAL=str(args.change_interval),
+        FAKE_PIXLET_STATIC="1" if args.static else "0",
+        FAKE_PIXLET_LOG=pixlet_log,
+    )
+
+    logs = []
+    clients = {}
+    for device in devices:
+        device_dir = os.path.join(workdir, "clients", device)
+        os.makedirs(device_dir)
+        env = dict(
+            base_env,
+            PYTHONPATH=os.pathsep.join(filter(None, [BENCH_DIR, os.environ.get("PYTHONPATH")])),
+            ALIBYT_DEVICE_ID=device,
+            ALIBYT_CACHE_DIR=os.path.join(device_dir, "cache"),
+            ALIBYT_BENCH_FRAMES=os.path.join(device_dir, "frames.jsonl"),
+            ALIBYT_DISPLAY_SPEED=str(args.dwell),
+            ALIBYT_STATS_INTERVAL=str(STATS_INTERVAL),
+            ALIBYT_FRAME_FORMAT=args.frame_format,
+        )
+        log = open(os.path.join(device_dir, "client.log"), "wb")
+        logs.append(log)
+        clients[device] = subprocess.Popen([sys.executable, "mqtt_client.py"], cwd=CLIENT_DIR, env=env,
+                                           stdout=log, stderr=subprocess.STDOUT)
+
+    publisher_log = open(os.path.join(workdir, "publisher.log"), "wb")
+    logs.append(publisher_log)
+    started = time.time()
+    publisher = subprocess.Popen([sys.executable, "mqtt_publisher.py"], cwd=SERVER_DIR, env=publisher_env,
+                                 stdout=publisher_log, stderr=subprocess.STDOUT)
+    try:
+        time.sleep(args.duration)
+    finally:
+        publisher_usage = stop_process(publisher)
+        client_usage = {device: stop_process(proc) for device, proc in clients.items()}
+        elapsed = time.time() - started
+        time.sleep(0.5)  # Last stats messages
+        observer.stop()
+        stop_broker()
+        for log in logs:
+            log.close()
+
+    renders = read_jsonl(pixlet_log)
+    app_ids = {app_id(name): name for name in apps}
+    latencies = []
+    client_results = {}
+    for device in devices:
+        events = read_jsonl(os.path.join(workdir, "clients", device, "frames.jsonl"))
+        summary = next((event for event in events if event.get("summary")), {})
+        seen = set()
+        for event in events:
+            key = (device, event.get("app"), event.get("seq"))
+            if event.get("summary") or key in seen or event.get("app") not in app_ids:
+                continue
+            seen.add(key)
+            arrival = observer.arrivals.get(key)
+            if arrival is not None:
+                latencies.append(event["t"] - arrival)
+
+        usage = client_usage[device]
+        cpu = usage.ru_utime + usage.ru_stime
+        frames = summary.get("frames", 0)
+        stats = observer.stats.get(device, {})
+        client_results[device] = {
+            "frames": frames,
+            "fps": summary.get("fps", 0.0),
+            "max_frame_gap": summary.get("max_gap", 0.0),
+            "cpu_seconds": cpu,
+            "cpu_ms_per_frame": cpu * 1000 / frames if frames else None,
+            "max_rss_kib": usage.ru_maxrss,
+            "late_frames": stats.get("late"),
+            "dropped_frames": stats.get("dropped"),
+            "decodes": stats.get("decodes"),
+            "decode_ms_mean": stats["decode_s"] * 1000 / stats["decodes"] if stats.get("decodes") else None,
+            "first_frame_ms": stats["first_frame_s"] * 1000 if stats.get("first_frame_s") is not None else None,
+            "exit_code": clients[device].returncode,
+        }
+
+    render_times = [render["end"] - render["start"] for render in renders]
+    return {
+        "commit": git_commit(),
+        "timestamp": started,
+        "params": {
+            "apps": args.apps, "devices": args.devices, "duration": args.duration,
+            "frames": args.frames, "bytes": args.bytes, "render_delay": args.render_delay,
+            "change_interval": args.change_interval, "static": args.static, "refresh": args.refresh, "dwell": args.dwell,
+            "frame_format": args.frame_format, "broker": broker_name,
+        },
+        "results": {
+            "elapsed": elapsed,
+            "renders": {
+                "count": len(renders),
+                "per_second": len(renders) / elapsed,
+                "mean_seconds": sum(render_times) / len(render_times) if render_times else None,
+                "mean_bytes": sum(render["bytes"] for render in renders) / len(renders) if renders else None,
+            },
+            "publishes": {"count": observer.messages, "bytes": observer.bytes, "deltas": observer.deltas},
+            "latency": percentiles(latencies),
+            "clients": client_results,
+            "publisher": {
+                "cpu_seconds": publisher_usage.ru_utime + publisher_usage.ru_stime,
+                "max_rss_kib": publisher_usage.ru_maxrss,
+                "exit_code": publisher.returncode,
+            },
+        },
+        "workdir": workdir,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apps", type=int, default=10, help="apps subscribed by every device")
+    parser.add_argument("--devices", type=int, default=2, help="client processes")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to run")
+    parser.add_argument("--frames", type=int, default=1, help="frames per rendered image")
+    parser.add_argument("--bytes", type=int, default=0, help="approximate bytes per rendered image")
+    parser.add_argument("--render-delay", type=float, default=0.05, help="seconds per fake render")
+    parser.add_argument("--change-interval", type=float, default=0,
+                        help="seconds an app's image stays the same (0: every render changes)")
+    parser.add_argument("--static", action="store_true",
+                        help="only the marker pixels change between renders, like a clock")
+    parser.add_argument("--refresh", type=int, default=10, help="catalog refresh rate of every app")
+    parser.add_argument("--dwell", type=float, default=2, help="client seconds per app")
+    parser.add_argument("--frame-format", choices=("rgb888", "rgb565", "webp"), default="rgb888",
+                        help="image format the clients ask for (rgb565 blurs the markers, so no latency)")
+    parser.add_argument("--broker", choices=("auto", "mosquitto", "inprocess"), default="auto")
+    parser.add_argument("--log-level", default="WARNING", help="log level of the publisher and clients")
+    parser.add_argument("--keep", action="store_true", help="keep the working directory")
+    parser.add_argument("-o", "--output", help="write results here instead of stdout")
+    args = parser.parse_args()
+
+    results = run(args)
+    if not args.keep:
+        shutil.rmtree(results.pop("workdir"), ignore_errors=True)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Minimal in-process MQTT 3.1.1 broker for benchmarks on hosts without mosquitto.
+
+Supports what AliByt uses: CONNECT, SUBSCRIBE with + and # wildcards, PUBLISH with
+retained messages, PINGREQ and DISCONNECT. Inbound QoS 1 publishes are acknowledged;
+everything is delivered to subscribers at QoS 0. No persistence, auth or sessions.
+
+    python3 broker.py [port]
+"""
+import asyncio
+import struct
+import sys
+import threading
+
+CONNECT, CONNACK, PUBLISH, PUBACK, SUBSCRIBE, SUBACK = 1, 2, 3, 4, 8, 9
+UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 10, 11, 12, 13, 14
+
+
+def topic_matches(pattern, topic):
+    pattern_parts = pattern.split("/")
+    topic_parts = topic.split("/")
+    for i, part in enumerate(pattern_parts):
+        if part == "#":
+            return True
+        if i >= len(topic_parts) or (part != "+" and part != topic_parts[i]):
+            return False
+    return len(pattern_parts) == len(topic_parts)
+
+
+def _remaining_length(length):
+    encoded = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        encoded.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(encoded)
+
+
+def _packet(kind, flags, body):
+    return bytes([(kind << 4) | flags]) + _remaining_length(len(body)) + body
+
+
+def _publish_packet(topic, payload, retain):
+    encoded = topic.encode("utf-8")
+    return _packet(PUBLISH, 1 if retain else 0, struct.pack("!H", len(encoded)) + encoded + payload)
+
+
+class Broker:
+    def __init__(self, host="127.0.0.1", port=1883):
+        self.host = host
+        self.port = port
+        self.retained = {}  # topic -> payload
+        self.sessions = {}  # writer -> set of subscription patterns
+        self.messages = 0
+        self._connections = {}  # writer -> handler task
+        self._server = None
+        self._loop = None
+        self._thread = None
+
+    async def _read_packet(self, reader):
+        header = await reader.readexactly(1)
+        multiplier, length = 1, 0
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length += (byte & 0x7F) * multiplier
+            if not byte & 0x80:
+                break
+            multiplier *= 128
+        body = await reader.readexactly(length) if length else b""
+        return header[0] >> 4, header[0] & 0x0F, body
+
+    def _deliver(self, topic, payload, retain=False):
+        packet = _publish_packet(topic, payload, retain)
+        for writer, patterns in list(self.sessions.items()):
+            if any(topic_matches(pattern, topic) for pattern in patterns):
+                writer.write(packet)
+
+    async def _handle(self, reader, writer):
+        patterns = set()
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                kind, flags, body = await self._read_packet(reader)
+                if kind == CONNECT:
+                    self.sessions[writer] = patterns
+                    writer.write(_packet(CONNACK, 0, b"\x00\x00"))
+                elif kind == PUBLISH:
+                    qos = (flags >> 1) & 0x03
+                    (topic_length,) = struct.unpack_from("!H", body)
+                    topic = body[2:2 + topic_length].decode("utf-8")
+                    offset = 2 + topic_length
+                    if qos:
+                        packet_id = body[offset:offset + 2]
+                        offset += 2
+                        writer.write(_packet(PUBACK, 0, packet_id))
+                    payload = body[offset:]
+                    if flags & 0x01:
+                        if payload:
+                            self.retained[topic] = payload
+                        else:
+                            self.retained.pop(topic, None)
+                    self.messages += 1
+                    self._deliver(topic, payload)
+                elif kind == SUBSCRIBE:
+                    packet_id, offset, granted = body[:2], 2, bytearray()
+                    new = []
+                    while offset < len(body):
+                        (length,) = struct.unpack_from("!H", body, offset)
+                        pattern = body[offset + 2:offset + 2 + length].decode("utf-8")
+                        offset += 3 + length  # Skip the requested QoS byte
+                        patterns.add(pattern)
+                        new.append(pattern)
+                        granted.append(0)
+                    writer.write(_packet(SUBACK, 0, packet_id + bytes(granted)))
+                    for topic, payload in list(self.retained.items()):
+                        if any(topic_matches(pattern, topic) for pattern in new):
+                            writer.write(_publish_packet(topic, payload, retain=True))
+                elif kind == UNSUBSCRIBE:
+                    packet_id, offset = body[:2], 2
+                    while offset < len(body):
+                        (length,) = struct.unpack_from("!H", body, offset)
+                        patterns.discard(body[offset + 2:offset + 2 + length].decode("utf-8"))
+                        offset += 2 + length
+                    writer.write(_packet(UNSUBACK, 0, packet_id))
+                elif kind == PINGREQ:
+                    writer.write(_packet(PINGRESP, 0, b""))
+                elif kind == DISCONNECT:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.sessions.pop(writer, None)
+            self._connections.pop(writer, None)
+            writer.close()
+
+    async def serve(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        async with self._server:
+            await self._server.serve_forever()
+
+    def start(self):
+        """Runs the broker on a background thread and returns once it is listening."""
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._server = self._loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+            ready.set()
+            self._loop.run_forever()
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="mqtt-broker", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    async def _shutdown(self):
+        self._server.close()
+        # Closing each connection ends its handler with an IncompleteReadError
+        tasks = list(self._connections.values())
+        for writer in list(self._connections):
+            writer.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(timeout=5)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+
+
+if __name__ == "__main__":
+    asyncio.run(Broker("0.0.0.0", int(sys.argv[1]) if len(sys.argv) > 1 else 1883).serve())
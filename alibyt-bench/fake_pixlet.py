@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Stand-in for the `pixlet` binary, for benchmarking without real apps or network access.
+
+    fake_pixlet.py render app.star [key=value ...] -o out.webp
+    fake_pixlet.py serve app.star --host 127.0.0.1 --port 8080
+
+Both emit 64x32 lossless WebPs whose first two pixels encode the app (a 24-bit hash of
+its name) and a render sequence number, so the stub rgbmatrix can tell which render is on
+screen. The third pixel holds the frame index, so the frames of an animation always differ
+and Pillow never merges them. Behaviour is set through the environment:
+
+    FAKE_PIXLET_FRAMES          frames per image (default 1; more makes an animated WebP)
+    FAKE_PIXLET_BYTES           approximate size of each image, reached with noise pixels
+    FAKE_PIXLET_DELAY           seconds each render takes (default 0.05)
+    FAKE_PIXLET_CHANGE_INTERVAL seconds an app's image stays the same (default 0: every render differs)
+    FAKE_PIXLET_STATIC          1 to keep each app's pixels fixed so only the marker pixels change,
+                                like a clock ticking
+    FAKE_PIXLET_LOG             file to append one JSON line per render to
+"""
+import json
+import os
+import random
+import sys
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qsl
+
+from PIL import Image
+
+WIDTH, HEIGHT = 64, 32
+FRAMES = int(os.environ.get("FAKE_PIXLET_FRAMES", 1))
+TARGET_BYTES = int(os.environ.get("FAKE_PIXLET_BYTES", 0))
+DELAY = float(os.environ.get("FAKE_PIXLET_DELAY", 0.05))
+CHANGE_INTERVAL = float(os.environ.get("FAKE_PIXLET_CHANGE_INTERVAL", 0))
+STATIC = os.environ.get("FAKE_PIXLET_STATIC") == "1"
+LOG_PATH = os.environ.get("FAKE_PIXLET_LOG")
+FRAME_DURATION = 100  # Milliseconds per animation frame
+
+
+def app_id(app_path):
+    """24-bit id of an app, from its file name; the benchmark uses the same function."""
+    name = os.path.splitext(os.path.basename(app_path))[0]
+    return zlib.crc32(name.encode("utf-8")) & 0xFFFFFF
+
+
+def _pixel(value):
+    return (value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF
+
+
+def render(app_path, config=None):
+    """Returns (WebP bytes, seq) for one render of an app."""
+    started = time.time()
+    time.sleep(DELAY)
+    if CHANGE_INTERVAL > 0:
+        seq = int(started // CHANGE_INTERVAL) & 0xFFFFFF
+    else:
+        seq = int(started * 1000) & 0xFFFFFF
+
+    # Same app and seq -> same image, so unchanged renders are byte-identical
+    rng = random.Random(f"{app_path}:{'' if STATIC else seq}:{sorted((config or {}).items())}")
+    # Each noise pixel costs roughly 3 bytes even losslessly
+    noise = min(WIDTH * HEIGHT - 3, TARGET_BYTES // (3 * FRAMES)) if TARGET_BYTES else 0
+    base = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+    frames = []
+    for index in range(FRAMES):
+        image = Image.new("RGB", (WIDTH, HEIGHT), base)
+        pixels = image.load()
+        for _ in range(noise):
+            pixels[rng.randrange(3, WIDTH), rng.randrange(HEIGHT)] = (
+                rng.randrange(256), rng.randrange(256), rng.randrange(256)
+            )
+        pixels[0, 0] = _pixel(app_id(app_path))
+        pixels[1, 0] = _pixel(seq)
+        pixels[2, 0] = _pixel(index)
+        frames.append(image)
+
+    out = BytesIO()
+    if len(frames) > 1:
+        frames[0].save(out, "WEBP", lossless=True, save_all=True, append_images=frames[1:],
+                       duration=FRAME_DURATION, loop=0)
+    else:
+        frames[0].save(out, "WEBP", lossless=True)
+    data = out.getvalue()
+
+    if LOG_PATH:
+        with open(LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "app": app_id(app_path), "seq": seq, "start": started,
+                "end": time.time(), "bytes": len(data),
+            }) + "\n")
+    return data, seq
+
+
+def cmd_render(args):
+    app_path = args[0]
+    output = args[args.index("-o") + 1]
+    config = dict(arg.split("=", 1) for arg in args[1:] if "=" in arg and not arg.startswith("-"))
+    data, _ = render(app_path, config)
+    with open(output, "wb") as f:
+        f.write(data)
+
+
+def cmd_serve(args):
+    app_path = args[0]
+    host = args[args.index("--host") + 1] if "--host" in args else "127.0.0.1"
+    port = int(args[args.index("--port") + 1]) if "--port" in args else 8080
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path, _, query = self.path.partition("?")
+            if path == "/api/v1/preview.webp":
+                body, _ = render(app_path, dict(parse_qsl(query)))
+                content_type = "image/webp"
+            elif path == "/":
+                body, content_type = b"ok", "text/plain"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    ThreadingHTTPServer((host, port), Handler).serve_forever()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ("render", "serve"):
+        sys.exit(__doc__)
+    {"render": cmd_render, "serve": cmd_serve}[sys.argv[1]](sys.argv[2:])
@@ -0,0 +1,128 @@
+"""Stand-in for the rgbmatrix bindings, for running the client without a panel.
+
+Records every frame swapped onto the "panel" instead of driving GPIO. Set
+ALIBYT_BENCH_FRAMES to a file path to get one JSON line per change of displayed image,
+{"t": unix time, "app": id, "seq": render id}, read from the marker pixels the fake pixlet
+draws, plus a summary line at exit with frame counts and inter-frame timing.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+
+FRAMES_PATH = os.environ.get("ALIBYT_BENCH_FRAMES")
+
+
+class RGBMatrixOptions:
+    def __init__(self):
+        self.rows = 32
+        self.cols = 32
+        self.chain_length = 1
+        self.parallel = 1
+        self.hardware_mapping = "regular"
+        self.gpio_slowdown = 1
+        self.brightness = 100
+        self.disable_hardware_pulsing = False
+
+
+class _Recorder:
+    """Counts swapped frames and logs whenever the marker pixels change."""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8") if path else None
+        self.frames = 0
+        self.changes = 0
+        self.first = None
+        self.last = None
+        self.max_gap = 0.0
+        self._marker = None
+        atexit.register(self.close)
+
+    def swapped(self, image):
+        now = time.time()
+        marker = read_marker(image)
+        with self._lock:
+            self.frames += 1
+            if self.last is not None:
+                self.max_gap = max(self.max_gap, now - self.last)
+            else:
+                self.first = now
+            self.last = now
+            if marker != self._marker:
+                self._marker = marker
+                self.changes += 1
+                if self._file and marker is not None:
+                    self._file.write(json.dumps({"t": now, "app": marker[0], "seq": marker[1]}) + "\n")
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            span = (self.last - self.first) if self.frames > 1 else 0.0
+            self._file.write(json.dumps({
+                "summary": True,
+                "frames": self.frames,
+                "changes": self.changes,
+                "fps": (self.frames - 1) / span if span else 0.0,
+                "max_gap": self.max_gap,
+            }) + "\n")
+            self._file.close()
+            self._file = None
+
+
+def read_marker(image):
+    """(app id, render seq) from the fake pixlet's marker pixels, or None for other images."""
+    if image is None or image.width < 2:
+        return None
+    app_pixel = image.getpixel((0, 0))
+    seq_pixel = image.getpixel((1, 0))
+    if not isinstance(app_pixel, tuple) or len(app_pixel) < 3:
+        return None
+    return (
+        (app_pixel[0] << 16) | (app_pixel[1] << 8) | app_pixel[2],
+        (seq_pixel[0] << 16) | (seq_pixel[1] << 8) | seq_pixel[2],
+    )
+
+
+recorder = _Recorder(FRAMES_PATH)
+
+
+class FrameCanvas:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.brightness = 100
+        self.image = None
+
+    def SetImage(self, image, offset_x=0, offset_y=0, unsafe=True):
+        self.image = image
+
+    def Clear(self):
+        self.image = None
+
+    def Fill(self, red, green, blue):
+        self.image = None
+
+    def SetPixel(self, x, y, red, green, blue):
+        pass
+
+
+class RGBMatrix(FrameCanvas):
+    def __init__(self, options=None):
+        options = options or RGBMatrixOptions()
+        super().__init__(options.cols * options.chain_length, options.rows * options.parallel)
+        self.brightness = options.brightness
+
+    def CreateFrameCanvas(self):
+        return FrameCanvas(self.width, self.height)
+
+    def SwapOnVSync(self, canvas, framerate_fraction=1):
+        recorder.swapped(canvas.image)
+        self.image = canvas.image
+        return FrameCanvas(self.width, self.height)
+
+    def SetImage(self, image, offset_x=0, offset_y=0, unsafe=True):
+        super().SetImage(image)
+        recorder.swapped(image)
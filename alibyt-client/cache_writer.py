@@ -0,0 +1,85 @@
+import logging
+import os
+import threading
+
+log = logging.getLogger(__name__)
+
+IMAGE_EXTENSION = ".webp"
+
+
+class CacheWriter:
+    """Persists images to the on-disk cache from a background thread.
+
+    Writes are coalesced per app: if an app is updated several times before the
+    writer gets to it, only the latest image is written. Files are replaced with
+    an atomic rename so a crash never leaves a half-written image behind.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self._pending = {}  # app -> bytes to write, or None to delete
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def path(self, app_name):
+        return os.path.join(self.cache_dir, f"{app_name}{IMAGE_EXTENSION}")
+
+    def write(self, app_name, image_data):
+        """Queues an image to be written; never blocks on disk."""
+        with self._cond:
+            self._pending[app_name] = image_data
+            self._cond.notify()
+
+    def delete(self, app_name):
+        """Queues an app's cached image for deletion."""
+        with self._cond:
+            self._pending[app_name] = None
+            self._cond.notify()
+
+    def load_all(self):
+        """Reads every cached image synchronously. Returns {app: bytes}; used at startup."""
+        images = {}
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith(IMAGE_EXTENSION):
+                continue
+            app_name = filename[:-len(IMAGE_EXTENSION)]
+            try:
+                with open(os.path.join(self.cache_dir, filename), "rb") as f:
+                    images[app_name] = f.read()
+            except OSError as e:
+                log.warning("Error reading cached image for %s: %s", app_name, e)
+        return images
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                batch = self._pending
+                self._pending = {}
+
+            for app_name, image_data in batch.items():
+                try:
+                    if image_data is None:
+                        self._remove(app_name)
+                    else:
+                        self._replace(app_name, image_data)
+                except OSError as e:
+                    log.error("Error persisting image for %s: %s", app_name, e)
+
+    def _replace(self, app_name, image_data):
+        path = self.path(app_name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(image_data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _remove(self, app_name):
+        try:
+            os.remove(self.path(app_name))
+        except FileNotFoundError:
+            pass
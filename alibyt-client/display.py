@@ -0,0 +1,91 @@
+import logging
+
+log = logging.getLogger("alibyt.display")
+
+# Panel geometry and wiring
+PANEL_ROWS = 32
+PANEL_COLS = 64
+CHAIN_LENGTH = 1
+HARDWARE_MAPPING = "adafruit-hat"
+GPIO_SLOWDOWN = 2
+
+
+class MatrixDisplay:
+    """The RGB LED panel, drawn through an offscreen canvas swapped in on vertical sync.
+
+    The rgbmatrix bindings are imported and the panel initialised on the first frame rather
+    than at startup, so loading the cache and connecting never wait on the hardware.
+    """
+
+    def __init__(self, rows=PANEL_ROWS, cols=PANEL_COLS, chain_length=CHAIN_LENGTH,
+                 hardware_mapping=HARDWARE_MAPPING, gpio_slowdown=GPIO_SLOWDOWN):
+        self.rows = rows
+        self.cols = cols
+        self.chain_length = chain_length
+        self.hardware_mapping = hardware_mapping
+        self.gpio_slowdown = gpio_slowdown
+        self.width = cols * chain_length
+        self.height = rows
+        self._matrix = None
+        self._offscreen = None
+
+    def open(self):
+        if self._matrix is not None:
+            return
+        from rgbmatrix import RGBMatrix, RGBMatrixOptions
+
+        options = RGBMatrixOptions()
+        options.rows = self.rows
+        options.cols = self.cols
+        options.chain_length = self.chain_length
+        options.hardware_mapping = self.hardware_mapping
+        options.gpio_slowdown = self.gpio_slowdown
+        self._matrix = RGBMatrix(options=options)
+        self._offscreen = self._matrix.CreateFrameCanvas()  # Back buffer for tear-free swaps
+        log.info("Initialised %dx%d panel", self.width, self.height)
+
+    def show(self, frame, brightness):
+        """Draws a frame on the offscreen canvas and swaps it in on the next vertical sync."""
+        if self._matrix is None:
+            self.open()
+        if self._offscreen.brightness != brightness:
+            self._offscreen.brightness = brightness  # Takes effect as the frame is drawn
+        self._offscreen.SetImage(frame)
+        self._offscreen = self._matrix.SwapOnVSync(self._offscreen)
+
+    def close(self):
+        if self._matrix is not None:
+            self._matrix.Clear()
+
+
+class HeadlessDisplay:
+    """Keeps the last frame in memory instead of driving a panel, for tests and benchmarks."""
+
+    def __init__(self, width=PANEL_COLS * CHAIN_LENGTH, height=PANEL_ROWS):
+        self.width = width
+        self.height = height
+        self.frame = None
+        self.brightness = None
+        self.frames = 0
+
+    def open(self):
+        pass
+
+    def show(self, frame, brightness):
+        self.frame = frame
+        self.brightness = brightness
+        self.frames += 1
+
+    def close(self):
+        pass
+
+
+BACKENDS = {"matrix": MatrixDisplay, "headless": HeadlessDisplay}
+
+
+def create_display(name):
+    """Returns the display backend called `name`: "matrix" or "headless"."""
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown display {name!r}; expected one of {', '.join(BACKENDS)}") from None
@@ -0,0 +1,90 @@
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from PIL import Image, ImageSequence
+import raw_frames
+
+DEFAULT_FRAME_DURATION = 100  # Milliseconds, used when a frame carries no duration
+
+
+class FrameSet:
+    """Decoded, display-sized RGB frames of one app with their durations in milliseconds.
+
+    `brightness_applied` is set for raw bundles, whose app brightness the server already applied.
+    """
+
+    def __init__(self, frames, durations, digest=None, brightness_applied=False):
+        self.frames = frames
+        self.durations = durations
+        self.digest = digest
+        self.brightness_applied = brightness_applied
+        self.nbytes = sum(len(frame.mode) * frame.width * frame.height for frame in frames)
+
+    @property
+    def animated(self):
+        return len(self.frames) > 1
+
+
+def decode_frames(image_data, size, digest=None):
+    """Decodes WebP bytes or a raw frame bundle once into RGB frames resized to the panel."""
+    if raw_frames.is_bundle(image_data):
+        return unpack_raw_frames(image_data, size, digest)
+    image = Image.open(BytesIO(image_data))
+    frames = []
+    durations = []
+    for frame in ImageSequence.Iterator(image):
+        rgb = frame.convert("RGB")
+        if rgb.size != size:
+            rgb = rgb.resize(size)
+        frames.append(rgb)
+        durations.append(frame.info.get("duration") or DEFAULT_FRAME_DURATION)
+    return FrameSet(frames, durations, digest)
+
+
+def unpack_raw_frames(bundle, size, digest=None):
+    """Builds frames straight from a raw bundle's pixel buffers; no image codec runs. Bundles
+    are made for the panel size the client advertises, so resizing is only a fallback."""
+    bundle_size, raw_mode, durations, pixels = raw_frames.decode(bundle)
+    frames = []
+    for buffer in pixels:
+        frame = Image.frombuffer("RGB", bundle_size, buffer, "raw", raw_mode, 0, 1)
+        if bundle_size != size:
+            frame = frame.resize(size)
+        frames.append(frame)
+    return FrameSet(frames, durations, digest, brightness_applied=True)
+
+
+class FrameCache:
+    """LRU of decoded frame sets, bounded by the total size of their pixel buffers."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._sets = OrderedDict()  # app -> FrameSet, least recently used first
+        self._lock = threading.Lock()
+
+    def put(self, app_name, frame_set):
+        with self._lock:
+            old = self._sets.pop(app_name, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._sets[app_name] = frame_set
+            self.nbytes += frame_set.nbytes
+
+            # Evict least recently shown apps; they are decoded again from disk if needed
+            while self.nbytes > self.max_bytes and len(self._sets) > 1:
+                _, evicted = self._sets.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def get(self, app_name):
+        with self._lock:
+            frame_set = self._sets.get(app_name)
+            if frame_set is not None:
+                self._sets.move_to_end(app_name)
+            return frame_set
+
+    def remove(self, app_name):
+        with self._lock:
+            frame_set = self._sets.pop(app_name, None)
+            if frame_set is not None:
+                self.nbytes -= frame_set.nbytes
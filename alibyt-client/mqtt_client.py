@@ -1,129 +1,413 @@
+import asyncio
 import json
+import logging
 import os
 import time
 import base64
+from concurrent.futures import ThreadPoolExecutor
 import paho.mqtt.client as mqtt
-from io import BytesIO
-from PIL import Image, ImageSequence
-from rgbmatrix import RGBMatrix, RGBMatrixOptions
+import payload
+import raw_frames
+from cache_writer import CacheWriter
+from display import create_display
+from frame_cache import FrameCache, decode_frames
+from mqtt_loop import MqttLoop
+from rotation import Rotation
+
+# One event loop owns the MQTT connection, the rotation, the frame cache and the display clock.
+# Images are decoded on a worker thread and written to disk by CacheWriter's thread.
+STARTED = time.monotonic()
+
+# Logging; set ALIBYT_LOG_LEVEL=DEBUG to see every slot
+LOG_LEVEL = os.environ.get("ALIBYT_LOG_LEVEL", "INFO")
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+log = logging.getLogger("alibyt.client")
 
 # MQTT Setup
-MQTT_BROKER = "192.168.2.48"
-MQTT_TOPIC = "alibyt/images"
-
-# Matrix Setup
-options = RGBMatrixOptions()
-options.rows = 32
-options.cols = 64
-options.chain_length = 1
-options.hardware_mapping = 'adafruit-hat'
-options.gpio_slowdown = 2
-matrix = RGBMatrix(options=options)
+MQTT_BROKER = os.environ.get("ALIBYT_MQTT_BROKER", "192.168.2.48")
+MQTT_PORT = int(os.environ.get("ALIBYT_MQTT_PORT", 1883))
+MQTT_TOPIC = "alibyt/images"  # Legacy JSON images and control messages
+DEVICE_ID = os.environ.get("ALIBYT_DEVICE_ID", "default")  # Registered with the server's /devices endpoint; "default" uses the original topics
+IMAGE_TOPIC_PREFIX = payload.TOPIC_PREFIX if DEVICE_ID == "default" else f"alibyt/{DEVICE_ID}/images/"
+BINARY_TOPIC = f"{IMAGE_TOPIC_PREFIX}+"  # Per-app binary images for this device, retained by the broker
+# Updates while connected, deltas included; the retained images above are only read on (re)connect
+LIVE_TOPIC_PREFIX = f"alibyt/{DEVICE_ID}/live/"
+LIVE_TOPIC = f"{LIVE_TOPIC_PREFIX}+"
+STATUS_TOPIC = f"alibyt/{DEVICE_ID}/status"  # Rotation position, published at every slot for just-in-time rendering
+STATUS_UPCOMING = 32  # Most upcoming apps reported per status message
+STATS_TOPIC = f"alibyt/{DEVICE_ID}/stats"  # Compact playback stats, collected by the server's /metrics
+CAPABILITIES_TOPIC = f"alibyt/{DEVICE_ID}/capabilities"  # Retained frame formats this client accepts
+KEYFRAME_TOPIC = f"alibyt/{DEVICE_ID}/keyframe"  # Asks for an app's whole image when a delta can't be applied
+CONTROL_TOPIC = f"alibyt/{DEVICE_ID}/control"  # Retained device settings: speed and brightness
+MANIFEST_TOPIC = f"alibyt/{DEVICE_ID}/manifest"  # Retained list of this device's apps; others are pruned
+APP_CONTROL_TOPICS = "alibyt/apps/+/control"  # Retained per-app settings: brightness
+# Preferred image format: rgb888 or rgb565 frames already sized for the panel, or webp to decode locally
+FRAME_FORMAT = os.environ.get("ALIBYT_FRAME_FORMAT", "rgb888")
+
+# Display: "matrix" drives the LED panel, initialised when the first frame is shown;
+# "headless" keeps frames in memory for tests and benchmarks
+display = create_display(os.environ.get("ALIBYT_DISPLAY", "matrix"))
 
 # Image Storage
-CACHE_DIR = "/home/aalibh4/alibyt-client/image_cache"
-os.makedirs(CACHE_DIR, exist_ok=True)  # Ensure cache directory exists
+CACHE_DIR = os.environ.get("ALIBYT_CACHE_DIR", "/home/aalibh4/alibyt-client/image_cache")
+cache_writer = CacheWriter(CACHE_DIR)  # Persists images off the event loop
 
-# Image Queue (Dictionary for easy replacement)
-image_queue = {}
+# Rotation of apps with their raw image bytes, kept in memory
+STALE_TTL = None  # Seconds without an update before an app is skipped; None keeps apps indefinitely,
+                  # since the publisher does not resend renders that have not changed
+rotation = Rotation(ttl=STALE_TTL)
 current_image = None  # Track the currently displayed app
-display_speed = 5  # Default 5 seconds per image
+display_speed = float(os.environ.get("ALIBYT_DISPLAY_SPEED", 5))  # Default 5 seconds per image
+
+# Brightness (0-100) from control messages, set on the canvas as each frame is drawn so changes
+# never re-initialise the panel or decode images again. App brightness scales the device's.
+device_brightness = 100
+app_brightness = {}  # app -> brightness, for apps with their own setting
+FRAME_CACHE_BYTES = 16 * 1024 * 1024  # Budget for decoded frames (a 64x32 RGB frame is 6 KiB)
+frame_cache = FrameCache(FRAME_CACHE_BYTES)
+decoder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="decode")  # Keeps decodes off the display clock
+pending_images = {}  # app -> newest image still being decoded; older decodes that finish later are dropped
+images_arrived = None  # asyncio.Event made in main(); wakes the display loop when an image arrives for an empty queue
+
+# Playback timing
+LATE_FRAME_TOLERANCE = 0.010  # Seconds a frame may be shown after its due time before it counts as late
+STATS_INTERVAL = float(os.environ.get("ALIBYT_STATS_INTERVAL", 60))  # Seconds between playback stats reports
+first_frame_s = None  # Seconds from start until the first frame was on screen
+# Totals since start, except decode_max_s which covers one report interval
+playback_stats = {"frames": 0, "late": 0, "dropped": 0, "decodes": 0, "decode_s": 0.0, "decode_max_s": 0.0}
+
+images_subscription = None  # Message id of the retained image subscription made on connect
+binary_seen = False  # Set once the publisher sends binary messages; legacy JSON images are then ignored
+background_tasks = set()  # Strong references, so pending tasks aren't garbage collected
 
-def get_cached_path(app_name):
-    """Returns the local path where the image for a given app should be stored."""
-    return os.path.join(CACHE_DIR, f"{app_name}.webp")
+def spawn(coro):
+    task = asyncio.get_running_loop().create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
 
-def save_image(image_data, app_name):
-    """Decodes and saves Base64 image data only if it's new."""
-    local_path = get_cached_path(app_name)
+def timed_decode(image_data, digest=None):
+    """Decodes an image into frames for the display. Runs on the decoder thread."""
+    started = time.perf_counter()
+    frame_set = decode_frames(image_data, (display.width, display.height), digest)
+    return frame_set, time.perf_counter() - started
+
+async def decode(image_data, digest=None):
+    """Decodes an image on the decoder thread, counting the time it takes."""
+    frame_set, elapsed = await asyncio.get_running_loop().run_in_executor(decoder, timed_decode, image_data, digest)
+    playback_stats["decodes"] += 1
+    playback_stats["decode_s"] += elapsed
+    playback_stats["decode_max_s"] = max(playback_stats["decode_max_s"], elapsed)
+    return frame_set
+
+async def store_image(app_name, image_data, digest=None):
+    """Decodes an app's new image once and swaps it into the queue, so its slot is only a buffer swap."""
+    pending_images[app_name] = image_data
     try:
-        with open(local_path, "wb") as f:
-            f.write(image_data)
-        return local_path
+        frame_set = await decode(image_data, digest)
     except Exception as e:
-        print(f"Error saving image for {app_name}: {e}")
-        return None
+        log.error("Error decoding image for %s: %s", app_name, e)
+        frame_set = None
+    if pending_images.get(app_name) is not image_data:
+        return  # A newer image arrived, or the app was removed, while this one was decoding
+    del pending_images[app_name]
+    if frame_set is None:
+        return
+
+    frame_cache.put(app_name, frame_set)
+    rotation.put(app_name, image_data, digest)
+    cache_writer.write(app_name, image_data)  # Coalesced and written in the background
+    images_arrived.set()
+    log.info("Updated queue: %s (%d frames)", app_name, len(frame_set.frames))
+
+def latest_image(app_name):
+    """The newest image received for an app, even if it is still being decoded."""
+    if app_name in pending_images:
+        return pending_images[app_name]
+    entry = rotation.get(app_name)
+    return entry.image_data if entry else None
+
+def remove_image(app_name):
+    """Drops an app from the queue and deletes its cached image."""
+    pending_images.pop(app_name, None)
+    rotation.remove(app_name)
+    frame_cache.remove(app_name)
+    cache_writer.delete(app_name)
+    log.info("Removed %s from queue", app_name)
+
+def warm_load_cache():
+    """Queues images persisted by a previous run so content shows before the broker connects.
+    Only reads files; each image is decoded when its slot first comes up."""
+    for app_name, image_data in cache_writer.load_all().items():
+        rotation.put(app_name, image_data)
+    log.info("Warm-loaded %d apps from %s", len(rotation), CACHE_DIR)
+
+def apply_settings(settings, app_name=None):
+    """Applies a control message: speed and brightness for the device, or brightness for one app.
+
+    Also accepts the legacy {"type": "update_speed"} and {"type": "brightness"} messages.
+    """
+    global display_speed, device_brightness
+    if app_name is not None:
+        if settings.get("brightness") is None:
+            app_brightness.pop(app_name, None)
+        else:
+            app_brightness[app_name] = int(settings["brightness"])
+        log.info("Settings for %s: brightness %s", app_name, app_brightness.get(app_name))
+        return
+    if settings.get("speed") is not None:
+        display_speed = float(settings["speed"])
+    if settings.get("brightness") is not None:
+        device_brightness = int(settings["brightness"])
+    log.info("Settings: %ss per app, brightness %d", display_speed, device_brightness)
+
+def on_manifest_message(message):
+    """Drops apps the device is no longer subscribed to, such as ones warm-loaded from the disk cache
+    after being cleared while this client was offline."""
+    if not message.payload:
+        return
+    try:
+        subscribed = set(json.loads(message.payload)["apps"])
+    except (ValueError, KeyError, TypeError) as e:
+        log.error("Ignoring bad manifest: %s", e)
+        return
+    held = {entry.app_name for entry in rotation.snapshot()} | set(pending_images)
+    for app_name in held - subscribed:
+        remove_image(app_name)
+
+def on_control_message(message):
+    """Handles a retained settings message for the device or one app."""
+    if not message.payload:
+        return
+    try:
+        settings = json.loads(message.payload)
+        if message.topic == CONTROL_TOPIC:
+            apply_settings(settings)
+        else:
+            apply_settings(settings, message.topic.split("/")[2])
+    except (ValueError, TypeError, AttributeError) as e:
+        log.error("Error applying settings from %s: %s", message.topic, e)
+
+def on_binary_message(message, topic_prefix):
+    """Handles a binary image message from a per-app image or live topic."""
+    global binary_seen
+    if not message.payload:
+        # An empty message means the app was unsubscribed
+        remove_image(message.topic[len(topic_prefix):])
+        return
+
+    try:
+        app_name, image_data, digest, frames, flags = payload.decode(message.payload)
+    except ValueError as e:
+        log.error("Error decoding binary message on %s: %s", message.topic, e)
+        return
+
+    binary_seen = True
+    if flags & payload.FLAG_DELTA:
+        current = latest_image(app_name)
+        if raw_frames.is_target(image_data, current):
+            return  # Already have its result, e.g. from the retained image after a reconnect
+        try:
+            image_data = raw_frames.apply(image_data, current)
+        except ValueError as e:
+            log.info("Requesting keyframe for %s: %s", app_name, e)
+            client.publish(KEYFRAME_TOPIC, json.dumps({"app": app_name}), qos=1)
+            return
+    spawn(store_image(app_name, image_data, digest))
 
 def on_message(client, userdata, message):
     """Handles incoming MQTT messages and updates the image queue."""
-    global image_queue
+    if message.topic.startswith(LIVE_TOPIC_PREFIX):
+        on_binary_message(message, LIVE_TOPIC_PREFIX)
+        return
+    if message.topic.startswith(IMAGE_TOPIC_PREFIX):
+        on_binary_message(message, IMAGE_TOPIC_PREFIX)
+        return
+    if message.topic.endswith("/control"):
+        on_control_message(message)
+        return
+    if message.topic == MANIFEST_TOPIC:
+        on_manifest_message(message)
+        return
+
     try:
         data = json.loads(message.payload)
+        if data.get("type") in ("update_speed", "brightness"):
+            apply_settings(data)
+            return
         app_name = data.get("app")
         image_data = data.get("image_data")
-        delete_old = data.get("delete_old", False)
         
         if app_name and image_data:
+            if binary_seen:
+                return  # Publisher also sends this image on its binary topic
             try:
                 decoded_data = base64.b64decode(image_data)
             except Exception as e:
-                print(f"Error decoding Base64 image for {app_name}: {e}")
+                log.error("Error decoding Base64 image for %s: %s", app_name, e)
                 return
             
-            # Replace or delete existing image
-            if delete_old and app_name in image_queue:
-                try:
-                    os.remove(get_cached_path(app_name))  # Delete old file
-                    print(f"Deleted old image for {app_name}")
-                except FileNotFoundError:
-                    print(f"Old image for {app_name} not found, skipping delete.")
-                except Exception as e:
-                    print(f"Error deleting old image for {app_name}: {e}")
-            
-            # Store new image
-            local_path = save_image(decoded_data, app_name)
-            if local_path:
-                image_queue[app_name] = local_path
-                print(f"Updated queue: {app_name} -> {local_path}")
+            spawn(store_image(app_name, decoded_data))
         else:
-            print("Invalid app name or image data received.")
+            log.warning("Invalid app name or image data received")
     except json.JSONDecodeError as e:
-        print(f"Error decoding JSON: {e}")
+        log.error("Error decoding JSON: %s", e)
+
+def on_connect(client, userdata, flags, rc):
+    """Subscribes on every (re)connect; the broker then replays each app's retained image."""
+    global images_subscription
+    client.publish(CAPABILITIES_TOPIC, json.dumps({
+        "formats": [FRAME_FORMAT, "webp"] if FRAME_FORMAT in raw_frames.FORMATS else ["webp"],
+        "delta": True,
+        "stream": True,
+        "width": display.width,
+        "height": display.height,
+    }), qos=1, retain=True)
+    client.subscribe([(MQTT_TOPIC, 0), (LIVE_TOPIC, 1), (CONTROL_TOPIC, 1), (APP_CONTROL_TOPICS, 1), (MANIFEST_TOPIC, 1)])
+    _, images_subscription = client.subscribe(BINARY_TOPIC, 1)
+
+def on_subscribe(client, userdata, mid, granted_qos):
+    """Drops the retained image subscription once the broker has queued its replay; from then on
+    updates arrive on the live topic, so full copies of each change aren't received twice."""
+    if mid == images_subscription:
+        client.unsubscribe(BINARY_TOPIC)
 
-# MQTT Client Setup
+# MQTT Client Setup; driven by the event loop in main()
 client = mqtt.Client()
+client.on_connect = on_connect
+client.on_subscribe = on_subscribe
 client.on_message = on_message
-client.connect(MQTT_BROKER)
-client.subscribe(MQTT_TOPIC)
-client.loop_start()
 
-def display_images():
-    """Loops through image queue and displays them, handling animated WebP images."""
+async def get_frames(app_name, image_data):
+    """Returns the decoded frames for an app, decoding only if they were evicted or never decoded."""
+    frame_set = frame_cache.get(app_name)
+    if frame_set is None:
+        frame_set = await decode(image_data)
+        entry = rotation.get(app_name)
+        if entry is not None and entry.image_data is image_data:  # Not replaced meanwhile
+            frame_cache.put(app_name, frame_set)
+    return frame_set
+
+def slot_brightness(app_name, frame_set):
+    """Panel brightness for an app: the device's, scaled by the app's own unless the server
+    already applied that to the frames."""
+    if frame_set.brightness_applied:
+        return device_brightness
+    return device_brightness * app_brightness.get(app_name, 100) // 100
+
+def show_frame(frame, brightness):
+    """Puts a frame on the display, noting how long after start the first one took."""
+    global first_frame_s
+    display.show(frame, brightness)
+    if first_frame_s is None:
+        first_frame_s = time.monotonic() - STARTED
+        log.info("First frame on screen %.0f ms after start", first_frame_s * 1000)
+
+async def play_frames(frame_set, dwell, brightness=100):
+    """Plays a frame set against the monotonic clock using its native frame durations.
+
+    Static images stay up for `dwell` seconds. Animations play at least one full pass and
+    keep looping until `dwell` has elapsed. A frame whose whole slot has already passed is
+    dropped rather than shown late, so time spent blitting never stretches the animation.
+    """
+    start = time.monotonic()
+
+    if not frame_set.animated:
+        show_frame(frame_set.frames[0], brightness)
+        playback_stats["frames"] += 1
+        remaining = start + dwell - time.monotonic()
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+        return
+
+    due = start
+    while True:
+        for frame, duration in zip(frame_set.frames, frame_set.durations):
+            frame_end = due + duration / 1000
+            now = time.monotonic()
+            if now >= frame_end:
+                playback_stats["dropped"] += 1
+            else:
+                if now - due > LATE_FRAME_TOLERANCE:
+                    playback_stats["late"] += 1
+                show_frame(frame, brightness)
+                playback_stats["frames"] += 1
+                remaining = frame_end - time.monotonic()
+                if remaining > 0:
+                    await asyncio.sleep(remaining)
+            due = frame_end
+        if due - start >= dwell:
+            break
+
+def report_playback_stats():
+    """Logs the playback counters and publishes them, with queue size, for fleet monitoring."""
+    stats = dict(
+        {key: round(value, 4) for key, value in playback_stats.items()},
+        uptime=round(time.monotonic() - STARTED),
+        queue=len(rotation),
+        cache_bytes=frame_cache.nbytes,
+        first_frame_s=round(first_frame_s, 4) if first_frame_s is not None else None,
+    )
+    log.info(
+        "Playback: %d frames shown, %d late, %d dropped, %d decodes (max %.1f ms), %d apps queued",
+        stats["frames"], stats["late"], stats["dropped"], stats["decodes"],
+        stats["decode_max_s"] * 1000, stats["queue"],
+    )
+    client.publish(STATS_TOPIC, json.dumps(stats, separators=(",", ":")))
+    playback_stats["decode_max_s"] = 0.0
+
+def report_status(app_name):
+    """Tells the publisher which app just started and which come next, so it renders them just in time."""
+    client.publish(STATUS_TOPIC, json.dumps({
+        "app": app_name,
+        "upcoming": rotation.upcoming(STATUS_UPCOMING),
+        "cycle": rotation.cycle_length(),  # Longer than "upcoming" when the list is truncated
+        "dwell": display_speed,
+    }))
+
+async def display_images():
+    """Shows apps in rotation order from the decoded frame cache."""
     global current_image
     while True:
-        if image_queue:
-            app_names = list(image_queue.keys())  # Get the list of apps in queue
-            for app_name in app_names:
-                image_path = image_queue[app_name]
-                print(f"Displaying Image for {app_name}: {image_path}")
-                try:
-                    image = Image.open(image_path)  # Load image from cache
-                    
-                    # Check if image is animated
-                    if getattr(image, "is_animated", False):
-                        total_frames = image.n_frames
-                        frame_delay = display_speed / total_frames  # Frame timing
-                        print(f"Animated WebP detected: {total_frames} frames, {frame_delay:.2f}s per frame.")
-                        for frame in ImageSequence.Iterator(image):
-                            frame = frame.convert("RGB").resize((matrix.width, matrix.height))
-                            matrix.SetImage(frame)
-                            time.sleep(frame_delay)  # Control animation speed
-                        print(f"Finished animation for {image_path}, moving to next image.")
-                    else:
-                        # Display static image
-                        image = image.convert("RGB").resize((matrix.width, matrix.height))
-                        matrix.SetImage(image)
-                        print(f"Successfully displayed: {image_path}")
-                        time.sleep(display_speed)  # Sleep only for static images
-                except Exception as e:
-                    print(f"Error displaying image: {e}")
-                    del image_queue[app_name]  # Remove invalid images
-        else:
-            print("Image queue is empty!")
-            time.sleep(1)  # Prevents excessive CPU usage
+        entry = rotation.next()
+        if entry is None:
+            log.debug("Image queue is empty!")
+            images_arrived.clear()
+            try:
+                await asyncio.wait_for(images_arrived.wait(), 1)  # Stale apps come back on their own
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        current_image = entry.app_name
+        log.debug("Displaying image for %s", entry.app_name)
+        report_status(entry.app_name)
+        try:
+            frame_set = await get_frames(entry.app_name, entry.image_data)
+            await play_frames(frame_set, display_speed, slot_brightness(entry.app_name, frame_set))
+        except Exception as e:
+            log.error("Error displaying %s: %s", entry.app_name, e)
+            rotation.remove(entry.app_name)  # Remove invalid images
+            frame_cache.remove(entry.app_name)
+
+async def report_stats():
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        report_playback_stats()
+
+async def main():
+    global images_arrived
+    # Created here rather than at import: before Python 3.10 an Event binds to the loop current
+    # at creation, which is not the one asyncio.run() starts
+    images_arrived = asyncio.Event()
+    # The first frame comes from the disk cache; the broker connects alongside it
+    warm_load_cache()
+    mqtt_loop = MqttLoop(asyncio.get_running_loop(), client)
+    await asyncio.gather(display_images(), mqtt_loop.run(MQTT_BROKER, MQTT_PORT), report_stats())
 
-# Start Image Display Loop
 try:
-    display_images()
+    asyncio.run(main())
 except KeyboardInterrupt:
-    print("Exiting MQTT client...")
+    log.info("Exiting MQTT client...")
+finally:
+    display.close()
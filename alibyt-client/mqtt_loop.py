@@ -0,0 +1,97 @@
+import asyncio
+import logging
+
+log = logging.getLogger("alibyt.mqtt")
+
+RECONNECT_MIN = 1  # Seconds before the first reconnect attempt; doubles per failure
+RECONNECT_MAX = 60
+MISC_INTERVAL = 1  # Seconds between keepalive checks
+
+
+class MqttLoop:
+    """Runs a paho client on an asyncio event loop instead of paho's own network thread.
+
+    The loop watches the client's socket and calls paho's read and write handlers when it is
+    ready, so message callbacks run on the event loop alongside the display. Connecting can
+    block on DNS and TCP, so it runs in an executor thread and the socket callbacks it
+    triggers are handed back to the loop.
+    """
+
+    def __init__(self, loop, client):
+        self.loop = loop
+        self.client = client
+        self._fd = None
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def _call_in_loop(self, callback, *args):
+        try:
+            in_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def _watch(self, fd):
+        self._fd = fd
+        self.loop.add_reader(fd, self.client.loop_read)
+
+    def _unwatch(self, fd):
+        if fd == self._fd:
+            self.loop.remove_reader(fd)
+            self.loop.remove_writer(fd)
+            self._fd = None
+
+    def _set_writing(self, fd, writing):
+        if fd != self._fd:
+            return
+        if writing:
+            self.loop.add_writer(fd, self.client.loop_write)
+        else:
+            self.loop.remove_writer(fd)
+
+    # Paho calls these just before the socket is closed, so its descriptor is still valid
+    def _on_socket_open(self, client, userdata, sock):
+        self._call_in_loop(self._watch, sock.fileno())
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._call_in_loop(self._unwatch, sock.fileno())
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._call_in_loop(self._set_writing, sock.fileno(), True)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._call_in_loop(self._set_writing, sock.fileno(), False)
+
+    async def run(self, host, port, keepalive=60):
+        """Connects, then keeps the connection alive and reconnects with backoff whenever it drops."""
+        self.client.connect_async(host, port, keepalive)
+        delay = RECONNECT_MIN
+        try:
+            while True:
+                if self.client.socket() is None:
+                    try:
+                        await self.loop.run_in_executor(None, self.client.reconnect)
+                        delay = RECONNECT_MIN
+                    except OSError as e:
+                        log.warning("Could not connect to %s:%d, retrying in %ds: %s", host, port, delay, e)
+                        await asyncio.sleep(delay)
+                        delay = min(delay * 2, RECONNECT_MAX)
+                        continue
+                self.client.loop_misc()
+                await asyncio.sleep(MISC_INTERVAL)
+        finally:
+            self.detach()
+
+    def detach(self):
+        """Stops watching the client's socket, e.g. before the event loop closes at shutdown."""
+        if self._fd is not None:
+            self._unwatch(self._fd)
+        self.client.on_socket_open = None
+        self.client.on_socket_close = None
+        self.client.on_socket_register_write = None
+        self.client.on_socket_unregister_write = None
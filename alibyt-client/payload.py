@@ -0,0 +1,29 @@
+"""Decoder for the binary image messages built by alibyt-server/payload.py.
+
+See that module for the header layout.
+"""
+import struct
+
+MAGIC = b"ABYT"
+PROTOCOL_VERSION = 1
+HEADER = struct.Struct("!4sBBHB16s")
+
+# Header flags
+FLAG_DELETE_OLD = 0x01
+FLAG_DELTA = 0x02
+
+TOPIC_PREFIX = "alibyt/images/"  # Retained per-app image topics
+
+
+def decode(message):
+    """Parses a binary message into (app_name, body, digest, frames, flags)."""
+    if len(message) < HEADER.size:
+        raise ValueError("Message shorter than header")
+    magic, version, flags, frames, app_len, digest = HEADER.unpack_from(message)
+    if magic != MAGIC:
+        raise ValueError("Bad magic")
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported protocol version {version}")
+    start = HEADER.size + app_len
+    app_name = bytes(message[HEADER.size:start]).decode("utf-8")
+    return app_name, message[start:], digest.hex(), frames, flags
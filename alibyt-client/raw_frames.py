@@ -0,0 +1,104 @@
+"""Decoder for the display-native frame bundles and deltas built by alibyt-server/raw_frames.py.
+
+See that module for the layouts.
+"""
+import hashlib
+import struct
+import zlib
+
+MAGIC = b"ABRF"
+HEADER = struct.Struct("!4sBBHHH")
+DELTA_MAGIC = b"ABRD"
+DELTA_HEADER = struct.Struct("!4s16s16s")
+
+# Pixel formats, with the bytes per pixel and Pillow raw mode that unpacks them to RGB
+FORMAT_RGB888 = 1
+FORMAT_RGB565 = 2
+PIXEL_LAYOUTS = {FORMAT_RGB888: (3, "RGB"), FORMAT_RGB565: (2, "BGR;16")}
+FORMATS = {"rgb888": FORMAT_RGB888, "rgb565": FORMAT_RGB565}
+
+# Pixel data codecs
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+
+
+def is_bundle(data):
+    return data[:4] == MAGIC
+
+
+def _unpack(bundle):
+    """Parses a bundle into (format code, size, durations, uncompressed pixel bytes)."""
+    magic, code, codec, width, height, count = HEADER.unpack_from(bundle)
+    if magic != MAGIC:
+        raise ValueError("Not a raw frame bundle")
+    durations = list(struct.unpack_from(f"!{count}H", bundle, HEADER.size))
+    pixels = bundle[HEADER.size + 2 * count:]
+    if codec == CODEC_ZLIB:
+        pixels = zlib.decompress(pixels)
+    elif codec != CODEC_NONE:
+        raise ValueError(f"Unsupported codec {codec}")
+    return code, (width, height), durations, bytes(pixels)
+
+
+def _frames_digest(code, size, durations, pixels):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(struct.pack(f"!BHHH{len(durations)}H", code, size[0], size[1], len(durations), *durations))
+    h.update(pixels)
+    return h.digest()
+
+
+def apply(delta, base):
+    """Applies a delta to the bundle it was made against and returns the resulting bundle,
+    uncompressed so it decodes without copying. Raises ValueError if `base` is not the bundle
+    the delta expects or the result doesn't match, in which case a keyframe is needed."""
+    if base is None or len(delta) < DELTA_HEADER.size or len(base) < HEADER.size:
+        raise ValueError("No bundle to apply the delta to")
+    magic, base_digest, target_digest = DELTA_HEADER.unpack_from(delta)
+    if magic != DELTA_MAGIC:
+        raise ValueError("Not a raw frame delta")
+    base_code, base_size, base_durations, base_pixels = _unpack(base)
+    if _frames_digest(base_code, base_size, base_durations, base_pixels) != base_digest:
+        raise ValueError("Delta was made against a different bundle")
+
+    code, size, durations, xor = _unpack(delta[DELTA_HEADER.size:])
+    if len(xor) != len(base_pixels):
+        raise ValueError("Delta does not match the bundle size")
+    pixels = (int.from_bytes(base_pixels, "little") ^ int.from_bytes(xor, "little")).to_bytes(len(xor), "little")
+    if _frames_digest(code, size, durations, pixels) != target_digest:
+        raise ValueError("Delta result does not match its digest")
+    header = HEADER.pack(MAGIC, code, CODEC_NONE, size[0], size[1], len(durations))
+    return header + struct.pack(f"!{len(durations)}H", *durations) + pixels
+
+
+def is_target(delta, bundle):
+    """True if `bundle` already is the result of `delta`, so there is nothing to apply."""
+    if bundle is None or len(delta) < DELTA_HEADER.size or not is_bundle(bundle):
+        return False
+    try:
+        return _frames_digest(*_unpack(bundle)) == DELTA_HEADER.unpack_from(delta)[2]
+    except (ValueError, struct.error, zlib.error):
+        return False
+
+
+def decode(data):
+    """Parses a bundle into (size, raw mode, durations, one memoryview of pixels per frame)."""
+    if len(data) < HEADER.size:
+        raise ValueError("Bundle shorter than header")
+    magic, frame_format, codec, width, height, count = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Bad magic")
+    if frame_format not in PIXEL_LAYOUTS:
+        raise ValueError(f"Unsupported frame format {frame_format}")
+    durations = list(struct.unpack_from(f"!{count}H", data, HEADER.size))
+    pixels = memoryview(data)[HEADER.size + 2 * count:]
+    if codec == CODEC_ZLIB:
+        pixels = memoryview(zlib.decompress(pixels))
+    elif codec != CODEC_NONE:
+        raise ValueError(f"Unsupported codec {codec}")
+
+    pixel_bytes, raw_mode = PIXEL_LAYOUTS[frame_format]
+    frame_bytes = width * height * pixel_bytes
+    if len(pixels) != frame_bytes * count:
+        raise ValueError("Pixel data does not match the header")
+    frames = [pixels[i * frame_bytes:(i + 1) * frame_bytes] for i in range(count)]
+    return (width, height), raw_mode, durations, frames
@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import namedtuple
+
+# One app in the rotation. Entries are immutable; updates replace them.
+RotationEntry = namedtuple("RotationEntry", ["app_name", "image_data", "digest", "weight", "updated"])
+
+
+class Rotation:
+    """Ordered rotation of apps shared between the MQTT thread and the display thread.
+
+    Writers build a new tuple of entries under a lock and swap it in with a single
+    assignment, so readers always see a complete, consistent snapshot without locking.
+    Apps keep their position when updated; new apps join at the end.
+
+    Apps are picked with smooth weighted round-robin: an app of weight 3 is shown three
+    times per cycle, spread out rather than back to back. Entries not updated within
+    `ttl` seconds are skipped until they are refreshed.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._entries = ()
+        self._write_lock = threading.Lock()
+        self._credit = {}  # app -> current weight; only touched by the reader in next()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, app_name):
+        return any(entry.app_name == app_name for entry in self._entries)
+
+    def snapshot(self):
+        """Returns the current entries as an immutable tuple."""
+        return self._entries
+
+    def get(self, app_name):
+        for entry in self._entries:
+            if entry.app_name == app_name:
+                return entry
+        return None
+
+    def put(self, app_name, image_data, digest=None, weight=None, updated=None):
+        """Adds or replaces an app. The previous weight is kept unless a new one is given."""
+        with self._write_lock:
+            entries = list(self._entries)
+            for i, entry in enumerate(entries):
+                if entry.app_name == app_name:
+                    entries[i] = entry._replace(
+                        image_data=image_data,
+                        digest=digest,
+                        weight=entry.weight if weight is None else weight,
+                        updated=time.monotonic() if updated is None else updated,
+                    )
+                    break
+            else:
+                entries.append(RotationEntry(
+                    app_name, image_data, digest,
+                    1 if weight is None else weight,
+                    time.monotonic() if updated is None else updated,
+                ))
+            self._entries = tuple(entries)
+
+    def set_weight(self, app_name, weight):
+        """Changes how often an app is shown per cycle. A weight of 0 pauses it."""
+        with self._write_lock:
+            self._entries = tuple(
+                entry._replace(weight=weight) if entry.app_name == app_name else entry
+                for entry in self._entries
+            )
+
+    def remove(self, app_name):
+        with self._write_lock:
+            self._entries = tuple(entry for entry in self._entries if entry.app_name != app_name)
+
+    def live(self, now=None):
+        """Entries that are neither stale nor paused, in rotation order."""
+        if now is None:
+            now = time.monotonic()
+        return [
+            entry for entry in self._entries
+            if entry.weight > 0 and (self.ttl is None or now - entry.updated <= self.ttl)
+        ]
+
+    @staticmethod
+    def _pick(entries, credit):
+        """One round of smooth weighted round-robin over `entries`, updating `credit` in place."""
+        total = 0
+        best = None
+        for entry in entries:
+            credit[entry.app_name] = credit.get(entry.app_name, 0) + entry.weight
+            total += entry.weight
+            if best is None or credit[entry.app_name] > credit[best.app_name]:
+                best = entry
+        credit[best.app_name] -= total
+        return best
+
+    def next(self, now=None):
+        """Picks the next entry to show, or None if nothing is live. Call from one thread only."""
+        entries = self.live(now)
+        if not entries:
+            return None
+
+        best = self._pick(entries, self._credit)
+
+        # Forget credit of apps that left the rotation
+        if len(self._credit) > len(entries):
+            names = {entry.app_name for entry in entries}
+            self._credit = {name: credit for name, credit in self._credit.items() if name in names}
+        return best
+
+    def cycle_length(self, now=None):
+        """Slots in one full cycle of the live entries, or None if fractional weights mean the
+        sequence doesn't repeat after a whole number of slots."""
+        cycle = sum(entry.weight for entry in self.live(now))
+        return int(cycle) if cycle == int(cycle) else None
+
+    def upcoming(self, limit, now=None):
+        """Names of the apps next() will return, in order: one full cycle, at most `limit` of them.
+
+        Call from the thread that calls next(); the rotation itself is not advanced.
+        """
+        entries = self.live(now)
+        if not entries:
+            return []
+        credit = dict(self._credit)
+        cycle = sum(entry.weight for entry in entries)
+        count = min(limit, int(cycle) if cycle == int(cycle) else limit)
+        return [self._pick(entries, credit).app_name for _ in range(max(count, 1))]
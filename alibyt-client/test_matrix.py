@@ -1,4 +1,5 @@
 
+import time
 from rgbmatrix import RGBMatrix, RGBMatrixOptions
 from PIL import Image
 
@@ -22,7 +23,7 @@ matrix.SetImage(image)
 # Keep the script running to hold the image on display
 try:
     while True:
-        pass  # Keeps the script alive
+        time.sleep(1)  # Keeps the script alive without spinning a core
 except KeyboardInterrupt:
     print("Exiting...")
 
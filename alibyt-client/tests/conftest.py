@@ -0,0 +1,7 @@
+import os
+import sys
+
+CLIENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(os.path.dirname(CLIENT_DIR), "alibyt-bench")
+sys.path.insert(0, CLIENT_DIR)
+sys.path.insert(1, BENCH_DIR)  # Stub rgbmatrix, for running without a panel
@@ -0,0 +1,41 @@
+import struct
+import zlib
+
+import pytest
+
+import raw_frames
+
+
+def bundle(pixels, size=(2, 1), durations=(100,)):
+    header = raw_frames.HEADER.pack(raw_frames.MAGIC, raw_frames.FORMAT_RGB888, raw_frames.CODEC_ZLIB,
+                                    size[0], size[1], len(durations))
+    return header + struct.pack(f"!{len(durations)}H", *durations) + zlib.compress(pixels)
+
+
+def delta(base_pixels, pixels):
+    digest = lambda data: raw_frames._frames_digest(raw_frames.FORMAT_RGB888, (2, 1), [100], data)
+    xor = bytes(a ^ b for a, b in zip(base_pixels, pixels))
+    header = raw_frames.DELTA_HEADER.pack(raw_frames.DELTA_MAGIC, digest(base_pixels), digest(pixels))
+    return header + bundle(xor)
+
+
+BASE = bytes([1, 2, 3, 4, 5, 6])
+TARGET = bytes([1, 2, 3, 9, 9, 9])
+
+
+def test_apply_delta():
+    result = raw_frames.apply(delta(BASE, TARGET), bundle(BASE))
+    assert raw_frames.decode(result)[3][0].tobytes() == TARGET
+
+
+def test_delta_against_wrong_base_is_rejected():
+    with pytest.raises(ValueError):
+        raw_frames.apply(delta(BASE, TARGET), bundle(bytes(6)))
+
+
+def test_is_target_recognises_an_applied_delta():
+    change = delta(BASE, TARGET)
+    assert raw_frames.is_target(change, bundle(TARGET))
+    assert not raw_frames.is_target(change, bundle(BASE))
+    assert not raw_frames.is_target(change, None)
+    assert not raw_frames.is_target(change, b"RIFF....WEBP")
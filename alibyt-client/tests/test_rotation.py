@@ -0,0 +1,109 @@
+import threading
+
+import pytest
+
+from rotation import Rotation
+
+
+def names(entries):
+    return [entry.app_name for entry in entries]
+
+
+def test_updates_keep_position_and_new_apps_join_at_end():
+    rotation = Rotation()
+    for app in ("clock", "weather", "nba"):
+        rotation.put(app, app.encode())
+    rotation.put("clock", b"new")
+    rotation.put("stocks", b"stocks")
+    assert names(rotation.snapshot()) == ["clock", "weather", "nba", "stocks"]
+    assert rotation.get("clock").image_data == b"new"
+
+
+def test_weighted_round_robin_spreads_heavy_apps():
+    rotation = Rotation()
+    rotation.put("clock", b"", weight=3)
+    rotation.put("weather", b"")
+    picks = [rotation.next().app_name for _ in range(8)]
+    assert picks == ["clock", "clock", "weather", "clock"] * 2
+    assert rotation.upcoming(4) == ["clock", "clock", "weather", "clock"]
+
+
+def test_paused_and_stale_apps_are_skipped():
+    rotation = Rotation(ttl=10)
+    rotation.put("clock", b"", updated=100)
+    rotation.put("weather", b"", updated=80)
+    rotation.put("nba", b"", updated=100)
+    rotation.set_weight("nba", 0)
+    assert [rotation.next(now=105).app_name for _ in range(2)] == ["clock", "clock"]
+    assert rotation.next(now=200) is None
+
+
+def test_concurrent_publishes_during_rotation():
+    """Writers replace and remove apps while a display thread rotates through a fake matrix;
+    every frame shown must be a complete entry whose image belongs to its app."""
+    Image = pytest.importorskip("PIL.Image")
+    from display import MatrixDisplay
+    from rgbmatrix import read_marker
+
+    apps = {f"app{i}": i + 1 for i in range(8)}  # name -> marker id
+
+    def image(app, seq):
+        frame = Image.new("RGB", (64, 32))
+        app_id = apps[app]
+        frame.putpixel((0, 0), (app_id >> 16 & 0xFF, app_id >> 8 & 0xFF, app_id & 0xFF))
+        frame.putpixel((1, 0), (seq >> 16 & 0xFF, seq >> 8 & 0xFF, seq & 0xFF))
+        return frame
+
+    rotation = Rotation()
+    for app in apps:
+        rotation.put(app, image(app, 0))
+    display = MatrixDisplay()
+    stop = threading.Event()
+    errors = []
+    shown = []
+
+    def publish(writer):
+        seq = 0
+        while not stop.is_set():
+            for app in list(apps)[writer::2]:
+                seq += 1
+                rotation.put(app, image(app, seq), digest=str(seq))
+                if seq % 7 == 0:
+                    rotation.remove(app)
+                    rotation.put(app, image(app, seq))
+
+    def rotate():
+        try:
+            for _ in range(5000):
+                entry = rotation.next()
+                if entry is None:
+                    continue
+                display.show(entry.image_data, 100)
+                marker = read_marker(display._matrix.image)
+                assert marker[0] == apps[entry.app_name], entry.app_name
+                shown.append(entry.app_name)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            stop.set()
+
+    writers = [threading.Thread(target=publish, args=(writer,)) for writer in range(2)]
+    reader = threading.Thread(target=rotate)
+    for thread in writers + [reader]:
+        thread.start()
+    for thread in writers + [reader]:
+        thread.join(timeout=60)
+
+    assert not errors
+    assert set(shown) == set(apps)
+    assert sorted(names(rotation.snapshot())) == sorted(apps)
+
+
+def test_cycle_length_counts_weighted_slots():
+    rotation = Rotation()
+    rotation.put("clock", b"", weight=3)
+    rotation.put("weather", b"")
+    rotation.put("nba", b"", weight=0)
+    assert rotation.cycle_length() == 4
+    rotation.set_weight("weather", 0.5)
+    assert rotation.cycle_length() is None
@@ -0,0 +1,126 @@
+import threading
+
+# Bounds for adapted refresh intervals, in seconds
+MIN_REFRESH = 5
+MAX_REFRESH = 3600
+
+BACKOFF = 1.5  # Interval multiplier after a render that didn't change
+TIGHTEN = 0.5  # Interval multiplier after a render that did
+SMOOTHING = 0.2  # Weight of the newest sample in the moving averages
+
+
+class _JobStats:
+    """Observed behaviour of one render job."""
+
+    __slots__ = ("refresh_rate", "explicit", "interval", "duration", "change_rate", "renders", "unchanged")
+
+    def __init__(self, refresh_rate, explicit):
+        self.refresh_rate = refresh_rate
+        self.explicit = explicit
+        self.interval = refresh_rate
+        self.duration = None  # Moving average render time in seconds
+        self.change_rate = None  # Moving average fraction of renders that changed
+        self.renders = 0
+        self.unchanged = 0
+
+
+class AdaptiveRefresh:
+    """Per-job refresh intervals that follow each app's observed change rate and render cost.
+
+    Every render that produces the same image stretches the job's interval by BACKOFF and every
+    render that changes it shrinks it by TIGHTEN, within [min_refresh, max_refresh]. A refresh
+    rate the user set explicitly caps the interval instead, so the app is never staler than
+    asked for. When the estimated render load (sum of duration / interval over all jobs, i.e.
+    busy render workers) exceeds `cpu_budget`, every interval is stretched proportionally.
+    """
+
+    def __init__(self, min_refresh=MIN_REFRESH, max_refresh=MAX_REFRESH, cpu_budget=None):
+        self.min_refresh = min_refresh
+        self.max_refresh = max_refresh
+        self.cpu_budget = cpu_budget
+        self._lock = threading.Lock()
+        self._jobs = {}  # key -> _JobStats
+
+    def configure(self, key, refresh_rate, explicit=False):
+        """Registers a job, or updates its refresh rate. Observations are kept across updates."""
+        with self._lock:
+            stats = self._jobs.get(key)
+            if stats is None:
+                self._jobs[key] = _JobStats(refresh_rate, explicit)
+            elif (stats.refresh_rate, stats.explicit) != (refresh_rate, explicit):
+                stats.refresh_rate, stats.explicit = refresh_rate, explicit
+                stats.interval = self._clamp(stats, refresh_rate)
+
+    def forget(self, key):
+        with self._lock:
+            self._jobs.pop(key, None)
+
+    def _bounds(self, stats):
+        if stats.explicit:
+            return min(self.min_refresh, stats.refresh_rate), stats.refresh_rate
+        return self.min_refresh, max(self.max_refresh, self.min_refresh)
+
+    def _clamp(self, stats, interval):
+        low, high = self._bounds(stats)
+        return min(max(interval, low), high)
+
+    def record(self, key, changed, duration=None):
+        """Feeds back one render: whether its output changed, and how long pixlet took (None if cached)."""
+        with self._lock:
+            stats = self._jobs.get(key)
+            if stats is None:
+                return
+            stats.renders += 1
+            if not changed:
+                stats.unchanged += 1
+            sample = 1.0 if changed else 0.0
+            stats.change_rate = sample if stats.change_rate is None else (
+                SMOOTHING * sample + (1 - SMOOTHING) * stats.change_rate
+            )
+            if duration is not None:
+                stats.duration = duration if stats.duration is None else (
+                    SMOOTHING * duration + (1 - SMOOTHING) * stats.duration
+                )
+            stats.interval = self._clamp(stats, stats.interval * (TIGHTEN if changed else BACKOFF))
+
+    def _load(self):
+        """Estimated busy render workers at the current intervals. Call with the lock held."""
+        return sum(stats.duration / stats.interval for stats in self._jobs.values() if stats.duration)
+
+    def interval(self, key, default):
+        """Seconds until the job's next render, including any stretch needed to stay within budget."""
+        with self._lock:
+            stats = self._jobs.get(key)
+            if stats is None:
+                return default
+            interval = stats.interval
+            if self.cpu_budget:
+                load = self._load()
+                if load > self.cpu_budget:
+                    # Stretch within the job's bounds; explicit user rates still win over the budget
+                    interval = self._clamp(stats, interval * load / self.cpu_budget)
+            return interval
+
+    def render_time(self, key):
+        """Average seconds a render of the job takes, or None before the first one."""
+        with self._lock:
+            stats = self._jobs.get(key)
+            return stats.duration if stats else None
+
+    def stats(self):
+        """Returns the estimated render load and per-job interval, render time and change rate."""
+        with self._lock:
+            return {
+                "load": self._load(),
+                "budget": self.cpu_budget,
+                "jobs": {
+                    key: {
+                        "interval": stats.interval,
+                        "duration": stats.duration,
+                        "change_rate": stats.change_rate,
+                        "renders": stats.renders,
+                        "unchanged": stats.unchanged,
+                    }
+                    for key, stats in self._jobs.items()
+                },
+            }
@@ -0,0 +1,338 @@
+import json
+import os
+import re
+import threading
+import time
+import paho.mqtt.client as mqtt
+from database import DEFAULT_DEVICE, Database
+from metrics import Registry
+from mqtt import PUBLISHER_METRICS_TOPIC, RESERVED_DEVICE_IDS, STATS_TOPICS, app_control_topic, control_topic, status_device
+from utils import load_apps_config
+
+# Route logic shared by the Flask server (server.py) and the asyncio server (async_server.py).
+# Every handler takes the parsed JSON body and returns (response body, status code).
+
+# Paths
+DB_FILE = os.path.expanduser("~/AliByt/alibyt-server/alibyt.db")
+
+# HTTP Server Details
+RHEL_IP = "192.168.2.48"
+HTTP_PORT = 8080  # The port where your HTTP server runs
+IMAGE_FOLDER = "/home/ali/AliByt/alibyt-server/images"  # Directory where images are stored
+
+# MQTT Setup
+MQTT_BROKER = "localhost"
+MQTT_TOPIC = "alibyt/images"
+CHANGES_TOPIC = "alibyt/server/changes"  # One message per committed change; wakes the publisher
+
+DEVICE_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")  # Device ids appear in MQTT topics
+
+# Metrics for /metrics: this server's own, the publisher's latest snapshot and each client's stats
+registry = Registry()
+request_seconds = registry.histogram("alibyt_http_request_seconds", "API request latency by route and status")
+CLIENT_STATS_MAX_AGE = 600  # Seconds after which a silent device's stats are no longer exported
+CLIENT_METRICS = {
+    # Key in the client's stats message -> (metric name, type, help)
+    "uptime": ("alibyt_client_uptime_seconds", "gauge", "Seconds since the client started"),
+    "frames": ("alibyt_client_frames_total", "counter", "Frames shown"),
+    "late": ("alibyt_client_late_frames_total", "counter", "Frames shown after their deadline"),
+    "dropped": ("alibyt_client_dropped_frames_total", "counter", "Frames skipped because their slot had passed"),
+    "decodes": ("alibyt_client_decodes_total", "counter", "Images decoded into frames"),
+    "decode_s": ("alibyt_client_decode_seconds_total", "counter", "Time spent decoding images"),
+    "decode_max_s": ("alibyt_client_decode_max_seconds", "gauge", "Slowest decode since the last report"),
+    "queue": ("alibyt_client_queue_size", "gauge", "Apps in the rotation"),
+    "cache_bytes": ("alibyt_client_frame_cache_bytes", "gauge", "Memory used by decoded frames"),
+    "first_frame_s": ("alibyt_client_first_frame_seconds", "gauge", "Seconds from start to the first frame on screen"),
+}
+metrics_lock = threading.Lock()
+publisher_metrics = ""  # Prometheus text retained by mqtt_publisher.py
+client_stats = {}  # device -> (monotonic time received, stats dict)
+
+def on_mqtt_connect(client, userdata, flags, rc):
+    client.subscribe([(PUBLISHER_METRICS_TOPIC, 0), (STATS_TOPICS, 0)])
+
+def on_mqtt_message(client, userdata, message):
+    global publisher_metrics
+    with metrics_lock:
+        if message.topic == PUBLISHER_METRICS_TOPIC:
+            publisher_metrics = message.payload.decode("utf-8", "replace")
+            return
+        try:
+            stats = json.loads(message.payload)
+        except ValueError:
+            return
+        if isinstance(stats, dict):
+            client_stats[status_device(message.topic)] = (time.monotonic(), stats)
+
+# One shared client; its network loop runs in the background so publishing never blocks a request
+mqtt_client = mqtt.Client()
+mqtt_client.on_connect = on_mqtt_connect
+mqtt_client.on_message = on_mqtt_message
+mqtt_client.connect_async(MQTT_BROKER)
+mqtt_client.loop_start()
+
+# Subscriptions and settings (imports database.json on first run)
+db = Database(DB_FILE)
+db.migrate_from_json()
+
+def notify_change(change):
+    """ Announce a committed change with the database version it produced """
+    mqtt_client.publish(CHANGES_TOPIC, json.dumps({"type": change, "version": db.version()}))
+
+def resolve_device(data):
+    """ Returns (device id, error) for a request; requests without a device target the default one """
+    device = (data or {}).get("device", DEFAULT_DEVICE)
+    if not isinstance(device, str) or db.device(device) is None:
+        return None, f"Unknown device {device}"
+    return device, None
+
+def subscribe(data):
+    """ Subscribe a device to an app, optionally with its own config selections """
+    data = data or {}
+    device, error = resolve_device(data)
+    if error:
+        return {"error": error}, 400
+
+    app_name = data.get("app")
+    config = data.get("config")
+    available_apps = load_apps_config()
+
+    if config is not None and app_name in available_apps:
+        error = validate_app_settings(app_name, {"config": config}, available_apps)
+        if error:
+            return {"error": error}, 400
+
+    if app_name in available_apps and db.subscribe(app_name, device, config):
+        notify_change("subscriptions")
+        return {"message": f"Subscribed {device} to {app_name}"}, 200
+
+    return {"error": "Invalid request or already subscribed"}, 400
+
+def unsubscribe(data):
+    """ Unsubscribe a device from an app """
+    data = data or {}
+    device, error = resolve_device(data)
+    if error:
+        return {"error": error}, 400
+    app_name = data.get("app")
+
+    if db.unsubscribe(app_name, device):
+        notify_change("subscriptions")
+        return {"message": f"Unsubscribed {device} from {app_name}"}, 200
+    return {"error": "App not found in subscriptions"}, 400
+
+def get_subscriptions(query=None):
+    """ Get a device's list of subscribed apps """
+    device, error = resolve_device(query)
+    if error:
+        return {"error": error}, 400
+    return {
+        "device": device,
+        "subscribed_apps": db.subscribed_apps(device),
+        "client_speed": db.client_speed(device),
+    }, 200
+
+def set_subscriptions(data):
+    """ Replace a device's whole rotation with an ordered list of apps, in one transaction """
+    data = data or {}
+    device, error = resolve_device(data)
+    if error:
+        return {"error": error}, 400
+    app_names = data.get("subscribed_apps")
+    if not isinstance(app_names, list):
+        return {"error": "subscribed_apps must be a list"}, 400
+
+    available_apps = load_apps_config()
+    unknown = [app_name for app_name in app_names if app_name not in available_apps]
+    if unknown:
+        return {"error": "Unknown apps", "apps": unknown}, 400
+
+    db.set_subscriptions(list(dict.fromkeys(app_names)), device)  # Drop duplicates, keep order
+    notify_change("subscriptions")
+    return get_subscriptions({"device": device})
+
+def get_devices():
+    """ List devices with their settings """
+    return {"devices": db.devices()}, 200
+
+def register_device(data):
+    """ Create a device or update its name, rotation speed or brightness """
+    data = data or {}
+    device = data.get("device")
+    if not isinstance(device, str) or not DEVICE_ID.match(device):
+        return {"error": "device must be 1-64 letters, digits, '-' or '_'"}, 400
+    if device in RESERVED_DEVICE_IDS:
+        return {"error": f"device cannot be one of {', '.join(sorted(RESERVED_DEVICE_IDS))}"}, 400
+
+    speed = data.get("speed")
+    if speed is not None and not (isinstance(speed, int) and speed > 0):
+        return {"error": "Invalid speed value"}, 400
+    brightness = data.get("brightness")
+    if brightness is not None and not (isinstance(brightness, int) and 0 <= brightness <= 100):
+        return {"error": "Brightness must be between 0 and 100"}, 400
+
+    db.register_device(device, data.get("name"), speed, brightness)
+    notify_change("devices")
+    publish_device_settings(device, speed=speed, brightness=brightness)
+    return {"device": db.device(device)}, 200
+
+def remove_device(data):
+    """ Delete a device and its subscriptions """
+    device = (data or {}).get("device")
+    if db.remove_device(device):
+        notify_change("devices")
+        return {"message": f"Removed {device}"}, 200
+    return {"error": "Unknown device or default device"}, 400
+
+def publish_device_settings(device, speed=None, brightness=None):
+    """ Tell a device about changed settings: all of them, retained on its control topic so a
+    reconnecting client gets the full set, and the changed ones on the legacy topic for the default device """
+    settings = db.device(device) or {}
+    mqtt_client.publish(control_topic(device), json.dumps({
+        "type": "settings",
+        "speed": settings.get("client_speed"),
+        "brightness": settings.get("brightness"),
+    }), qos=1, retain=True)
+
+    if device == DEFAULT_DEVICE:
+        if speed is not None:
+            mqtt_client.publish(MQTT_TOPIC, json.dumps({"type": "update_speed", "speed": speed}))
+        if brightness is not None:
+            mqtt_client.publish(MQTT_TOPIC, json.dumps({"type": "brightness", "brightness": brightness}))
+
+def publish_app_settings(app_names):
+    """ Tell every device about apps' display settings on their retained per-app control topics """
+    for app_name in app_names:
+        settings = db.app_settings(app_name)
+        mqtt_client.publish(app_control_topic(app_name), json.dumps({
+            "type": "settings",
+            "brightness": settings["brightness"],
+        }), qos=1, retain=True)
+
+def push_update(data):
+    """ Push a new image update via MQTT to the default device, sending a URL instead of a file path """
+    app_name = (data or {}).get("app")
+
+    available_apps = load_apps_config()
+    if app_name in available_apps and db.is_subscribed(app_name):
+        image_filename = os.path.basename(available_apps[app_name]["path"])
+        image_url = f"http://{RHEL_IP}:{HTTP_PORT}/{image_filename}"
+
+        mqtt_message = json.dumps({"app": app_name, "url": image_url})
+        mqtt_client.publish(MQTT_TOPIC, mqtt_message)
+
+        return {"message": f"Update pushed for {app_name}", "url": image_url}, 200
+    return {"error": "App not subscribed or invalid"}, 400
+
+def set_client_speed(data):
+    """ Set a device's cycle speed """
+    data = data or {}
+    device, error = resolve_device(data)
+    if error:
+        return {"error": error}, 400
+    new_speed = data.get("speed")
+
+    if isinstance(new_speed, int) and new_speed > 0:
+        db.set_client_speed(new_speed, device)
+        notify_change("devices")
+        publish_device_settings(device, speed=new_speed)
+        return {"message": f"Client speed updated to {new_speed} seconds"}, 200
+    return {"error": "Invalid speed value"}, 400
+
+def validate_app_settings(app_name, settings, available_apps):
+    """ Returns an error message for invalid settings, or None """
+    if app_name not in available_apps:
+        return "App not found"
+
+    brightness = settings.get("brightness")
+    if brightness is not None and not 0 <= brightness <= 100:
+        return "Brightness must be between 0 and 100"
+
+    refresh_rate = settings.get("refresh_rate")
+    if refresh_rate is not None and not refresh_rate > 0:
+        return "Refresh rate must be greater than 0"
+
+    config = settings.get("config")
+    if config is not None:
+        known_ids = {option["id"] for option in available_apps[app_name]["config_settings"]}
+        if not isinstance(config, dict) or not set(config) <= known_ids:
+            return "Config must map known setting ids to values"
+    return None
+
+def update_app_settings(data):
+    """ Update brightness, refresh interval or config selections for a specific app """
+    data = data or {}
+    app_name = data.get("app")
+
+    error = validate_app_settings(app_name, data, load_apps_config())
+    if error:
+        return {"error": error}, 400
+
+    db.update_app_settings(app_name, data.get("refresh_rate"), data.get("brightness"), data.get("config"))
+    notify_change("app_settings")
+    if data.get("brightness") is not None:
+        publish_app_settings([app_name])
+    return {"message": f"Updated settings for {app_name}"}, 200
+
+def patch_app_settings(data):
+    """ Update settings for many apps at once: {"apps": {app: {brightness, refresh_rate, config}}} """
+    updates = (data or {}).get("apps")
+    if not isinstance(updates, dict):
+        return {"error": "apps must map app names to settings"}, 400
+
+    # Validate everything before writing anything
+    available_apps = load_apps_config()
+    errors = {}
+    for app_name, settings in updates.items():
+        if not isinstance(settings, dict):
+            errors[app_name] = "Settings must be an object"
+            continue
+        error = validate_app_settings(app_name, settings, available_apps)
+        if error:
+            errors[app_name] = error
+    if errors:
+        return {"error": "Invalid settings", "apps": errors}, 400
+
+    with db.transaction() as conn:
+        for app_name, settings in updates.items():
+            db.update_app_settings(
+                app_name, settings.get("refresh_rate"), settings.get("brightness"), settings.get("config"), conn=conn
+            )
+    notify_change("app_settings")
+    publish_app_settings([app_name for app_name, settings in updates.items() if settings.get("brightness") is not None])
+    return {"message": f"Updated settings for {len(updates)} apps"}, 200
+
+def get_render_breakers(query=None):
+    """ Show render jobs that are backing off or quarantined (?app=... for one app) """
+    return {"breakers": db.render_breakers((query or {}).get("app"))}, 200
+
+def reset_render_breakers(data):
+    """ Let failing render jobs run again now: {"job": ...}, {"app": ...} or {} for all """
+    data = data or {}
+    reset = db.reset_render_breakers(data.get("app"), data.get("job"))
+    if reset:
+        notify_change("render_breakers")
+    return {"message": f"Reset {reset} render breakers"}, 200
+
+def observe_request(route, method, status, seconds):
+    """ Records one API request for /metrics """
+    request_seconds.observe(seconds, route=route, method=method, status=status)
+
+def get_metrics():
+    """ Everything in Prometheus text format; returned as (text, status) """
+    clients = Registry()
+    now = time.monotonic()
+    with metrics_lock:
+        text = publisher_metrics
+        for device, (received, stats) in client_stats.items():
+            if now - received > CLIENT_STATS_MAX_AGE:
+                continue
+            for key, (name, kind, help_text) in CLIENT_METRICS.items():
+                value = stats.get(key)
+                if isinstance(value, (int, float)):
+                    metric = clients.counter(name, help_text) if kind == "counter" else clients.gauge(name, help_text)
+                    if kind == "counter":
+                        metric.inc(value, device=device)
+                    else:
+                        metric.set(value, device=device)
+    return registry.render() + text + clients.render(), 200
@@ -0,0 +1,77 @@
+import asyncio
+import json
+import time
+from aiohttp import web
+import api
+
+# Asyncio serving mode: the same routes as server.py on aiohttp. Handlers run the shared
+# route logic in a worker thread so SQLite and MQTT calls never block the event loop.
+
+HOST = "0.0.0.0"
+PORT = 5000
+
+async def read_json(request):
+    """ Parsed JSON body, or None if there isn't a valid one """
+    if not request.can_read_body:
+        return None
+    try:
+        return await request.json()
+    except json.JSONDecodeError:
+        return None
+
+async def read_query(request):
+    """ Query string parameters as a plain dict """
+    return dict(request.query)
+
+def route(handler, source=read_json):
+    """ Wraps a shared api handler as an aiohttp view; `source` extracts its argument, if any """
+    async def view(request):
+        args = (await source(request),) if source else ()
+        body, status = await asyncio.to_thread(handler, *args)
+        return web.json_response(body, status=status)
+    return view
+
+@web.middleware
+async def record_latency(request, handler):
+    """ Records every request's latency for /metrics """
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else "unmatched"
+        api.observe_request(route, request.method, status, time.perf_counter() - started)
+
+async def metrics(request):
+    """ Prometheus metrics for the server, the publisher and every reporting client """
+    text, status = await asyncio.to_thread(api.get_metrics)
+    return web.Response(text=text, status=status, content_type="text/plain", charset="utf-8")
+
+def create_app():
+    app = web.Application(middlewares=[record_latency])
+    app.add_routes([
+        web.get("/metrics", metrics),
+        web.post("/subscribe", route(api.subscribe)),
+        web.post("/unsubscribe", route(api.unsubscribe)),
+        web.get("/subscriptions", route(api.get_subscriptions, source=read_query)),
+        web.put("/subscriptions", route(api.set_subscriptions)),
+        web.get("/devices", route(api.get_devices, source=None)),
+        web.post("/devices", route(api.register_device)),
+        web.delete("/devices", route(api.remove_device)),
+        web.post("/push_update", route(api.push_update)),
+        web.post("/set_speed", route(api.set_client_speed)),
+        web.post("/update_app_settings", route(api.update_app_settings)),
+        web.patch("/app_settings", route(api.patch_app_settings)),
+        web.get("/render_breakers", route(api.get_render_breakers, source=read_query)),
+        web.post("/render_breakers/reset", route(api.reset_render_breakers)),
+    ])
+    return app
+
+if __name__ == "__main__":
+    web.run_app(create_app(), host=HOST, port=PORT)
@@ -0,0 +1,94 @@
+import random
+import threading
+import time
+
+BASE_BACKOFF = 30  # Seconds before the first retry of a failed render
+MAX_BACKOFF = 1800  # Longest wait between retries before quarantine
+QUARANTINE_AFTER = 5  # Consecutive failures before a job is quarantined
+QUARANTINE_TIME = 6 * 3600  # Seconds between probe renders of a quarantined job
+
+# Breaker states
+CLOSED = "closed"  # Rendering normally
+OPEN = "open"  # Failing; retried with exponential backoff
+QUARANTINED = "quarantined"  # Failed too often; probed rarely until it renders again
+
+
+class CircuitBreaker:
+    """Per-job render failure tracking with exponential backoff, jitter and quarantine.
+
+    The n-th consecutive failure blocks the job for BASE_BACKOFF * 2**(n-1) seconds (capped at
+    MAX_BACKOFF), scaled by a random factor in [0.5, 1.5) so broken apps don't retry in step.
+    After QUARANTINE_AFTER failures the job is only probed every QUARANTINE_TIME seconds.
+    A successful render closes the breaker. Times are wall-clock so state can be persisted.
+
+    `on_change(key, state)` is called after every transition; `state` is None once closed.
+    """
+
+    def __init__(self, base_backoff=BASE_BACKOFF, max_backoff=MAX_BACKOFF,
+                 quarantine_after=QUARANTINE_AFTER, quarantine_time=QUARANTINE_TIME, on_change=None):
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.quarantine_after = quarantine_after
+        self.quarantine_time = quarantine_time
+        self.on_change = on_change
+        self._lock = threading.Lock()
+        self._states = {}  # key -> {"state", "failures", "retry_at", "last_error", "last_failure"}
+
+    def load(self, states):
+        """Replaces all breaker state, e.g. with what was persisted or reset elsewhere."""
+        with self._lock:
+            self._states = {key: dict(state) for key, state in states.items()}
+
+    def states(self):
+        with self._lock:
+            return {key: dict(state) for key, state in self._states.items()}
+
+    def get(self, key):
+        with self._lock:
+            state = self._states.get(key)
+            return dict(state) if state else None
+
+    def retry_in(self, key, now=None):
+        """Seconds until the job may be rendered again; 0 if it may be rendered now."""
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                return 0
+            return max(0, state["retry_at"] - (time.time() if now is None else now))
+
+    def allow(self, key, now=None):
+        """Whether the job may be rendered now (closed, or due for a retry or probe)."""
+        return self.retry_in(key, now) == 0
+
+    def record_success(self, key):
+        with self._lock:
+            closed = self._states.pop(key, None) is not None
+        if closed and self.on_change:
+            self.on_change(key, None)
+
+    def record_failure(self, key, error, now=None):
+        """Counts a failure and returns the job's new state."""
+        now = time.time() if now is None else now
+        with self._lock:
+            failures = self._states.get(key, {}).get("failures", 0) + 1
+            if failures >= self.quarantine_after:
+                status, delay = QUARANTINED, self.quarantine_time
+            else:
+                status = OPEN
+                delay = min(self.base_backoff * 2 ** (failures - 1), self.max_backoff)
+                delay *= random.uniform(0.5, 1.5)
+            state = self._states[key] = {
+                "state": status,
+                "failures": failures,
+                "retry_at": now + delay,
+                "last_error": str(error)[-500:],
+                "last_failure": now,
+            }
+            state = dict(state)
+        if self.on_change:
+            self.on_change(key, state)
+        return state
+
+    def reset(self, key):
+        with self._lock:
+            self._states.pop(key, None)
@@ -0,0 +1,75 @@
+import json
+import logging
+import os
+import threading
+from types import MappingProxyType
+
+log = logging.getLogger(__name__)
+
+
+def freeze(value):
+    """Recursively converts parsed JSON into read-only mappings and tuples."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def atomic_write_json(path, data, **kwargs):
+    """Writes JSON to a temp file next to `path` and renames it into place."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, **kwargs)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class ConfigStore:
+    """Cached view of apps_config.json, re-parsed only when the file's mtime or size changes.
+
+    Readers get immutable snapshots that stay consistent however long they are held.
+    Writes go through a temp file and rename, so other processes never see a partial file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._snapshot = MappingProxyType({})
+
+    def _file_stamp(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def snapshot(self):
+        """Returns the current catalog as a read-only mapping of app -> settings."""
+        try:
+            stamp = self._file_stamp()
+        except FileNotFoundError:
+            return self._snapshot
+        if stamp == self._stamp:
+            return self._snapshot
+
+        with self._lock:
+            if stamp != self._stamp:
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        self._snapshot = freeze(json.load(f))
+                    self._stamp = stamp
+                except json.JSONDecodeError as e:
+                    # Keep serving the last good catalog; the writer may not be atomic
+                    log.error("Error parsing %s, keeping previous config: %s", self.path, e)
+            return self._snapshot
+
+    def get(self, app_name):
+        """Returns one app's settings, or None."""
+        return self.snapshot().get(app_name)
+
+    def write(self, apps_config):
+        """Replaces the whole catalog."""
+        with self._lock:
+            atomic_write_json(self.path, apps_config, indent=4)
+            self._snapshot = freeze(apps_config)
+            self._stamp = self._file_stamp()
@@ -0,0 +1,391 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_PATH = "/home/ali/AliByt/alibyt-server/alibyt.db"
+
+# Files migrated into the database on first open
+LEGACY_DB_PATH = "/home/ali/AliByt/alibyt-server/database.json"
+LEGACY_CONFIG_PATH = "/home/ali/AliByt/alibyt-server/apps_config.json"
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CLIENT_SPEED = 5
+DEFAULT_DEVICE = "default"  # The single display that existed before devices were introduced
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    device_id TEXT PRIMARY KEY,
+    name TEXT,
+    client_speed INTEGER,
+    brightness INTEGER
+);
+INSERT OR IGNORE INTO devices (device_id) VALUES ('default');
+
+CREATE TABLE IF NOT EXISTS device_subscriptions (
+    device_id TEXT NOT NULL REFERENCES devices (device_id) ON DELETE CASCADE,
+    app TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    config TEXT,  -- JSON object of per-device overrides of the app's config selections
+    PRIMARY KEY (device_id, app)
+);
+CREATE INDEX IF NOT EXISTS device_subscriptions_app ON device_subscriptions (app);
+
+CREATE TABLE IF NOT EXISTS app_settings (
+    app TEXT PRIMARY KEY,
+    refresh_rate INTEGER,
+    brightness INTEGER,
+    config TEXT  -- JSON object of schema field id -> selected value
+);
+
+-- Written by the publisher for render jobs that are failing; absent rows are healthy
+CREATE TABLE IF NOT EXISTS render_breakers (
+    job TEXT PRIMARY KEY,  -- app, or app@<config hash>
+    app TEXT NOT NULL,
+    state TEXT NOT NULL,
+    failures INTEGER NOT NULL,
+    retry_at REAL NOT NULL,  -- Unix time of the next allowed render
+    last_error TEXT,
+    last_failure REAL
+);
+
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+-- `version` is bumped by every write so other processes can cheaply notice changes
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+"""
+
+
+class Database:
+    """WAL-mode SQLite store for devices, their subscriptions, per-app settings and client settings."""
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._local = threading.local()  # One connection per thread
+        self._listeners = []
+        self._listeners_lock = threading.Lock()
+        self._conn().executescript(SCHEMA)  # Idempotent; executescript manages its own transaction
+        self._upgrade()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def _upgrade(self):
+        """Moves data from the single-display tables into the default device."""
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'subscriptions'").fetchone():
+                conn.execute(
+                    "INSERT OR IGNORE INTO device_subscriptions (device_id, app, position) "
+                    "SELECT ?, app, position FROM subscriptions",
+                    (DEFAULT_DEVICE,),
+                )
+                conn.execute("DROP TABLE subscriptions")
+            row = conn.execute("SELECT value FROM settings WHERE key = 'client_speed'").fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE devices SET client_speed = ? WHERE device_id = ?", (int(row["value"]), DEFAULT_DEVICE)
+                )
+                conn.execute("DELETE FROM settings WHERE key = 'client_speed'")
+
+    @contextmanager
+    def _transaction(self, notify=False):
+        """Write transaction; with `notify`, bumps the version and calls local listeners."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            if notify:
+                conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if notify:
+            self._notify()
+
+    def transaction(self):
+        """Groups several writes into one transaction and one change notification."""
+        return self._transaction(notify=True)
+
+    def on_change(self, callback):
+        """Registers `callback(version)` for changes made through this process."""
+        with self._listeners_lock:
+            self._listeners.append(callback)
+
+    def _notify(self):
+        version = self.version()
+        with self._listeners_lock:
+            listeners = list(self._listeners)
+        for callback in listeners:
+            try:
+                callback(version)
+            except Exception as e:
+                log.exception("Error in database change listener: %s", e)
+
+    def version(self):
+        """Monotonic change counter, shared by every process using the database."""
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row["value"]
+
+    # Devices
+
+    def devices(self):
+        """Returns every device with its settings, in id order."""
+        rows = self._conn().execute(
+            "SELECT device_id, name, client_speed, brightness FROM devices ORDER BY device_id"
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def device(self, device_id):
+        row = self._conn().execute(
+            "SELECT device_id, name, client_speed, brightness FROM devices WHERE device_id = ?", (device_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def register_device(self, device_id, name=None, client_speed=None, brightness=None, conn=None):
+        """Creates a device or updates the given settings of an existing one."""
+        if conn is None:
+            with self.transaction() as conn:
+                return self.register_device(device_id, name, client_speed, brightness, conn)
+        conn.execute(
+            "INSERT INTO devices (device_id, name, client_speed, brightness) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (device_id) DO UPDATE SET "
+            "name = COALESCE(excluded.name, name), "
+            "client_speed = COALESCE(excluded.client_speed, client_speed), "
+            "brightness = COALESCE(excluded.brightness, brightness)",
+            (device_id, name, client_speed, brightness),
+        )
+
+    def remove_device(self, device_id):
+        """Deletes a device and its subscriptions. The default device can't be removed."""
+        if device_id == DEFAULT_DEVICE:
+            return False
+        with self.transaction() as conn:
+            return conn.execute("DELETE FROM devices WHERE device_id = ?", (device_id,)).rowcount == 1
+
+    # Subscriptions
+
+    def subscribed_apps(self, device=DEFAULT_DEVICE):
+        rows = self._conn().execute(
+            "SELECT app FROM device_subscriptions WHERE device_id = ? ORDER BY position", (device,)
+        ).fetchall()
+        return [row["app"] for row in rows]
+
+    def all_subscriptions(self):
+        """Returns (device, app, config overrides) for every subscription of every device."""
+        rows = self._conn().execute(
+            "SELECT device_id, app, config FROM device_subscriptions ORDER BY device_id, position"
+        ).fetchall()
+        return [
+            (row["device_id"], row["app"], json.loads(row["config"]) if row["config"] else {})
+            for row in rows
+        ]
+
+    def is_subscribed(self, app_name, device=DEFAULT_DEVICE):
+        row = self._conn().execute(
+            "SELECT 1 FROM device_subscriptions WHERE device_id = ? AND app = ?", (device, app_name)
+        ).fetchone()
+        return row is not None
+
+    def subscribe(self, app_name, device=DEFAULT_DEVICE, config=None, conn=None):
+        """Appends an app to a device's rotation. Returns False if it was already subscribed."""
+        if conn is None:
+            with self.transaction() as conn:
+                return self.subscribe(app_name, device, config, conn)
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO device_subscriptions (device_id, app, position, config) "
+            "SELECT ?, ?, COALESCE(MAX(position), -1) + 1, ? FROM device_subscriptions WHERE device_id = ?",
+            (device, app_name, json.dumps(config) if config else None, device),
+        )
+        return cursor.rowcount == 1
+
+    def unsubscribe(self, app_name, device=DEFAULT_DEVICE, conn=None):
+        """Removes an app from a device's rotation. Returns False if it wasn't subscribed."""
+        if conn is None:
+            with self.transaction() as conn:
+                return self.unsubscribe(app_name, device, conn)
+        cursor = conn.execute(
+            "DELETE FROM device_subscriptions WHERE device_id = ? AND app = ?", (device, app_name)
+        )
+        return cursor.rowcount == 1
+
+    def set_subscriptions(self, app_names, device=DEFAULT_DEVICE, conn=None):
+        """Replaces a device's whole rotation with `app_names`, in order, keeping config overrides."""
+        if conn is None:
+            with self.transaction() as conn:
+                return self.set_subscriptions(app_names, device, conn)
+        overrides = {
+            row["app"]: row["config"]
+            for row in conn.execute("SELECT app, config FROM device_subscriptions WHERE device_id = ?", (device,))
+        }
+        conn.execute("DELETE FROM device_subscriptions WHERE device_id = ?", (device,))
+        conn.executemany(
+            "INSERT OR IGNORE INTO device_subscriptions (device_id, app, position, config) VALUES (?, ?, ?, ?)",
+            [(device, app_name, position, overrides.get(app_name)) for position, app_name in enumerate(app_names)],
+        )
+
+    # Per-app settings
+
+    def app_settings(self, app_name):
+        """Returns {"refresh_rate", "brightness", "config"} for an app; unset values are None."""
+        row = self._conn().execute(
+            "SELECT refresh_rate, brightness, config FROM app_settings WHERE app = ?", (app_name,)
+        ).fetchone()
+        if row is None:
+            return {"refresh_rate": None, "brightness": None, "config": {}}
+        return {
+            "refresh_rate": row["refresh_rate"],
+            "brightness": row["brightness"],
+            "config": json.loads(row["config"]) if row["config"] else {},
+        }
+
+    def all_app_settings(self):
+        """Returns settings for every app that has any, keyed by app."""
+        rows = self._conn().execute("SELECT app, refresh_rate, brightness, config FROM app_settings").fetchall()
+        return {
+            row["app"]: {
+                "refresh_rate": row["refresh_rate"],
+                "brightness": row["brightness"],
+                "config": json.loads(row["config"]) if row["config"] else {},
+            }
+            for row in rows
+        }
+
+    def update_app_settings(self, app_name, refresh_rate=None, brightness=None, config=None, conn=None):
+        """Sets the given settings for an app, leaving the others unchanged. `config` is merged."""
+        if conn is None:
+            with self.transaction() as conn:
+                return self.update_app_settings(app_name, refresh_rate, brightness, config, conn)
+        row = conn.execute("SELECT config FROM app_settings WHERE app = ?", (app_name,)).fetchone()
+        merged = json.loads(row["config"]) if row and row["config"] else {}
+        merged.update(config or {})
+        conn.execute(
+            "INSERT INTO app_settings (app, refresh_rate, brightness, config) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (app) DO UPDATE SET "
+            "refresh_rate = COALESCE(excluded.refresh_rate, refresh_rate), "
+            "brightness = COALESCE(excluded.brightness, brightness), "
+            "config = excluded.config",
+            (app_name, refresh_rate, brightness, json.dumps(merged) if merged else None),
+        )
+
+    # Client settings
+
+    def client_speed(self, device=DEFAULT_DEVICE):
+        row = self._conn().execute("SELECT client_speed FROM devices WHERE device_id = ?", (device,)).fetchone()
+        return row["client_speed"] if row and row["client_speed"] else DEFAULT_CLIENT_SPEED
+
+    def set_client_speed(self, speed, device=DEFAULT_DEVICE, conn=None):
+        return self.register_device(device, client_speed=speed, conn=conn)
+
+    # Render circuit breakers
+
+    def render_breakers(self, app_name=None):
+        """Returns breaker state keyed by render job, optionally only for one app's jobs."""
+        query = "SELECT job, state, failures, retry_at, last_error, last_failure FROM render_breakers"
+        params = ()
+        if app_name is not None:
+            query += " WHERE app = ?"
+            params = (app_name,)
+        return {
+            row["job"]: {key: row[key] for key in ("state", "failures", "retry_at", "last_error", "last_failure")}
+            for row in self._conn().execute(query, params)
+        }
+
+    def save_render_breaker(self, job, app_name, state):
+        """Records a job's breaker state, or clears it when `state` is None. Doesn't bump the version."""
+        with self._transaction() as conn:
+            if state is None:
+                conn.execute("DELETE FROM render_breakers WHERE job = ?", (job,))
+                return
+            conn.execute(
+                "INSERT OR REPLACE INTO render_breakers "
+                "(job, app, state, failures, retry_at, last_error, last_failure) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job, app_name, state["state"], state["failures"], state["retry_at"],
+                 state["last_error"], state["last_failure"]),
+            )
+
+    def reset_render_breakers(self, app_name=None, job=None):
+        """Closes breakers for one job, one app's jobs, or all jobs. Returns how many were reset."""
+        with self.transaction() as conn:
+            if job is not None:
+                cursor = conn.execute("DELETE FROM render_breakers WHERE job = ?", (job,))
+            elif app_name is not None:
+                cursor = conn.execute("DELETE FROM render_breakers WHERE app = ?", (app_name,))
+            else:
+                cursor = conn.execute("DELETE FROM render_breakers")
+            return cursor.rowcount
+
+    # Migration
+
+    def migrate_from_json(self, db_json_path=LEGACY_DB_PATH, config_path=LEGACY_CONFIG_PATH,
+                          default_refresh_rate=60):
+        """One-shot import of database.json and the settings in apps_config.json. Idempotent.
+
+        A file that can't be read or parsed is logged and nothing is imported, so the next
+        start tries again instead of losing the legacy subscriptions.
+        """
+        try:
+            legacy = self._read_legacy(db_json_path)
+            apps_config = self._read_legacy(config_path)
+        except (OSError, ValueError) as e:
+            log.error("Could not read legacy settings, will retry the migration on next start: %s", e)
+            return False
+
+        migrated = False
+        with self.transaction() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone():
+                return False
+            conn.execute("INSERT INTO meta (key, value) VALUES ('migrated', 1)")
+
+            if legacy is not None:
+                self.set_subscriptions(legacy.get("subscribed_apps", []), conn=conn)
+                if "client_speed" in legacy:
+                    self.set_client_speed(legacy["client_speed"], conn=conn)
+                migrated = True
+
+            for app_name, info in (apps_config or {}).items():
+                refresh_rate = info.get("refresh_rate")
+                config = {
+                    option["id"]: option["selected_value"]
+                    for option in info.get("config_settings", [])
+                    if option.get("selected_value") is not None
+                }
+                if refresh_rate == default_refresh_rate:
+                    refresh_rate = None  # Only carry over explicit user settings
+                if refresh_rate is not None or info.get("brightness") is not None or config:
+                    self.update_app_settings(app_name, refresh_rate, info.get("brightness"), config, conn=conn)
+                    migrated = True
+
+        if migrated:
+            log.info("Migrated %s and %s settings into %s", db_json_path, config_path, self.path)
+        return migrated
+
+    @staticmethod
+    def _read_legacy(path):
+        """Parsed JSON from `path`, or None if it doesn't exist."""
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+
+if __name__ == "__main__":
+    Database().migrate_from_json()
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from io import BytesIO
+
+try:
+    from PIL import Image, ImageSequence
+except ImportError:  # Pixel-level comparison is optional on the server
+    Image = None
+
+log = logging.getLogger(__name__)
+
+DIGEST_SIZE = 16  # Bytes; BLAKE2b truncated to 128 bits
+
+
+def content_digest(data):
+    """Returns the hex BLAKE2b digest of raw image bytes."""
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).hexdigest()
+
+
+def pixel_digest(data):
+    """Returns a digest of the decoded frames and their durations, ignoring container metadata.
+
+    Returns None if Pillow is not installed or the image cannot be decoded.
+    """
+    if Image is None:
+        return None
+    try:
+        image = Image.open(BytesIO(data))
+        h = hashlib.blake2b(digest_size=DIGEST_SIZE)
+        h.update(f"{image.size}".encode())
+        for frame in ImageSequence.Iterator(image):
+            h.update(frame.convert("RGBA").tobytes())
+            h.update(str(frame.info.get("duration", 0)).encode())
+        return h.hexdigest()
+    except Exception as e:
+        log.warning("Could not decode image for pixel digest: %s", e)
+        return None
+
+
+class DigestIndex:
+    """Digest of the last published render per key (app, or device/app), saved to a sidecar file."""
+
+    def __init__(self, path, compare_pixels=False):
+        self.path = path
+        self.compare_pixels = compare_pixels
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> {"digest": ..., "pixels": ...}
+        try:
+            with open(path, "r") as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except json.JSONDecodeError:
+            log.warning("%s is corrupted, starting with an empty digest index", path)
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
+
+    def check(self, app, data):
+        """Records `data` as the latest render of `app`. Returns (changed, digest).
+
+        With `compare_pixels`, a render whose bytes differ but whose decoded frames
+        match the last one is reported as unchanged.
+        """
+        changed, digest = self.check_many([app], data)
+        return bool(changed), digest
+
+    def check_many(self, keys, data):
+        """Records `data` under each key (e.g. one per device). Returns (changed keys, digest).
+
+        The content digest and pixel digest are computed once, and the sidecar file is
+        written once, however many keys share the render.
+        """
+        digest = content_digest(data)
+        with self._lock:
+            stale = [key for key in keys if (self._entries.get(key) or {}).get("digest") != digest]
+        if not stale:
+            return [], digest
+
+        pixels = pixel_digest(data) if self.compare_pixels else None
+        changed = []
+        with self._lock:
+            for key in stale:
+                entry = self._entries.get(key)
+                if not (entry and pixels and entry.get("pixels") == pixels):
+                    changed.append(key)
+                self._entries[key] = {"digest": digest, "pixels": pixels}
+            self._save()
+        return changed, digest
+
+    def get(self, app):
+        """Returns the last recorded digest for `app`, or None."""
+        with self._lock:
+            entry = self._entries.get(app)
+            return entry["digest"] if entry else None
+
+    def apps(self):
+        """Returns the keys with a recorded digest."""
+        with self._lock:
+            return set(self._entries)
+
+    def remove(self, *keys):
+        with self._lock:
+            removed = [key for key in keys if self._entries.pop(key, None) is not None]
+            if removed:
+                self._save()
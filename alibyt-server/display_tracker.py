@@ -0,0 +1,116 @@
+import math
+import threading
+import time
+
+# A device that hasn't reported for this many slots (plus STALE_GRACE seconds) is treated as unknown
+STALE_SLOTS = 3
+STALE_GRACE = 30
+
+
+class _DeviceStatus:
+    """Last reported rotation position of one device."""
+
+    __slots__ = ("app", "upcoming", "cycle", "dwell", "received")
+
+    def __init__(self, app, upcoming, cycle, dwell, received):
+        self.app = app
+        self.upcoming = upcoming
+        self.cycle = cycle  # Slots per rotation cycle, or None if it doesn't repeat evenly
+        self.dwell = dwell
+        self.received = received
+
+    @property
+    def truncated(self):
+        """True if `upcoming` covers less than one full cycle, so apps missing from it may still be shown."""
+        return self.cycle is None or self.cycle > len(self.upcoming)
+
+
+class DisplayTracker:
+    """Predicts when each device will next show an app, from the status its client sends at every slot.
+
+    A status names the app that just started, the apps that follow it, and how many slots one
+    rotation cycle has, with `dwell` seconds per slot. Clients cap the list, so for long
+    rotations it covers only part of the cycle and predictions stop at its end. Times are measured
+    from when the status arrived on this host, so client and server clocks never need to agree.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._devices = {}  # device -> _DeviceStatus
+
+    def update(self, device, status, now=None):
+        """Records a status message: {"app", "upcoming": [app, ...], "cycle": slots, "dwell": seconds}.
+
+        Older clients send no "cycle"; their list is taken to be the whole cycle.
+        """
+        upcoming = status.get("upcoming")
+        dwell = status.get("dwell")
+        cycle = status.get("cycle", len(upcoming) if isinstance(upcoming, list) else None)
+        if not isinstance(upcoming, list) or not isinstance(dwell, (int, float)) or dwell <= 0:
+            return False
+        if not isinstance(cycle, int) or cycle < len(upcoming):
+            cycle = None
+        received = time.monotonic() if now is None else now
+        with self._lock:
+            self._devices[device] = _DeviceStatus(status.get("app"), tuple(upcoming), cycle, dwell, received)
+        return True
+
+    def forget(self, device):
+        with self._lock:
+            self._devices.pop(device, None)
+
+    def _live(self, device, now):
+        status = self._devices.get(device)
+        if status is None or now - status.received > STALE_SLOTS * status.dwell + STALE_GRACE:
+            return None
+        return status
+
+    def seconds_until_shown(self, app, device, after=0, now=None):
+        """Seconds until `device` next starts showing `app`, at least `after` seconds from now.
+
+        Returns None if the device hasn't reported recently or the app isn't within the reported
+        part of a truncated rotation, and math.inf if the app isn't in its rotation at all.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            status = self._live(device, now)
+        if status is None:
+            return None
+
+        # Slot k (k >= 1) starts at received + k * dwell and shows upcoming[(k - 1) % cycle]
+        first_slot = (now + after - status.received) / status.dwell
+        best = None
+        for i, name in enumerate(status.upcoming):
+            if name != app:
+                continue
+            slot = i + 1
+            if slot < first_slot:
+                if status.truncated:
+                    continue  # Apps beyond the list could come first; only its own slots are certain
+                slot += math.ceil((first_slot - slot) / status.cycle) * status.cycle
+            seconds = status.received + slot * status.dwell - now
+            best = seconds if best is None else min(best, seconds)
+        if best is None and not status.truncated:
+            return math.inf
+        return best
+
+    def next_showing(self, app, devices, after=0, now=None):
+        """Seconds until any of `devices` next shows `app` (see seconds_until_shown).
+
+        Returns None if any device's rotation is unknown, since it could show the app at any time.
+        """
+        now = time.monotonic() if now is None else now
+        best = math.inf
+        for device in devices:
+            seconds = self.seconds_until_shown(app, device, after, now)
+            if seconds is None:
+                return None
+            best = min(best, seconds)
+        return best
+
+    def stats(self):
+        """Returns the devices with a recent status and the app each is showing."""
+        now = time.monotonic()
+        with self._lock:
+            return {device: status.app for device, status in self._devices.items()
+                    if self._live(device, now) is not None}
@@ -1,17 +1,57 @@
-import paho.mqtt.client as mqtt
+from database import DEFAULT_DEVICE
 
 BROKER = "localhost"
 PORT = 1883
-TOPIC_PREFIX = "alibyt/app/"
+TOPIC_PREFIX = "alibyt/images/"  # One retained topic per app for the default device
+# First topic levels taken by fixed topics; a device with one of these ids would share them
+RESERVED_DEVICE_IDS = {"images", "apps", "metrics", "server"}
 
-def publish_update(app_name, image_url):
-    """ Publish an image update via MQTT """
-    client = mqtt.Client()
-    client.connect(BROKER, PORT, 60)
+def image_topic_prefix(device=DEFAULT_DEVICE):
+    """ Returns the per-app image topic prefix of a device; alibyt/<device>/images/ for named devices """
+    return TOPIC_PREFIX if device == DEFAULT_DEVICE else f"alibyt/{device}/images/"
 
-    topic = f"{TOPIC_PREFIX}{app_name}"
-    client.publish(topic, image_url)
-    client.disconnect()
+def app_topic(app_name, device=DEFAULT_DEVICE):
+    """ Returns the per-app image topic """
+    return f"{image_topic_prefix(device)}{app_name}"
+
+def live_topic(app_name, device=DEFAULT_DEVICE):
+    """ Returns the per-app topic streaming updates, deltas included, to a connected device; never retained """
+    return f"alibyt/{device}/live/{app_name}"
+
+def manifest_topic(device=DEFAULT_DEVICE):
+    """ Returns the retained topic listing the apps a device is subscribed to """
+    return f"alibyt/{device}/manifest"
+
+def control_topic(device=DEFAULT_DEVICE):
+    """ Returns the topic carrying a device's settings (speed, brightness) """
+    return f"alibyt/{device}/control"
+
+def app_control_topic(app_name):
+    """ Returns the topic carrying an app's display settings (brightness), shared by every device """
+    return f"alibyt/apps/{app_name}/control"
+
+STATUS_TOPICS = "alibyt/+/status"  # Every device's rotation position reports
+STATS_TOPICS = "alibyt/+/stats"  # Every device's periodic playback stats
+CAPABILITIES_TOPICS = "alibyt/+/capabilities"  # Retained frame formats and panel size of every device
+KEYFRAME_TOPICS = "alibyt/+/keyframe"  # Devices that could not apply a delta ask for the whole image
+PUBLISHER_METRICS_TOPIC = "alibyt/metrics/publisher"  # Retained Prometheus text from mqtt_publisher.py
+
+def status_device(topic):
+    """ Returns the device id of a per-device topic such as status or stats """
+    return topic.split("/")[1]
+
+def publish_update(client, app_name, message, device=DEFAULT_DEVICE):
+    """ Publish an app's latest image as a retained message so clients get it on (re)connect """
+    return client.publish(app_topic(app_name, device), message, qos=1, retain=True)
+
+def publish_live(client, app_name, message, device=DEFAULT_DEVICE):
+    """ Publish an update to a device's live topic; only clients connected now receive it """
+    return client.publish(live_topic(app_name, device), message, qos=1)
+
+def clear_update(client, app_name, device=DEFAULT_DEVICE):
+    """ Clear an app's retained image so new clients no longer receive it, and tell connected ones """
+    publish_live(client, app_name, b"", device)
+    return client.publish(app_topic(app_name, device), b"", qos=1, retain=True)
 
 if __name__ == "__main__":
     print("MQTT Publisher ready.")
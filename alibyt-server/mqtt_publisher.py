@@ -1,145 +1,647 @@
 import json
+import logging
 import time
 import os
 import paho.mqtt.client as mqtt
 import subprocess
 import base64
 import threading
-import random
+import hashlib
+import payload
+import raw_frames
+from metrics import Registry
+from mqtt import (
+    CAPABILITIES_TOPICS, KEYFRAME_TOPICS, PUBLISHER_METRICS_TOPIC, STATUS_TOPICS, clear_update, manifest_topic,
+    publish_live, publish_update, status_device
+)
+from adaptive_refresh import AdaptiveRefresh
+from display_tracker import DisplayTracker
+from config_store import ConfigStore
+from circuit_breaker import QUARANTINED, CircuitBreaker
+from database import DEFAULT_DEVICE, Database
+from digest_index import DigestIndex
+from render_cache import RenderCache, normalize_config, time_bucket
+from render_pool import RenderPool
+from render_proxy import RenderProxy
+from render_scheduler import RenderScheduler
 
-# Config Paths
-CONFIG_PATH = "/home/ali/AliByt/alibyt-server/apps_config.json"
-SUBSCRIPTIONS_PATH = "/home/ali/AliByt/alibyt-server/database.json"
-RENDERED_PATH = "/home/ali/AliByt/alibyt-server/rendered_images"
-CACHE_PATH = "/home/ali/AliByt/alibyt-server/image_cache"  # Store old images
+# Logging; set ALIBYT_LOG_LEVEL=DEBUG to see every render
+LOG_LEVEL = os.environ.get("ALIBYT_LOG_LEVEL", "INFO")
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+log = logging.getLogger("alibyt.publisher")
+
+# Config Paths (ALIBYT_SERVER_DIR relocates them all, e.g. for the benchmark harness)
+SERVER_DIR = os.environ.get("ALIBYT_SERVER_DIR", "/home/ali/AliByt/alibyt-server")
+CONFIG_PATH = os.path.join(SERVER_DIR, "apps_config.json")
+DB_PATH = os.path.join(SERVER_DIR, "alibyt.db")
+RENDERED_PATH = os.path.join(SERVER_DIR, "rendered_images")
+CACHE_PATH = os.path.join(SERVER_DIR, "image_cache")  # Render cache and digest index
 
 # Ensure directories exist
 os.makedirs(RENDERED_PATH, exist_ok=True)
 os.makedirs(CACHE_PATH, exist_ok=True)
 
-# Load app configurations
-with open(CONFIG_PATH, "r") as file:
-    apps = json.load(file)
+# App configurations, reloaded whenever apps_config.json changes
+apps_config = ConfigStore(CONFIG_PATH)
+
+# Subscriptions and per-app settings (imports database.json on first run)
+db = Database(DB_PATH)
+db.migrate_from_json()
 
 # MQTT setup
-MQTT_BROKER = "192.168.2.48"
-MQTT_TOPIC = "alibyt/images"
+MQTT_BROKER = os.environ.get("ALIBYT_MQTT_BROKER", "192.168.2.48")
+MQTT_PORT = int(os.environ.get("ALIBYT_MQTT_PORT", 1883))
+MQTT_TOPIC = "alibyt/images"  # Legacy JSON topic
+PUBLISH_LEGACY_JSON = True  # Also send base64 JSON until every client understands binary messages
+CHANGES_TOPIC = "alibyt/server/changes"  # Published by the API after each committed change
+changes_event = threading.Event()  # Set when the API reports a change, to reconcile without waiting
+
+# Where each device is in its rotation, so apps are rendered just before they are shown
+display_tracker = DisplayTracker()
+JIT_LEAD = 3  # Seconds before a slot, on top of the render time, that its app should be rendered
+
+# Devices that advertise a raw frame format get renders transcoded to their panel (see raw_frames.py):
+# device -> (frame format, width, height). Everyone else gets WebP.
+TRANSCODE_RAW = True
+RAW_GAMMA = 1.0  # Applied before the app's brightness; 1.0 leaves colour correction to the panel driver
+device_formats = {}
+
+# Devices that advertise "stream" take updates on their non-retained live topic, while their retained
+# image topic always holds the whole latest image for when they (re)connect.
+stream_devices = set()
+
+# Raw-format streaming devices that can apply deltas get only the pixels that changed since the bundle
+# they last received, unless the delta would be more than DELTA_MAX_RATIO of the full bundle. Deltas go
+# only to the live topic, so a retained message is never a delta. A device that can't apply one asks
+# for a keyframe on its keyframe topic.
+DELTA_FRAMES = True
+DELTA_MAX_RATIO = 0.5
+delta_devices = set()
+sent_bundles = {}  # "device/app" -> last raw bundle sent, the base of the next delta
+keyframe_requests = set()  # (device, app) pairs to resend in full, handled by run_scheduler()
+
+def update_capabilities(device, capabilities):
+    """Records the preferred frame format of a device from its retained capabilities message."""
+    device_formats.pop(device, None)
+    delta_devices.discard(device)
+    if capabilities.get("stream"):
+        stream_devices.add(device)
+    else:
+        stream_devices.discard(device)
+    if not TRANSCODE_RAW:
+        return
+    for frame_format in capabilities.get("formats", []):
+        if frame_format == "webp":
+            break
+        if frame_format in raw_frames.FORMATS:
+            device_formats[device] = (frame_format, int(capabilities["width"]), int(capabilities["height"]))
+            if DELTA_FRAMES and capabilities.get("delta") and device in stream_devices:
+                delta_devices.add(device)
+            break
+
+def on_connect(client, userdata, flags, rc):
+    client.subscribe([(CHANGES_TOPIC, 0), (STATUS_TOPICS, 0), (CAPABILITIES_TOPICS, 1), (KEYFRAME_TOPICS, 1)])
+
+def on_message(client, userdata, message):
+    if message.topic == CHANGES_TOPIC:
+        changes_event.set()
+        return
+    if message.topic.endswith("/capabilities"):
+        try:
+            update_capabilities(status_device(message.topic), json.loads(message.payload or b"{}"))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            log.warning("Ignoring bad capabilities on %s: %s", message.topic, e)
+        return
+    if message.topic.endswith("/keyframe"):
+        try:
+            keyframe_requests.add((status_device(message.topic), json.loads(message.payload)["app"]))
+            changes_event.set()
+        except (ValueError, KeyError, TypeError) as e:
+            log.warning("Ignoring bad keyframe request on %s: %s", message.topic, e)
+        return
+    try:
+        display_tracker.update(status_device(message.topic), json.loads(message.payload))
+    except (ValueError, AttributeError) as e:
+        log.warning("Ignoring bad status on %s: %s", message.topic, e)
+
 client = mqtt.Client()
-client.connect(MQTT_BROKER)
+client.on_connect = on_connect
+client.on_message = on_message
+client.connect(MQTT_BROKER, MQTT_PORT)
+client.loop_start()  # Needed for QoS 1 acknowledgements on retained per-app topics
+
+# Scheduler setup
+MAX_RENDER_WORKERS = 4  # Maximum number of concurrent pixlet renders
+STATS_INTERVAL = 60  # Seconds between scheduler stats reports
+CHANGE_POLL_INTERVAL = 1  # Seconds between checks of the database version counter if no change is announced
+HEALTH_CHECK_INTERVAL = 30  # Seconds between pixlet worker health checks
+METRICS_INTERVAL = 15  # Seconds between metrics snapshots published for the server's /metrics endpoint
+
+RENDER_TIMEOUT = 20  # Seconds before a hung render is killed and counted as a failure
+
+# Warm Pixlet workers, recycled after MAX_WORKER_RENDERS renders or MAX_WORKER_RSS_MB of memory
+MAX_PIXLET_WORKERS = 16
+MAX_WORKER_RENDERS = 500
+MAX_WORKER_RSS_MB = 256
+render_pool = RenderPool(MAX_PIXLET_WORKERS, MAX_WORKER_RENDERS, MAX_WORKER_RSS_MB)
+
+# Caching HTTP proxy shared by all renders, so apps fetching the same URL share one upstream request.
+# An app's "cache_ttl" in apps_config.json (seconds) overrides the cache headers of what it fetches.
+RENDER_PROXY = os.environ.get("ALIBYT_RENDER_PROXY", "1") != "0"
+RENDER_PROXY_MB = 32
 
-# Track last sent images and timestamps
-last_images = {}
-last_executions = {}
+def app_cache_ttl(app):
+    return (apps_config.get(app) or {}).get("cache_ttl")
 
-def encode_image_to_base64(image_path):
-    """Encodes the image file into a Base64 string."""
+render_proxy = RenderProxy(RENDER_PROXY_MB * 1024 * 1024, app_cache_ttl).start() if RENDER_PROXY else None
+
+# Digest of the last render sent to each device, so only changes are published
+DIGEST_INDEX_PATH = os.path.join(CACHE_PATH, "digests.json")
+COMPARE_PIXELS = False  # Also treat renders with identical decoded frames as unchanged (needs Pillow)
+digest_index = DigestIndex(DIGEST_INDEX_PATH, compare_pixels=COMPARE_PIXELS)
+
+# Renders shared by identical (app, .star source, config, time window) requests
+RENDER_CACHE_PATH = os.path.join(CACHE_PATH, "renders")
+RENDER_CACHE_MB = 64
+render_cache = RenderCache(RENDER_CACHE_PATH, RENDER_CACHE_MB * 1024 * 1024)
+
+# Adaptive refresh: intervals back off while an app's output is unchanged and tighten when it changes.
+# An explicit refresh_rate setting is the longest interval the app is allowed; the catalog default is
+# only the starting point. RENDER_CPU_BUDGET is the average number of busy render workers allowed.
+MIN_REFRESH = 5
+MAX_REFRESH = 3600
+RENDER_CPU_BUDGET = 2.0
+adaptive_refresh = AdaptiveRefresh(MIN_REFRESH, MAX_REFRESH, RENDER_CPU_BUDGET)
+
+# Metrics, published as Prometheus text for the server to export
+registry = Registry()
+PAYLOAD_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576)  # Bytes
+render_seconds = registry.histogram("alibyt_render_seconds", "Time pixlet took to render an app")
+renders_total = registry.counter(
+    "alibyt_renders_total", "Scheduled renders by outcome: changed, unchanged, failed, backoff or skipped"
+)
+payload_bytes = registry.histogram("alibyt_payload_bytes", "Size of published image messages", PAYLOAD_BUCKETS)
+transcode_seconds = registry.histogram("alibyt_transcode_seconds", "Time taken to transcode a render to raw frames")
+published_bytes_total = registry.counter("alibyt_published_bytes_total", "Image bytes published per device")
+publishes_total = registry.counter("alibyt_publishes_total", "Image messages published per device")
+delta_publishes_total = registry.counter("alibyt_delta_publishes_total", "Image messages per device sent as deltas")
+keyframe_requests_total = registry.counter(
+    "alibyt_keyframe_requests_total", "Full images requested by devices that could not apply a delta"
+)
+scheduler_jobs = registry.gauge("alibyt_scheduler_jobs", "Render jobs by state: scheduled, queued or in_flight")
+scheduler_lateness = registry.gauge(
+    "alibyt_scheduler_lateness_seconds", "How late recent renders started: last, avg or max"
+)
+render_pool_stats = registry.gauge("alibyt_render_pool", "Warm pixlet worker pool counters")
+render_cache_stats = registry.gauge("alibyt_render_cache", "Render cache counters")
+render_proxy_stats = registry.gauge("alibyt_render_proxy", "Render HTTP proxy cache counters")
+render_load = registry.gauge("alibyt_render_load", "Estimated busy render workers")
+job_interval = registry.gauge("alibyt_refresh_interval_seconds", "Current adaptive refresh interval per job")
+open_breakers = registry.gauge("alibyt_render_breakers", "Failing render jobs by breaker state")
+
+# Failing jobs back off exponentially and are quarantined after repeated failures. State is kept
+# in the database so the API can show and reset it; devices keep their last good image meanwhile.
+def save_breaker(key, state):
+    db.save_render_breaker(key, key.split("@")[0], state)
+
+render_breakers = CircuitBreaker(on_change=save_breaker)
+render_breakers.load(db.render_breakers())
+
+# Latest render per job, for devices that subscribe between renders
+last_renders = {}
+
+# Publishes of a job happen on render workers and on the scheduler thread (catch-up, brightness and
+# keyframe re-sends). A lock per job keeps them in order, so an older render never lands after a newer one.
+job_locks = {}
+job_locks_lock = threading.Lock()
+
+def job_lock(key):
+    with job_locks_lock:
+        return job_locks.setdefault(key, threading.RLock())
+
+def republish(key, devices):
+    """Sends a job's latest render to `devices` again. Returns False if it hasn't rendered yet."""
+    with job_lock(key):
+        job = render_jobs.get(key)
+        if job is None or key not in last_renders:
+            return False
+        publish_to_devices(job["app"], devices, last_renders[key], job["brightness"])
+        return True
+
+# Renders skipped because no device would show them while fresh
+jit_skips = 0
+
+# Current render jobs: job key -> {"app", "config", "refresh_rate", "brightness", "devices"}; replaced wholesale
+render_jobs = {}
+
+def read_image(image_path):
+    """Reads the raw bytes of a rendered image."""
     try:
         with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode("utf-8")
+            return image_file.read()
     except FileNotFoundError:
-        print(f"Error: File not found - {image_path}")
+        log.error("Rendered image not found: %s", image_path)
         return None
 
-def render_pixlet_app(app_name, app_path, output_path):
-    """Renders a Pixlet app and saves the WebP output."""
+def render_pixlet_app(app_name, app_path, output_path, config=None):
+    """Renders a Pixlet app on a warm worker and saves the WebP output. Raises on failure or timeout."""
+    env = render_proxy.env(app_name) if render_proxy else None
+    return render_pool.render(app_path, output_path, config, timeout=RENDER_TIMEOUT, env=env)
+
+def render_app(app, app_path, output_path, config):
+    """Renders an app and returns the WebP bytes, or None if no image was written."""
+    render_pixlet_app(app, app_path, output_path, config)
+    return read_image(output_path)
+
+def render_error(e):
+    """Short description of a failed render, including pixlet's own error output."""
+    if isinstance(e, subprocess.CalledProcessError) and e.stderr:
+        return f"{e}: {e.stderr.decode('utf-8', 'replace').strip()}"
+    return str(e)
+
+def job_key(app, config):
+    """Identifies one render job: an app plus the config values it is rendered with."""
+    if not config:
+        return app
+    return f"{app}@{hashlib.blake2b(normalize_config(config).encode(), digest_size=4).hexdigest()}"
+
+def build_render_jobs(apps):
+    """Groups every device subscription into one render job per unique (app, config)."""
+    settings = db.all_app_settings()
+    jobs = {}
+    for device, app, overrides in db.all_subscriptions():
+        if app not in apps:
+            log.warning("Skipping %s for %s - not found in config", app, device)
+            continue
+        app_settings = settings.get(app) or {}
+        config = {**app_settings.get("config", {}), **overrides}
+        job = jobs.setdefault(job_key(app, config), {
+            "app": app,
+            "config": config,
+            # An explicit user setting overrides the catalog default
+            "refresh_rate": app_settings.get("refresh_rate") or apps[app]["refresh_rate"],
+            "explicit_refresh": bool(app_settings.get("refresh_rate")),
+            "brightness": app_settings.get("brightness"),
+            "devices": [],
+        })
+        job["devices"].append(device)
+    return jobs
+
+def frame_body(app, image_data, profile, brightness=None):
+    """Returns (body, format) of a render for devices with the given device_formats profile."""
+    if profile is None:
+        return image_data, "webp"
+    frame_format, width, height = profile
+    started = time.monotonic()
     try:
-        subprocess.run(["pixlet", "render", app_path, "-o", output_path], check=True)
-        return output_path
-    except subprocess.CalledProcessError as e:
-        print(f"Error rendering {app_name}: {e}")
+        body = raw_frames.transcode(
+            image_data, (width, height), frame_format, 100 if brightness is None else brightness, RAW_GAMMA
+        )
+    except Exception as e:
+        log.warning("Could not transcode %s to %s, sending WebP: %s", app, frame_format, e)
+        return image_data, "webp"
+    transcode_seconds.observe(time.monotonic() - started, format=frame_format)
+    return body, frame_format
+
+def delta_message(app, key, body, digest, frames, deltas):
+    """Returns a delta message against the bundle last sent to `key`, or None if a keyframe is
+    needed. `deltas` caches the result per base bundle, since devices usually share one."""
+    base = sent_bundles.get(key)
+    if base is None:
         return None
+    if base not in deltas:
+        delta = raw_frames.diff(base, body)
+        if delta is not None and len(delta) <= DELTA_MAX_RATIO * len(body):
+            deltas[base] = payload.encode(app, delta, digest, frames, flags=payload.FLAG_DELTA)
+        else:
+            deltas[base] = None
+    return deltas[base]
 
-def process_app(app):
-    """Runs a single app in its own thread, with retry on failures."""
-    global last_images, last_executions
+def publish_to_devices(app, devices, image_data, brightness=None):
+    """Sends a render to every device whose last copy differs, transcoded once per raw frame
+    format for devices that advertise one, as a delta where the device can apply it.
+    Returns the number of publishes."""
+    groups = {}
+    for device in devices:
+        groups.setdefault(device_formats.get(device), []).append(device)
 
-    app_info = apps[app]
-    app_path = os.path.join(app_info["path"], app_info["app_name"])
-    output_path = os.path.join(RENDERED_PATH, app_info["photo_name"])
-    cache_path = os.path.join(CACHE_PATH, app_info["photo_name"])
-    refresh_rate = app_info["refresh_rate"]
+    frames = payload.webp_frame_count(image_data)
+    sent = 0
+    for profile, group in groups.items():
+        body, frame_format = frame_body(app, image_data, profile, brightness)
+        changed, digest = digest_index.check_many([f"{device}/{app}" for device in group], body)
+        if not changed:
+            continue
 
-    while True:
-        current_time = time.time()
+        keyframe = payload.encode(app, body, digest, frames, flags=payload.FLAG_DELETE_OLD)
+        deltas = {}
+        for key in changed:
+            device = key.rsplit("/", 1)[0]
+            message = None
+            if frame_format != "webp" and device in delta_devices:
+                message = delta_message(app, key, body, digest, frames, deltas)
+                sent_bundles[key] = body
+            if message is None:
+                message = keyframe
+            else:
+                delta_publishes_total.inc(device=device)
+            payload_bytes.observe(len(message), app=app, format=frame_format)
+            if device in stream_devices:
+                publish_live(client, app, message, device)
+                publish_update(client, app, keyframe, device)  # Retained for reconnects; not sent to the device now
+            else:
+                publish_update(client, app, message, device)
+            publishes_total.inc(device=device)
+            published_bytes_total.inc(len(message), device=device)
+            if device == DEFAULT_DEVICE and PUBLISH_LEGACY_JSON and frame_format == "webp":
+                client.publish(MQTT_TOPIC, json.dumps({
+                    "app": app,
+                    "image_data": base64.b64encode(image_data).decode("utf-8"),
+                    "delete_old": True
+                }))
+        sent += len(changed)
+    return sent
 
-        if app in last_executions and (current_time - last_executions[app] < refresh_rate):
-            time.sleep(1)
+def send_keyframes(scheduler):
+    """Resends the latest render in full to devices that could not apply a delta."""
+    while keyframe_requests:
+        device, app = keyframe_requests.pop()
+        keyframe_requests_total.inc(device=device)
+        key = next((key for key, job in render_jobs.items() if job["app"] == app and device in job["devices"]), None)
+        if key is None:
+            sent_bundles.pop(f"{device}/{app}", None)
+            digest_index.remove(f"{device}/{app}")
             continue
+        with job_lock(key):
+            sent_bundles.pop(f"{device}/{app}", None)
+            digest_index.remove(f"{device}/{app}")
+            if republish(key, [device]):
+                continue
+        scheduler.wake(key)  # Nothing rendered since a restart; render it now
+
+def render_lead(key):
+    """Seconds ahead of a slot that the job's render should start."""
+    return JIT_LEAD + (adaptive_refresh.render_time(key) or 0)
 
-        print(f"Rendering {app}...")
+def next_render_delay(key, default):
+    """Seconds from this render to the next: the adaptive interval, deferred until just before
+    the first slot that this render will be too old for. Used as the scheduler's interval_fn."""
+    interval = max(adaptive_refresh.interval(key, default), render_breakers.retry_in(key))
+    job = render_jobs.get(key)
+    if job is None or not render_breakers.allow(key):
+        return interval
+    showing = display_tracker.next_showing(job["app"], job["devices"], after=interval)
+    if showing is None:
+        return interval  # Some device hasn't reported its rotation; keep the regular cadence
+    return min(max(interval, showing - render_lead(key)), max(MAX_REFRESH, interval))
 
-        retry_attempts = 3  # Retry up to 3 times if rendering fails
-        success = False
+def process_app(key):
+    """Renders one job once and fans it out to the devices that need it, with retry on failures."""
+    global jit_skips
 
-        for attempt in range(retry_attempts):
-            rendered_image = render_pixlet_app(app, app_path, output_path)
+    job = render_jobs.get(key)
+    app = job["app"] if job else key
+    app_info = apps_config.get(app)
+    if job is None or app_info is None:
+        log.info("Skipping %s - no longer subscribed or in config", key)
+        return False
+    app_path = os.path.join(app_info["path"], app_info["app_name"])
+    output_path = os.path.join(RENDERED_PATH, f"{key}.webp")
+    config = job["config"]
 
-            if rendered_image:
-                image_base64 = encode_image_to_base64(output_path)
+    # A render that would be stale before any device shows it is wasted; the scheduler retries later
+    interval = adaptive_refresh.interval(key, job["refresh_rate"])
+    showing = display_tracker.next_showing(app, job["devices"])
+    if key in last_renders and showing is not None and showing > interval + render_lead(key):
+        jit_skips += 1
+        renders_total.inc(app=app, result="skipped")
+        log.debug("Skipping %s - not shown for %.0fs", key, showing)
+        return False
 
-                if image_base64:
-                    # Compare new image with cached image
-                    if os.path.exists(cache_path):
-                        cached_base64 = encode_image_to_base64(cache_path)
-                        if image_base64 == cached_base64:
-                            print(f"No change in {app}, skipping update.")
-                            last_executions[app] = current_time
-                            success = True
-                            break
+    # Failing jobs wait out their backoff; the scheduler reschedules them for when it ends
+    if not render_breakers.allow(key):
+        renders_total.inc(app=app, result="backoff")
+        return False
 
-                    os.replace(output_path, cache_path)
+    log.debug("Rendering %s", key)
 
-                    print(f"New image rendered for {app}, sending to client...")
-                    last_images[app] = image_base64
-                    last_executions[app] = current_time
+    render_times = []
 
-                    client.publish(MQTT_TOPIC, json.dumps({
-                        "app": app,
-                        "image_data": image_base64,
-                        "delete_old": True
-                    }))
-                    success = True
-                    break
-            else:
-                print(f"Retry {attempt + 1}/{retry_attempts} for {app}...")
-                time.sleep(random.randint(2, 5))  # Wait 2-5 seconds before retrying
+    def timed_render():
+        started = time.monotonic()
+        try:
+            return render_app(app, app_path, output_path, config)
+        finally:
+            render_times.append(time.monotonic() - started)
+            render_seconds.observe(render_times[-1], app=app)
+
+    # Identical (app, source, config) renders within one refresh window are shared
+    try:
+        cache_key = render_cache.key(app, app_path, config, time_bucket(interval))
+        image_data = render_cache.get_or_render(cache_key, timed_render)
+        error = None if image_data else "Render produced no image"
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError) as e:
+        image_data = None
+        error = render_error(e)
+
+    if not image_data:
+        state = render_breakers.record_failure(key, error)
+        renders_total.inc(app=app, result="failed")
+        retry_in = state["retry_at"] - time.time()
+        if state["state"] == QUARANTINED:
+            log.error("Quarantined %s after %d failures, probing again in %.0fs: %s",
+                      key, state["failures"], retry_in, error)
+        else:
+            log.warning("Error rendering %s (failure %d), retrying in %.0fs: %s",
+                        key, state["failures"], retry_in, error)
+        return False
 
-        if not success:
-            print(f"Failed to render {app} after {retry_attempts} attempts. Skipping.")
-        
-        time.sleep(1)  # Prevent CPU overload
+    render_breakers.record_success(key)
+    with job_lock(key):
+        if key not in render_jobs:
+            return False  # Unscheduled while rendering; its devices no longer want it
+        changed = last_renders.get(key) != image_data
+        last_renders[key] = image_data
+        adaptive_refresh.record(key, changed, render_times[-1] if render_times else None)
+        job = render_jobs[key]  # Devices or brightness may have changed while rendering
+        sent = publish_to_devices(app, job["devices"], image_data, job["brightness"])
+    renders_total.inc(app=app, result="changed" if sent else "unchanged")
+    if sent:
+        log.info("New image rendered for %s, sent to %d/%d devices", key, sent, len(job["devices"]))
+    else:
+        log.debug("No change in %s, skipping update", key)
+    return True
+
+def collect_metrics(scheduler):
+    """Refreshes the gauges that mirror other components' stats."""
+    stats = scheduler.stats()
+    for state in ("scheduled", "queue_depth", "in_flight"):
+        scheduler_jobs.set(stats[state], state=state)
+    for stat in ("last", "avg", "max"):
+        scheduler_lateness.set(stats[f"lateness_{stat}"], stat=stat)
+    for name, value in render_pool.stats().items():
+        render_pool_stats.set(value, stat=name)
+    for name, value in render_cache.stats().items():
+        render_cache_stats.set(value, stat=name)
+    if render_proxy:
+        for name, value in render_proxy.stats().items():
+            render_proxy_stats.set(value, stat=name)
+
+    refresh_stats = adaptive_refresh.stats()
+    render_load.set(refresh_stats["load"])
+    job_interval.clear()
+    for key, job_stats in refresh_stats["jobs"].items():
+        job_interval.set(job_stats["interval"], job=key)
+
+    breakers = {}
+    for state in render_breakers.states().values():
+        breakers[state["state"]] = breakers.get(state["state"], 0) + 1
+    open_breakers.clear()
+    for state, count in breakers.items():
+        open_breakers.set(count, state=state)
 
 def run_scheduler():
-    """Runs the scheduler, creating threads for each app."""
-    threads = []
+    """Keeps the render scheduler in sync with the database and catalog, and reports its stats."""
+    global render_jobs
+
+    scheduler = RenderScheduler(process_app, max_workers=MAX_RENDER_WORKERS, interval_fn=next_render_delay)
+    threading.Thread(target=scheduler.run, daemon=True).start()
+    last_stats = last_health_check = last_metrics = time.monotonic()
+    seen = None
+
+    # (device, app) pairs with a retained image, including ones from before a restart
+    published = set()
+    sent_manifests = {}  # device -> app list last published on its manifest topic
+    for key in digest_index.apps():
+        device, _, app = key.rpartition("/")
+        published.add((device or DEFAULT_DEVICE, app))
 
     while True:
-        try:
-            with open(SUBSCRIPTIONS_PATH, "r") as f:
-                subscriptions = json.load(f)
-                subscribed_apps = set(subscriptions.get("subscribed_apps", []))
-        except json.JSONDecodeError:
-            print("Error: `database.json` is corrupted. Resetting to default.")
-            subscribed_apps = set()
-            with open(SUBSCRIPTIONS_PATH, "w") as f:
-                json.dump({"subscribed_apps": []}, f, indent=4)
-
-        for app in subscribed_apps:
-            if app not in apps:
-                print(f"Skipping {app} - Not found in config!")
-                continue
+        # Reconcile only when the database version or the catalog file has changed
+        apps = apps_config.snapshot()
+        current = (db.version(), id(apps))
+        if current != seen:
+            seen = current
+            # Pick up breakers reset through the API and render those jobs right away
+            tripped = set(render_breakers.states())
+            render_breakers.load(db.render_breakers())
+            for key in tripped - set(render_breakers.states()):
+                scheduler.wake(key)
+            previous_jobs = render_jobs
+            render_jobs = build_render_jobs(apps)
+
+            for key, job in render_jobs.items():
+                adaptive_refresh.configure(key, job["refresh_rate"], job["explicit_refresh"])
+            added, removed = scheduler.sync({key: job["refresh_rate"] for key, job in render_jobs.items()})
+            for key in added:
+                log.info("Scheduled %s every %ss for %d devices",
+                         key, render_jobs[key]["refresh_rate"], len(render_jobs[key]["devices"]))
+            for key in removed:
+                log.info("Unscheduled %s", key)
+                with job_lock(key):
+                    last_renders.pop(key, None)
+                with job_locks_lock:
+                    job_locks.pop(key, None)
+                adaptive_refresh.forget(key)
+
+            wanted = {(device, job["app"]) for job in render_jobs.values() for device in job["devices"]}
+
+            # Retained list of each device's apps, so a client that was offline when an app was cleared
+            # drops it from its disk cache; the cleared retained image alone never reaches it
+            manifests = {device: [] for device, _ in published | wanted}
+            manifests.update({device: [] for device in sent_manifests})
+            for device, app in sorted(wanted):
+                manifests[device].append(app)
+            for device, apps_list in manifests.items():
+                if sent_manifests.get(device) != apps_list:
+                    client.publish(manifest_topic(device), json.dumps({"apps": apps_list}), qos=1, retain=True)
+                    sent_manifests[device] = apps_list
+            for device, app in published - wanted:
+                log.info("Clearing %s from %s", app, device)
+                clear_update(client, app, device)
+                sent_bundles.pop(f"{device}/{app}", None)
+                digest_index.remove(f"{device}/{app}", *([app] if device == DEFAULT_DEVICE else []))
+
+            # Devices that just subscribed get the job's latest render without waiting for the next one
+            for key, job in render_jobs.items():
+                new_devices = [device for device in job["devices"] if (device, job["app"]) not in published]
+                if new_devices:
+                    republish(key, new_devices)
+            published = wanted
+
+            # Raw bundles have the app's brightness baked in, so re-transcode the latest render
+            # when it changes rather than waiting for the next one; WebP devices see no change
+            for key, job in render_jobs.items():
+                previous = previous_jobs.get(key)
+                if previous and previous["brightness"] != job["brightness"]:
+                    republish(key, job["devices"])
+
+            # Stop warm workers for apps no device wants any more
+            rendered_apps = {job["app"] for job in render_jobs.values()}
+            for key in removed:
+                app = key.split("@")[0]
+                if app not in rendered_apps and app in apps:
+                    render_pool.forget(os.path.join(apps[app]["path"], apps[app]["app_name"]))
+
+        if keyframe_requests:
+            send_keyframes(scheduler)
+
+        if time.monotonic() - last_health_check >= HEALTH_CHECK_INTERVAL:
+            render_pool.health_check()
+            last_health_check = time.monotonic()
+
+        if time.monotonic() - last_metrics >= METRICS_INTERVAL:
+            collect_metrics(scheduler)
+            client.publish(PUBLISHER_METRICS_TOPIC, registry.render(), retain=True)
+            last_metrics = time.monotonic()
 
-            # Start a new thread for each app
-            if app not in last_executions:
-                thread = threading.Thread(target=process_app, args=(app,))
-                thread.daemon = True
-                thread.start()
-                threads.append(thread)
+        if time.monotonic() - last_stats >= STATS_INTERVAL:
+            stats = scheduler.stats()
+            log.info(
+                "Scheduler: %d jobs, queue depth %d, %d in flight, lateness avg %.2fs max %.2fs",
+                stats["scheduled"], stats["queue_depth"], stats["in_flight"],
+                stats["lateness_avg"], stats["lateness_max"],
+            )
+            pool_stats = render_pool.stats()
+            log.info(
+                "Render pool: %d workers, %d warm / %d cold renders, %d recycled",
+                pool_stats["workers"], pool_stats["warm_renders"], pool_stats["cold_renders"], pool_stats["recycled"],
+            )
+            cache_stats = render_cache.stats()
+            log.info(
+                "Render cache: %d hits, %d misses, %d coalesced, %d entries (%d KiB)",
+                cache_stats["hits"], cache_stats["misses"], cache_stats["coalesced"],
+                cache_stats["entries"], cache_stats["bytes"] // 1024,
+            )
+            if render_proxy:
+                proxy_stats = render_proxy.stats()
+                log.info(
+                    "Render proxy: %d hits, %d misses, %d coalesced, %d revalidated, %d tunnels, %d entries (%d KiB)",
+                    proxy_stats["hits"], proxy_stats["misses"], proxy_stats["coalesced"], proxy_stats["revalidated"],
+                    proxy_stats["tunnels"], proxy_stats["entries"], proxy_stats["bytes"] // 1024,
+                )
+            refresh_stats = adaptive_refresh.stats()
+            log.info(
+                "Render load %.2f of %s workers, %d renders skipped, %d devices reporting",
+                refresh_stats["load"], refresh_stats["budget"], jit_skips, len(display_tracker.stats()),
+            )
+            for key, job_stats in sorted(refresh_stats["jobs"].items()):
+                duration = f"{job_stats['duration']:.2f}s" if job_stats["duration"] is not None else "n/a"
+                log.debug(
+                    "  %s: every %.0fs, render %s, %d/%d unchanged",
+                    key, job_stats["interval"], duration, job_stats["unchanged"], job_stats["renders"],
+                )
+            last_stats = time.monotonic()
 
-        time.sleep(5)  # Give time for new apps to be detected
+        changes_event.wait(CHANGE_POLL_INTERVAL)
+        changes_event.clear()
 
 if __name__ == "__main__":
     try:
         run_scheduler()
     except KeyboardInterrupt:
-        print("Exiting MQTT publisher...")
+        log.info("Exiting MQTT publisher...")
+    finally:
+        render_pool.close()
+        if render_proxy:
+            render_proxy.close()
@@ -0,0 +1,60 @@
+"""Binary image message format shared with alibyt-client/payload.py.
+
+Layout (network byte order):
+
+    magic      4s   b"ABYT"
+    version    B    PROTOCOL_VERSION
+    flags      B    FLAG_* bits
+    frames     H    number of frames in the body
+    app_len    B    length of the UTF-8 app id
+    hash       16s  BLAKE2b-128 digest of the body
+    app id     app_len bytes
+    body       WebP bytes, a raw_frames bundle, or a raw_frames delta with FLAG_DELTA
+"""
+import struct
+
+MAGIC = b"ABYT"
+PROTOCOL_VERSION = 1
+HEADER = struct.Struct("!4sBBHB16s")
+
+# Header flags
+FLAG_DELETE_OLD = 0x01  # Replace the client's previous image for this app
+FLAG_DELTA = 0x02  # Body is a raw_frames delta against the client's current bundle for this app
+
+
+def webp_frame_count(data):
+    """Counts ANMF chunks in a WebP container without decoding it. Still images count as 1."""
+    if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"WEBP":
+        return 1
+    frames = 0
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        size = int.from_bytes(data[offset + 4:offset + 8], "little")
+        if chunk_id == b"ANMF":
+            frames += 1
+        offset += 8 + size + (size & 1)  # Chunks are padded to even sizes
+    return max(frames, 1)
+
+
+def encode(app_name, body, digest, frames=None, flags=0):
+    """Builds a binary message. `digest` is the hex content digest of `body`."""
+    app_id = app_name.encode("utf-8")
+    if frames is None:
+        frames = webp_frame_count(body)
+    header = HEADER.pack(MAGIC, PROTOCOL_VERSION, flags, frames, len(app_id), bytes.fromhex(digest))
+    return header + app_id + body
+
+
+def decode(message):
+    """Parses a binary message into (app_name, body, digest, frames, flags)."""
+    if len(message) < HEADER.size:
+        raise ValueError("Message shorter than header")
+    magic, version, flags, frames, app_len, digest = HEADER.unpack_from(message)
+    if magic != MAGIC:
+        raise ValueError("Bad magic")
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported protocol version {version}")
+    start = HEADER.size + app_len
+    app_name = bytes(message[HEADER.size:start]).decode("utf-8")
+    return app_name, message[start:], digest.hex(), frames, flags
@@ -0,0 +1,143 @@
+"""Display-native frame bundles, shared with alibyt-client/raw_frames.py.
+
+Clients that advertise a raw format get these instead of WebP: frames already sized to the
+panel with brightness and gamma applied, so the client only inflates and copies pixels.
+
+Layout (network byte order):
+
+    magic      4s   b"ABRF"
+    format     B    FORMAT_* code
+    codec      B    CODEC_* code of the pixel data
+    width      H
+    height     H
+    frames     H
+    durations  frames x H   milliseconds per frame
+    pixels     frames x height x width pixels, row-major, compressed as one stream
+
+A delta turns one bundle into the next when only some pixels changed:
+
+    magic      4s   b"ABRD"
+    base       16s  frames_digest() of the bundle it applies to
+    target     16s  frames_digest() of the result
+    bundle     the target's bundle, with its pixels XORed against the base's
+
+Unchanged pixels XOR to zero, which the codec squeezes to almost nothing.
+"""
+import hashlib
+import struct
+import zlib
+from io import BytesIO
+
+try:
+    from PIL import Image, ImageChops, ImageSequence
+except ImportError:  # Transcoding is optional on the server; clients then get WebP
+    Image = None
+
+MAGIC = b"ABRF"
+HEADER = struct.Struct("!4sBBHHH")
+
+# Pixel formats
+FORMAT_RGB888 = 1  # 3 bytes per pixel: R, G, B
+FORMAT_RGB565 = 2  # 2 bytes per pixel, little-endian RRRRRGGGGGGBBBBB
+FORMATS = {"rgb888": FORMAT_RGB888, "rgb565": FORMAT_RGB565}
+
+DELTA_MAGIC = b"ABRD"
+DELTA_HEADER = struct.Struct("!4s16s16s")
+
+# Pixel data codecs
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+ZLIB_LEVEL = 1  # Fastest; panel frames are mostly flat colour and compress well anyway
+
+DEFAULT_FRAME_DURATION = 100  # Milliseconds, used when a frame carries no duration
+
+
+def is_bundle(data):
+    return data[:4] == MAGIC
+
+
+def _pack(code, size, durations, pixels):
+    header = HEADER.pack(MAGIC, code, CODEC_ZLIB, size[0], size[1], len(durations))
+    return header + struct.pack(f"!{len(durations)}H", *durations) + zlib.compress(pixels, ZLIB_LEVEL)
+
+
+def unpack(bundle):
+    """Parses a bundle into (format code, size, durations, uncompressed pixel bytes)."""
+    magic, code, codec, width, height, count = HEADER.unpack_from(bundle)
+    if magic != MAGIC:
+        raise ValueError("Bad magic")
+    durations = list(struct.unpack_from(f"!{count}H", bundle, HEADER.size))
+    pixels = bundle[HEADER.size + 2 * count:]
+    if codec == CODEC_ZLIB:
+        pixels = zlib.decompress(pixels)
+    elif codec != CODEC_NONE:
+        raise ValueError(f"Unsupported codec {codec}")
+    return code, (width, height), durations, bytes(pixels)
+
+
+def frames_digest(code, size, durations, pixels):
+    """Digest of what a bundle shows, independent of how its pixels were compressed."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(struct.pack(f"!BHHH{len(durations)}H", code, size[0], size[1], len(durations), *durations))
+    h.update(pixels)
+    return h.digest()
+
+
+def diff(base, target):
+    """Returns a delta turning bundle `base` into bundle `target`, or None if the two differ
+    in format, size or frame count and a full bundle has to be sent instead."""
+    base_code, base_size, base_durations, base_pixels = unpack(base)
+    code, size, durations, pixels = unpack(target)
+    if (base_code, base_size, len(base_durations)) != (code, size, len(durations)):
+        return None
+    xor = (int.from_bytes(base_pixels, "little") ^ int.from_bytes(pixels, "little")).to_bytes(len(pixels), "little")
+    header = DELTA_HEADER.pack(
+        DELTA_MAGIC,
+        frames_digest(base_code, base_size, base_durations, base_pixels),
+        frames_digest(code, size, durations, pixels),
+    )
+    return header + _pack(code, size, durations, xor)
+
+
+def _levels(brightness, gamma):
+    """Per-channel lookup table applying gamma then brightness (0-100), or None if it is a no-op."""
+    if brightness == 100 and gamma == 1.0:
+        return None
+    scale = max(0, min(brightness, 100)) / 100
+    return [round(255 * (value / 255) ** gamma * scale) for value in range(256)]
+
+
+def _rgb565(image):
+    """Packs an RGB image as little-endian RGB565 using Pillow's band operations."""
+    r, g, b = image.split()
+    # The bit fields of each byte don't overlap, so adding them never saturates
+    high = ImageChops.add(r.point(lambda v: v & 0xF8), g.point(lambda v: v >> 5))
+    low = ImageChops.add(g.point(lambda v: (v >> 2 & 0x07) << 5), b.point(lambda v: v >> 3))
+    return Image.merge("LA", (low, high)).tobytes()
+
+
+def transcode(image_data, size, frame_format="rgb888", brightness=100, gamma=1.0):
+    """Decodes WebP bytes once and returns them as a bundle of `size` frames in `frame_format`.
+
+    Raises RuntimeError if Pillow is not installed and ValueError for an unknown format.
+    """
+    if Image is None:
+        raise RuntimeError("Pillow is required to transcode renders")
+    if frame_format not in FORMATS:
+        raise ValueError(f"Unknown frame format {frame_format!r}")
+    code = FORMATS[frame_format]
+    lut = _levels(brightness, gamma)
+
+    image = Image.open(BytesIO(image_data))
+    durations = []
+    pixels = []
+    for frame in ImageSequence.Iterator(image):
+        rgb = frame.convert("RGB")
+        if rgb.size != size:
+            rgb = rgb.resize(size)
+        if lut is not None:
+            rgb = rgb.point(lut * 3)
+        pixels.append(rgb.tobytes() if code == FORMAT_RGB888 else _rgb565(rgb))
+        durations.append(min(frame.info.get("duration") or DEFAULT_FRAME_DURATION, 0xFFFF))
+
+    return _pack(code, size, durations, b"".join(pixels))
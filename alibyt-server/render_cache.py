@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from single_flight import SingleFlight
+
+RENDER_EXTENSION = ".webp"
+
+
+def normalize_config(config):
+    """Canonical text for a config dict, so equal settings always produce the same key."""
+    return json.dumps({str(key): str(value) for key, value in (config or {}).items()},
+                      sort_keys=True, separators=(",", ":"))
+
+
+def time_bucket(interval, now=None):
+    """Index of the `interval`-second window containing `now`."""
+    return int((time.time() if now is None else now) // max(interval, 1))
+
+
+class RenderCache:
+    """Size-bounded on-disk LRU of renders keyed by (app, .star hash, config, time bucket).
+
+    Concurrent requests for the same key are coalesced: the first caller renders and the
+    others wait for its result instead of starting their own pixlet run.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> size in bytes, least recently used first
+        self._flights = SingleFlight(self._lock)
+        self._star_hashes = {}  # path -> ((mtime_ns, size), digest)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+        # Adopt renders left by a previous run, oldest first
+        files = []
+        for filename in os.listdir(cache_dir):
+            if filename.endswith(RENDER_EXTENSION):
+                stat = os.stat(os.path.join(cache_dir, filename))
+                files.append((stat.st_mtime, filename[:-len(RENDER_EXTENSION)], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self.nbytes += size
+        self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}{RENDER_EXTENSION}")
+
+    def star_hash(self, star_path):
+        """BLAKE2 digest of a .star file, recomputed only when its mtime or size changes."""
+        stat = os.stat(star_path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        cached = self._star_hashes.get(star_path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        with open(star_path, "rb") as f:
+            digest = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+        self._star_hashes[star_path] = (stamp, digest)
+        return digest
+
+    def key(self, app_name, star_path, config, bucket):
+        """Cache key for one render of an app."""
+        h = hashlib.blake2b(digest_size=16)
+        for part in (app_name, self.star_hash(star_path), normalize_config(config), str(bucket)):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def _read(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _store(self, key, data):
+        tmp_path = f"{self._path(key)}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+        with self._lock:
+            self.nbytes += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._evict()
+
+    def _evict(self):
+        """Drops least recently used renders until under budget. Call with the lock held."""
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self.nbytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def get_or_render(self, key, render_fn):
+        """Returns cached bytes for `key`, or calls `render_fn()` once for all concurrent callers.
+
+        `render_fn` returns the rendered bytes, or None on failure (which is not cached).
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                hit = True
+            else:
+                hit = False
+                flight, leader = self._flights.join(key)
+                if leader:
+                    self.misses += 1
+                else:
+                    self.coalesced += 1
+
+        if hit:
+            data = self._read(key)
+            if data is not None:
+                with self._lock:
+                    self.hits += 1
+                return data
+            # File vanished underneath us; render again
+            with self._lock:
+                self.nbytes -= self._entries.pop(key, 0)
+            return self.get_or_render(key, render_fn)
+
+        def render():
+            data = render_fn()
+            if data is not None:
+                self._store(key, data)
+            return data
+
+        return self._flights.run(key, flight, leader, render)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.nbytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,245 @@
+import logging
+import os
+import socket
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+
+# Pixlet binary; override with PIXLET_BIN to point at a stand-in
+PIXLET_BIN = os.environ.get("PIXLET_BIN", "pixlet")
+
+# Endpoints exposed by `pixlet serve`
+PREVIEW_PATH = "/api/v1/preview.webp"
+HEALTH_PATH = "/"
+
+STARTUP_TIMEOUT = 15  # Seconds to wait for a worker to start serving
+RENDER_TIMEOUT = 30  # Seconds to wait for a single render
+
+log = logging.getLogger("alibyt.render_pool")
+
+
+def _environ(env):
+    """The process environment with `env` layered on top, or None to inherit it unchanged."""
+    return {**os.environ, **env} if env else None
+
+
+def render_subprocess(app_path, output_path, config=None, timeout=None, env=None):
+    """Renders an app with a one-off `pixlet render` process (the cold path)."""
+    args = [PIXLET_BIN, "render", app_path]
+    args += [f"{key}={value}" for key, value in (config or {}).items()]
+    args += ["-o", output_path]
+    subprocess.run(args, check=True, timeout=timeout, env=_environ(env),
+                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    return output_path
+
+
+def _free_port():
+    """Asks the OS for an unused local TCP port."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class PixletWorker:
+    """A long-lived `pixlet serve` process with one app already loaded.
+
+    `env` holds extra environment variables for the process, e.g. to route its fetches through
+    the render proxy.
+    """
+
+    def __init__(self, app_path, env=None):
+        self.app_path = app_path
+        self.port = _free_port()
+        self.renders = 0
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()  # One render at a time per worker
+        self.ready = threading.Event()  # Set once startup finished, successfully or not
+        self.started = False  # Whether it came up and answered health checks
+        self.proc = subprocess.Popen(
+            [PIXLET_BIN, "serve", app_path, "--host", "127.0.0.1", "--port", str(self.port)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            env=_environ(env),
+        )
+
+    def _url(self, path, config=None):
+        query = f"?{urllib.parse.urlencode(config)}" if config else ""
+        return f"http://127.0.0.1:{self.port}{path}{query}"
+
+    def wait_ready(self, timeout=STARTUP_TIMEOUT):
+        """Blocks until the worker answers health checks. Returns False if it never does."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.healthy():
+                return True
+            if self.proc.poll() is not None:
+                return False
+            time.sleep(0.1)
+        return False
+
+    def healthy(self):
+        """True if the process is alive and answering HTTP."""
+        if self.proc.poll() is not None:
+            return False
+        try:
+            with urllib.request.urlopen(self._url(HEALTH_PATH), timeout=2) as response:
+                return response.status == 200
+        except (urllib.error.URLError, OSError):
+            return False
+
+    def rss_bytes(self):
+        """Resident memory of the worker process, or 0 where /proc is unavailable."""
+        try:
+            with open(f"/proc/{self.proc.pid}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError):
+            pass
+        return 0
+
+    def render(self, config=None, timeout=RENDER_TIMEOUT):
+        """Renders the loaded app and returns the WebP bytes."""
+        with urllib.request.urlopen(self._url(PREVIEW_PATH, config), timeout=timeout) as response:
+            data = response.read()
+        self.renders += 1
+        self.last_used = time.monotonic()
+        return data
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+
+
+class RenderPool:
+    """Keeps warm Pixlet workers per app, recycling them and falling back to `pixlet render`."""
+
+    def __init__(self, max_workers=8, max_renders=500, max_rss_mb=256):
+        self.max_workers = max_workers
+        self.max_renders = max_renders
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self._workers = OrderedDict()  # app_path -> PixletWorker, least recently used first
+        self._lock = threading.Lock()
+        self.warm_renders = 0
+        self.cold_renders = 0
+        self.recycled = 0
+
+    def _checkout(self, app_path, env=None):
+        """Returns a ready worker for `app_path`, starting one (and evicting the LRU) if needed.
+
+        Callers that find a worker still starting wait for it rather than racing its startup.
+        Returns None if the worker didn't come up.
+        """
+        evicted = []
+        with self._lock:
+            worker = self._workers.get(app_path)
+            starting = worker is None
+            if starting:
+                while len(self._workers) >= self.max_workers:
+                    _, old = self._workers.popitem(last=False)
+                    evicted.append(old)
+                worker = PixletWorker(app_path, env)
+                self._workers[app_path] = worker
+            else:
+                self._workers.move_to_end(app_path)
+
+        for old in evicted:
+            old.close()
+
+        if starting:
+            try:
+                worker.started = worker.wait_ready()
+            finally:
+                worker.ready.set()
+            if not worker.started:
+                self._discard(app_path, worker)
+        else:
+            worker.ready.wait()
+        return worker if worker.started else None
+
+    def _discard(self, app_path, worker):
+        with self._lock:
+            if self._workers.get(app_path) is worker:
+                del self._workers[app_path]
+        worker.close()
+
+    def render(self, app_path, output_path, config=None, timeout=RENDER_TIMEOUT, env=None):
+        """Renders `app_path` into `output_path` on a warm worker, falling back to a subprocess.
+
+        `env` adds environment variables to pixlet processes started for the render; a worker
+        that is already running keeps the environment it was started with.
+
+        Raises subprocess.TimeoutExpired if the app takes longer than `timeout` seconds; the
+        hung worker or process is killed.
+        """
+        try:
+            worker = self._checkout(app_path, env)
+        except OSError as e:
+            log.warning("Could not start pixlet worker for %s: %s", app_path, e)
+            worker = None
+
+        if worker is not None:
+            try:
+                with worker.lock:
+                    data = worker.render(config, timeout)
+                with open(output_path, "wb") as f:
+                    f.write(data)
+                self.warm_renders += 1
+
+                if worker.renders >= self.max_renders or worker.rss_bytes() > self.max_rss:
+                    self.recycled += 1
+                    self._discard(app_path, worker)
+                return output_path
+            except (urllib.error.URLError, OSError) as e:
+                self._discard(app_path, worker)
+                if isinstance(e, socket.timeout) or isinstance(getattr(e, "reason", None), socket.timeout):
+                    # The app itself hangs; a cold render would only hang for another `timeout`
+                    raise subprocess.TimeoutExpired(app_path, timeout) from e
+                log.warning("Pixlet worker failed for %s, falling back to pixlet render: %s", app_path, e)
+
+        self.cold_renders += 1
+        return render_subprocess(app_path, output_path, config, timeout, env)
+
+    def health_check(self):
+        """Drops workers that died or stopped answering."""
+        with self._lock:
+            workers = list(self._workers.items())
+        for app_path, worker in workers:
+            if not worker.ready.is_set() or worker.lock.locked():
+                continue  # Still starting, or busy rendering, which is healthy enough
+            if not worker.healthy():
+                log.warning("Pixlet worker for %s is unhealthy, recycling", app_path)
+                self.recycled += 1
+                self._discard(app_path, worker)
+
+    def forget(self, app_path):
+        """Stops the worker for an app that is no longer scheduled."""
+        with self._lock:
+            worker = self._workers.pop(app_path, None)
+        if worker is not None:
+            worker.close()
+
+    def close(self):
+        with self._lock:
+            workers = list(self._workers.values())
+            self._workers.clear()
+        for worker in workers:
+            worker.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": len(self._workers),
+                "warm_renders": self.warm_renders,
+                "cold_renders": self.cold_renders,
+                "recycled": self.recycled,
+            }
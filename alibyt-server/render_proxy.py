@@ -0,0 +1,361 @@
+import base64
+import calendar
+import email.utils
+import logging
+import select
+import socket
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from single_flight import SingleFlight
+
+UPSTREAM_TIMEOUT = 15  # Seconds to wait for an upstream server
+TUNNEL_IDLE_TIMEOUT = 60  # Seconds a CONNECT tunnel may sit idle before it is closed
+
+# Responses that may be stored when they carry freshness or validators (RFC 9111)
+CACHEABLE_STATUSES = {200, 203, 204, 300, 301, 308, 404, 410}
+
+# Headers that belong to one connection and are never forwarded or stored
+HOP_BY_HOP = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "proxy-connection",
+    "te", "trailer", "transfer-encoding", "upgrade",
+}
+
+# Request headers that don't change the response, so they are left out of the cache key
+UNKEYED_HEADERS = HOP_BY_HOP | {"host", "user-agent", "accept-encoding", "content-length"}
+
+log = logging.getLogger("alibyt.render_proxy")
+
+
+def _cache_control(headers):
+    """Parses Cache-Control into a dict of lower-case directive -> value (None for bare flags)."""
+    directives = {}
+    for value in headers.get_all("Cache-Control") or []:
+        for part in value.split(","):
+            name, _, arg = part.strip().partition("=")
+            if name:
+                directives[name.lower()] = arg.strip('"') or None
+    return directives
+
+
+def _seconds(value):
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _http_date(value):
+    parsed = email.utils.parsedate(value) if value else None
+    return calendar.timegm(parsed) if parsed else None
+
+
+def freshness(headers):
+    """Seconds a response stays fresh according to its headers, or None if it must not be stored.
+
+    s-maxage and max-age win over Expires; no-cache responses are stored but always revalidated.
+    The Age the response already had upstream is subtracted.
+    """
+    directives = _cache_control(headers)
+    if "no-store" in directives or "private" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0
+    lifetime = _seconds(directives.get("s-maxage"))
+    if lifetime is None:
+        lifetime = _seconds(directives.get("max-age"))
+    if lifetime is None:
+        expires = _http_date(headers.get("Expires"))
+        if expires is not None:
+            date = _http_date(headers.get("Date")) or time.time()
+            lifetime = max(expires - date, 0)
+        elif "Expires" in headers:
+            lifetime = 0  # An invalid Expires means already expired
+    if lifetime is None:
+        return 0
+    return max(lifetime - (_seconds(headers.get("Age")) or 0), 0)
+
+
+class _Entry:
+    """One stored upstream response."""
+
+    def __init__(self, status, headers, body, lifetime):
+        self.status = status
+        self.headers = [(name, value) for name, value in headers.items() if name.lower() not in HOP_BY_HOP]
+        self.body = body
+        self.lifetime = lifetime  # Seconds fresh according to the upstream headers
+        self.stored_at = time.monotonic()
+        self.etag = headers.get("ETag")
+        self.last_modified = headers.get("Last-Modified")
+
+    def age(self):
+        return time.monotonic() - self.stored_at
+
+    def fresh(self, ttl=None):
+        """True while the entry is younger than `ttl`, or its own lifetime if `ttl` is None."""
+        return self.age() < (self.lifetime if ttl is None else ttl)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Hands redirects back to the client, which follows them itself."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class RenderProxy:
+    """Local caching HTTP proxy shared by every pixlet render.
+
+    Pixlet processes are pointed at it with HTTP_PROXY and HTTPS_PROXY (see env()), with the app
+    name as the proxy user so per-app TTLs can apply. Plain HTTP GETs are cached in memory under
+    a byte budget, honouring Cache-Control, Expires and validators; concurrent requests for the
+    same URL share one upstream fetch. Only plain-HTTP apps benefit: HTTPS is tunnelled with
+    CONNECT, uncached and uncoalesced, since caching it would mean terminating TLS with a local CA.
+
+    `ttl_fn(app)` returns the app's TTL override in seconds, or None to follow the headers. An
+    override applies to every response the app fetches, even ones the headers forbid storing.
+    """
+
+    def __init__(self, max_bytes, ttl_fn=None, host="127.0.0.1", port=0):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes // 8  # One large response shouldn't flush everything else
+        self.ttl_fn = ttl_fn or (lambda app: None)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> _Entry, least recently used first
+        self._flights = SingleFlight(self._lock)
+        self._opener = urllib.request.build_opener(urllib.request.ProxyHandler({}), _NoRedirect)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.revalidated = 0
+        self.stale = 0
+        self.uncacheable = 0
+        self.tunnels = 0
+        self.errors = 0
+        self.evictions = 0
+
+        self._server = ThreadingHTTPServer((host, port), _ProxyHandler)
+        self._server.daemon_threads = True
+        self._server.proxy = self
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="render-proxy", daemon=True)
+        self._thread.start()
+        log.info("Render proxy listening on %s:%d", self.host, self.port)
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def env(self, app):
+        """Environment variables that route a pixlet process for `app` through the proxy."""
+        url = f"http://{urllib.parse.quote(app, safe='')}:x@{self.host}:{self.port}"
+        return {"HTTP_PROXY": url, "HTTPS_PROXY": url, "http_proxy": url, "https_proxy": url}
+
+    @staticmethod
+    def key(url, headers):
+        """Cache key for a GET: the URL plus any request headers that could change the response."""
+        keyed = sorted((name.lower(), value) for name, value in headers.items() if name.lower() not in UNKEYED_HEADERS)
+        return "\n".join([url] + [f"{name}: {value}" for name, value in keyed])
+
+    def _ttl(self, app):
+        try:
+            ttl = self.ttl_fn(app) if app else None
+            return None if ttl is None else max(float(ttl), 0)
+        except (TypeError, ValueError):
+            return None
+
+    def _fetch(self, url, headers, stale):
+        """Fetches `url` upstream, revalidating `stale` if it has validators.
+
+        Returns (status, headers, body), or None if the upstream server couldn't be reached.
+        """
+        request = urllib.request.Request(url, headers=headers)
+        if stale is not None:
+            if stale.etag:
+                request.add_header("If-None-Match", stale.etag)
+            if stale.last_modified:
+                request.add_header("If-Modified-Since", stale.last_modified)
+        try:
+            with self._opener.open(request, timeout=UPSTREAM_TIMEOUT) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            with e:
+                return e.code, e.headers, e.read()
+        except (urllib.error.URLError, OSError) as e:
+            log.warning("Upstream fetch of %s failed: %s", url, e)
+            return None
+
+    def _store(self, key, entry):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= len(old.body)
+            self._entries[key] = entry
+            self.nbytes += len(entry.body)
+            while self.nbytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= len(evicted.body)
+                self.evictions += 1
+
+    def _forget(self, key):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= len(old.body)
+
+    def _refresh(self, key, url, headers, stale, ttl):
+        """Fetches `url` upstream and updates the cache. Returns (status, headers, body, cached)."""
+        fetched = self._fetch(url, headers, stale)
+        if fetched is None:
+            if stale is None:
+                return None
+            with self._lock:
+                self.stale += 1
+            return stale.status, stale.headers, stale.body, True  # Serve stale rather than fail
+
+        status, response_headers, body = fetched
+        if status == 304 and stale is not None:
+            refreshed = _Entry(stale.status, response_headers, stale.body, freshness(response_headers) or 0)
+            refreshed.headers = stale.headers  # A 304 only carries updated freshness
+            refreshed.etag = refreshed.etag or stale.etag
+            refreshed.last_modified = refreshed.last_modified or stale.last_modified
+            self._store(key, refreshed)
+            with self._lock:
+                self.revalidated += 1
+            return stale.status, stale.headers, stale.body, True
+
+        lifetime = freshness(response_headers)
+        if ttl is not None and lifetime is None:
+            lifetime = 0  # The override keeps it fresh; the headers only forbade storing
+        entry = _Entry(status, response_headers, body, lifetime)
+        storable = (
+            status in CACHEABLE_STATUSES and lifetime is not None and len(body) <= self.max_entry_bytes
+            and (lifetime > 0 or ttl or entry.etag or entry.last_modified)
+            and "*" not in response_headers.get("Vary", "")
+        )
+        if storable:
+            self._store(key, entry)
+        else:
+            self._forget(key)
+            with self._lock:
+                self.uncacheable += 1
+        return status, entry.headers, body, False
+
+    def get(self, url, headers, app=None):
+        """Returns (status, headers, body, cached) for a GET of `url` on behalf of `app`, or
+        None if the upstream server couldn't be reached and nothing was cached."""
+        key = self.key(url, headers)
+        ttl = self._ttl(app)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.fresh(ttl):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.status, entry.headers, entry.body, True
+            flight, leader = self._flights.join(key)
+            if leader:
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        return self._flights.run(key, flight, leader, lambda: self._refresh(key, url, headers, entry, ttl))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.nbytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "revalidated": self.revalidated,
+                "stale": self.stale,
+                "uncacheable": self.uncacheable,
+                "tunnels": self.tunnels,
+                "errors": self.errors,
+                "evictions": self.evictions,
+            }
+
+
+class _ProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        log.debug("%s %s", self.address_string(), format % args)
+
+    def _app(self):
+        """The app named as the proxy user in Proxy-Authorization, if any."""
+        scheme, _, credentials = (self.headers.get("Proxy-Authorization") or "").partition(" ")
+        if scheme.lower() != "basic":
+            return None
+        try:
+            user = base64.b64decode(credentials).decode("utf-8").partition(":")[0]
+        except (ValueError, UnicodeDecodeError):
+            return None
+        return urllib.parse.unquote(user) or None
+
+    def _reply(self, status, headers, body, cache_status):
+        self.send_response(status)
+        for name, value in headers:
+            if name.lower() not in ("content-length", "age"):
+                self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Cache", cache_status)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_GET(self):
+        proxy = self.server.proxy
+        if not self.path.startswith("http://"):
+            self.send_error(400, "Only absolute http:// URLs can be proxied")
+            return
+        headers = {name: value for name, value in self.headers.items() if name.lower() not in HOP_BY_HOP}
+        result = proxy.get(self.path, headers, self._app())
+        if result is None:
+            with proxy._lock:
+                proxy.errors += 1
+            self.send_error(502, "Upstream server unreachable")
+            return
+        status, response_headers, body, cached = result
+        self._reply(status, response_headers, body, "HIT" if cached else "MISS")
+
+    do_HEAD = do_GET
+
+    def do_CONNECT(self):
+        """Tunnels HTTPS to the upstream server unmodified."""
+        proxy = self.server.proxy
+        host, _, port = self.path.rpartition(":")
+        try:
+            upstream = socket.create_connection((host, int(port)), timeout=UPSTREAM_TIMEOUT)
+        except (OSError, ValueError) as e:
+            with proxy._lock:
+                proxy.errors += 1
+            self.send_error(502, f"Could not connect to {self.path}: {e}")
+            return
+        with proxy._lock:
+            proxy.tunnels += 1
+        self.send_response(200, "Connection Established")
+        self.end_headers()
+        self.close_connection = True
+
+        sockets = [self.connection, upstream]
+        with upstream:
+            while True:
+                readable, _, _ = select.select(sockets, [], [], TUNNEL_IDLE_TIMEOUT)
+                if not readable:
+                    return
+                for sock in readable:
+                    data = sock.recv(65536)
+                    if not data:
+                        return
+                    (upstream if sock is self.connection else self.connection).sendall(data)
@@ -0,0 +1,156 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of recent dispatches kept for lateness stats
+LATENESS_WINDOW = 256
+
+log = logging.getLogger("alibyt.scheduler")
+
+
+class RenderScheduler:
+    """Dispatches app renders from a heap of next-due deadlines onto a bounded worker pool."""
+
+    def __init__(self, render_fn, max_workers=4, interval_fn=None):
+        self.render_fn = render_fn
+        # Optional interval_fn(app, interval) -> seconds until the app's next render, for adaptive refresh
+        self.interval_fn = interval_fn
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="render")
+        self._cond = threading.Condition()
+        self._heap = []  # (due, seq, app)
+        self._entries = {}  # app -> seq of its live heap entry
+        self._intervals = {}  # app -> refresh interval in seconds
+        self._running = set()  # apps with a render in flight
+        self._seq = itertools.count()
+        self._lateness = deque(maxlen=LATENESS_WINDOW)
+        self._max_lateness = 0.0
+        self._dispatched = 0
+        self._stopped = False
+
+    def _push(self, app, due):
+        """Schedules `app` at `due`, superseding any older heap entry."""
+        seq = next(self._seq)
+        self._entries[app] = seq
+        heapq.heappush(self._heap, (due, seq, app))
+        self._cond.notify()
+
+    def add(self, app, interval, delay=0):
+        """Adds an app to the schedule; it is first rendered after `delay` seconds."""
+        with self._cond:
+            self._intervals[app] = interval
+            if app not in self._entries and app not in self._running:
+                self._push(app, time.monotonic() + delay)
+
+    def remove(self, app):
+        """Drops an app from the schedule. An in-flight render finishes but is not rescheduled."""
+        with self._cond:
+            self._intervals.pop(app, None)
+            self._entries.pop(app, None)  # Heap entry is discarded lazily
+
+    def wake(self, app):
+        """Moves a scheduled app's next render forward to now, unless it is already rendering."""
+        with self._cond:
+            if app in self._intervals and app not in self._running:
+                self._push(app, time.monotonic())
+
+    def sync(self, wanted):
+        """Reconciles the schedule with `wanted` (app -> interval). Returns (added, removed)."""
+        with self._cond:
+            current = set(self._intervals)
+        added = [app for app in wanted if app not in current]
+        removed = [app for app in current if app not in wanted]
+
+        for app in removed:
+            self.remove(app)
+        for app, interval in wanted.items():
+            # Interval changes for existing apps take effect on their next reschedule
+            self.add(app, interval)
+        return added, removed
+
+    def apps(self):
+        """Returns the apps currently scheduled."""
+        with self._cond:
+            return set(self._intervals)
+
+    def stop(self):
+        """Stops dispatching and waits for in-flight renders to finish."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._pool.shutdown(wait=True)
+
+    def run(self):
+        """Dispatch loop. Sleeps until the earliest deadline or a free worker, whichever is later."""
+        with self._cond:
+            while not self._stopped:
+                # Discard entries superseded by remove() or a newer push
+                while self._heap and self._entries.get(self._heap[0][2]) != self._heap[0][1]:
+                    heapq.heappop(self._heap)
+
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+
+                due = self._heap[0][0]
+                now = time.monotonic()
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+
+                if len(self._running) >= self.max_workers:
+                    self._cond.wait()  # Woken by _finish()
+                    continue
+
+                _, _, app = heapq.heappop(self._heap)
+                del self._entries[app]
+                self._running.add(app)
+
+                lateness = now - due
+                self._lateness.append(lateness)
+                self._max_lateness = max(self._max_lateness, lateness)
+                self._dispatched += 1
+
+                self._pool.submit(self._execute, app, now)
+
+    def _execute(self, app, started):
+        try:
+            self.render_fn(app)
+        except Exception:
+            log.exception("Unhandled error rendering %s", app)
+        finally:
+            self._finish(app, started)
+
+    def _finish(self, app, started):
+        with self._cond:
+            self._running.discard(app)
+            interval = self._intervals.get(app)
+            if interval is not None and app not in self._entries:
+                if self.interval_fn is not None:
+                    interval = self.interval_fn(app, interval)
+                # Keep a fixed cadence from the start of the last render
+                self._push(app, max(started + interval, time.monotonic()))
+            self._cond.notify_all()
+
+    def stats(self):
+        """Returns queue depth, in-flight count and lateness (seconds) of recent dispatches."""
+        with self._cond:
+            now = time.monotonic()
+            queue_depth = sum(
+                1 for due, seq, app in self._heap
+                if due <= now and self._entries.get(app) == seq
+            )
+            recent = list(self._lateness)
+            return {
+                "scheduled": len(self._intervals),
+                "queue_depth": queue_depth,
+                "in_flight": len(self._running),
+                "dispatched": self._dispatched,
+                "lateness_last": recent[-1] if recent else 0.0,
+                "lateness_avg": sum(recent) / len(recent) if recent else 0.0,
+                "lateness_max": self._max_lateness,
+            }
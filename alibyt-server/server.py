@@ -1,147 +1,94 @@
-from flask import Flask, request, jsonify
-import json
-import os
-import paho.mqtt.client as mqtt
-from utils import load_apps_config
+import time
+from flask import Flask, Response, g, request, jsonify
+import api
+from metrics import CONTENT_TYPE
 
 app = Flask(__name__)
 
-# Paths
-APPS_CONFIG_FILE = os.path.expanduser("~/AliByt/alibyt-server/apps_config.json")
-DB_FILE = os.path.expanduser("~/AliByt/alibyt-server/database.json")
+def respond(body, status):
+    return jsonify(body), status
 
-# HTTP Server Details
-RHEL_IP = "192.168.2.48" 
-HTTP_PORT = 8080  # The port where your HTTP server runs
-IMAGE_FOLDER = "/home/ali/AliByt/alibyt-server/images"  # Directory where images are stored
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
 
-# MQTT Setup
-MQTT_BROKER = "localhost"
-MQTT_TOPIC = "alibyt/images"
+@app.after_request
+def record_latency(response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    api.observe_request(route, request.method, response.status_code, time.perf_counter() - g.started)
+    return response
 
-mqtt_client = mqtt.Client()
-mqtt_client.connect(MQTT_BROKER)
-
-
-# Load app subscriptions
-if os.path.exists(DB_FILE):
-    with open(DB_FILE, "r") as f:
-        subscriptions = json.load(f)
-else:
-    subscriptions = {"subscribed_apps": [], "client_speed": 5}
-
-def save_subscriptions():
-    """ Save subscription data to file """
-    with open(DB_FILE, "w") as f:
-        json.dump(subscriptions, f, indent=4)
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """ Prometheus metrics for the server, the publisher and every reporting client """
+    text, status = api.get_metrics()
+    return Response(text, status=status, content_type=CONTENT_TYPE)
 
 @app.route("/subscribe", methods=["POST"])
 def subscribe():
     """ Subscribe to an app """
-    data = request.json
-    print("Received Data:", data)  # Debugging
-
-    app_name = data.get("app")
-    available_apps = load_apps_config()
-    print("Current Subscriptions:", subscriptions)  # Debugging
-
-    if app_name in available_apps and app_name not in subscriptions["subscribed_apps"]:
-        subscriptions["subscribed_apps"].append(app_name)
-        save_subscriptions()
-        return jsonify({"message": f"Subscribed to {app_name}"}), 200
-
-    return jsonify({"error": "Invalid request or already subscribed"}), 400
-
+    return respond(*api.subscribe(request.json))
 
 @app.route("/unsubscribe", methods=["POST"])
 def unsubscribe():
     """ Unsubscribe from an app """
-    data = request.json
-    app_name = data.get("app")
-
-    if app_name in subscriptions["subscribed_apps"]:
-        subscriptions["subscribed_apps"].remove(app_name)
-        save_subscriptions()
-        return jsonify({"message": f"Unsubscribed from {app_name}"}), 200
-    return jsonify({"error": "App not found in subscriptions"}), 400
+    return respond(*api.unsubscribe(request.json))
 
 @app.route("/subscriptions", methods=["GET"])
 def get_subscriptions():
-    """ Get list of subscribed apps """
-    return jsonify(subscriptions)
+    """ Get a device's list of subscribed apps (?device=..., default device otherwise) """
+    return respond(*api.get_subscriptions(request.args))
 
-@app.route("/push_update", methods=["POST"])
-def push_update():
-    """ Push a new image update via MQTT, sending a URL instead of a file path """
-    data = request.json
-    app_name = data.get("app")
+@app.route("/subscriptions", methods=["PUT"])
+def set_subscriptions():
+    """ Replace the whole rotation in one transaction """
+    return respond(*api.set_subscriptions(request.json))
 
-    available_apps = load_apps_config()
-    if app_name in subscriptions["subscribed_apps"] and app_name in available_apps:
-        image_filename = os.path.basename(available_apps[app_name]["path"])
-        image_url = f"http://{RHEL_IP}:{HTTP_PORT}/{image_filename}"
+@app.route("/devices", methods=["GET"])
+def get_devices():
+    """ List devices """
+    return respond(*api.get_devices())
 
-        mqtt_message = json.dumps({"app": app_name, "url": image_url})
-        mqtt_client.publish(MQTT_TOPIC, mqtt_message)
+@app.route("/devices", methods=["POST"])
+def register_device():
+    """ Create or update a device """
+    return respond(*api.register_device(request.json))
 
-        return jsonify({"message": f"Update pushed for {app_name}", "url": image_url}), 200
-    return jsonify({"error": "App not subscribed or invalid"}), 400
+@app.route("/devices", methods=["DELETE"])
+def remove_device():
+    """ Delete a device and its subscriptions """
+    return respond(*api.remove_device(request.json))
 
+@app.route("/push_update", methods=["POST"])
+def push_update():
+    """ Push a new image update via MQTT, sending a URL instead of a file path """
+    return respond(*api.push_update(request.json))
 
 @app.route("/set_speed", methods=["POST"])
 def set_client_speed():
-    """ Set client cycle speed """
-    data = request.json
-    new_speed = data.get("speed")
-
-    if isinstance(new_speed, int) and new_speed > 0:
-        subscriptions["client_speed"] = new_speed
-        save_subscriptions()
-        
-        mqtt_message = json.dumps({"type": "update_speed", "speed": new_speed})
-        mqtt_client.publish(MQTT_TOPIC, mqtt_message)
-
-        return jsonify({"message": f"Client speed updated to {new_speed} seconds"}), 200
-    return jsonify({"error": "Invalid speed value"}), 400
-    
+    """ Set a device's cycle speed """
+    return respond(*api.set_client_speed(request.json))
+
 @app.route("/update_app_settings", methods=["POST"])
 def update_app_settings():
-    """ Update brightness or refresh interval for a specific app """
-    data = request.json
-    app_name = data.get("app")
-    new_brightness = data.get("brightness")
-    new_refresh_rate = data.get("refresh_rate")
-
-    # Load current config
-    if os.path.exists(APPS_CONFIG_FILE):
-        with open(APPS_CONFIG_FILE, "r") as f:
-            apps_config = json.load(f)
-    else:
-        return jsonify({"error": "Configuration file not found"}), 500
-
-    # Ensure the app exists
-    if app_name not in apps_config:
-        return jsonify({"error": "App not found"}), 400
-
-    # Update settings if provided
-    if new_brightness is not None:
-        if 0 <= new_brightness <= 100:
-            apps_config[app_name]["brightness"] = new_brightness
-        else:
-            return jsonify({"error": "Brightness must be between 0 and 100"}), 400
-
-    if new_refresh_rate is not None:
-        if new_refresh_rate > 0:
-            apps_config[app_name]["refresh_rate"] = new_refresh_rate
-        else:
-            return jsonify({"error": "Refresh rate must be greater than 0"}), 400
-
-    # Save updated config
-    with open(APPS_CONFIG_FILE, "w") as f:
-        json.dump(apps_config, f, indent=4)
-
-    return jsonify({"message": f"Updated settings for {app_name}"}), 200
+    """ Update brightness, refresh interval or config selections for a specific app """
+    return respond(*api.update_app_settings(request.json))
+
+@app.route("/app_settings", methods=["PATCH"])
+def patch_app_settings():
+    """ Update settings for many apps in one transaction """
+    return respond(*api.patch_app_settings(request.json))
+
+
+@app.route("/render_breakers", methods=["GET"])
+def get_render_breakers():
+    """ Show failing render jobs (?app=... for one app) """
+    return respond(*api.get_render_breakers(request.args))
 
+@app.route("/render_breakers/reset", methods=["POST"])
+def reset_render_breakers():
+    """ Let failing render jobs run again now """
+    return respond(*api.reset_render_breakers(request.get_json(silent=True)))
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
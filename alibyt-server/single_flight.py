@@ -0,0 +1,42 @@
+import threading
+
+
+class _Flight:
+    """One piece of in-progress work that other callers can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class SingleFlight:
+    """Coalesces concurrent work on the same key: the first caller does it, the others wait for its result.
+
+    The owner passes in the lock guarding its own cache and calls join() while holding it, so a
+    cache miss and joining the key's flight happen atomically; run() is then called without it.
+    """
+
+    def __init__(self, lock):
+        self._lock = lock
+        self._flights = {}  # key -> _Flight
+
+    def join(self, key):
+        """Returns (flight, leader) for `key`, starting a flight if none is running. Call with the lock held."""
+        flight = self._flights.get(key)
+        if flight is not None:
+            return flight, False
+        flight = self._flights[key] = _Flight()
+        return flight, True
+
+    def run(self, key, flight, leader, work_fn):
+        """Leader: returns `work_fn()` and hands it to the waiters (None if it raises). Others: wait and return it."""
+        if not leader:
+            flight.done.wait()
+            return flight.result
+        try:
+            flight.result = work_fn()
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
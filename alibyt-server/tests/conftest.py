@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(os.path.dirname(SERVER_DIR), "alibyt-bench")
+sys.path.insert(0, SERVER_DIR)
+
+
+@pytest.fixture
+def fake_pixlet(monkeypatch):
+    """Points the render pool at the benchmark's stand-in pixlet, rendering without delay."""
+    import render_pool
+
+    path = os.path.join(BENCH_DIR, "fake_pixlet.py")
+    monkeypatch.setattr(render_pool, "PIXLET_BIN", path)
+    monkeypatch.setenv("FAKE_PIXLET_DELAY", "0")
+    return path
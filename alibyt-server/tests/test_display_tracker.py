@@ -0,0 +1,37 @@
+import math
+
+from display_tracker import DisplayTracker
+
+APPS = [f"a{i}" for i in range(40)]
+
+
+def tracker(upcoming, **status):
+    tracker = DisplayTracker()
+    assert tracker.update("pi", {"app": "a0", "upcoming": upcoming, "dwell": 5, **status}, now=0)
+    return tracker
+
+
+def test_full_cycle_wraps_with_its_own_period():
+    cycle = APPS[1:10] + ["a0"]
+    tracked = tracker(cycle, cycle=10)
+    assert tracked.next_showing("a3", ["pi"], now=0) == 15
+    assert tracked.next_showing("a1", ["pi"], now=20) == 35  # Slot 11 starts at 55s, after one 10-slot cycle
+    assert tracked.next_showing("missing", ["pi"], now=0) == math.inf
+
+
+def test_truncated_rotation_is_unknown_beyond_its_window():
+    tracked = tracker(APPS[1:33], cycle=40)
+    assert tracked.next_showing("a5", ["pi"], now=0) == 25
+    assert tracked.next_showing("a35", ["pi"], now=0) is None  # Not listed, but still in the rotation
+    assert tracked.next_showing("a5", ["pi"], now=100) is None  # Its listed slot has passed
+
+
+def test_status_without_cycle_is_taken_as_whole():
+    tracked = tracker(APPS[1:10] + ["a0"])
+    assert tracked.next_showing("a1", ["pi"], now=20) == 35
+    assert tracked.next_showing("missing", ["pi"], now=0) == math.inf
+
+
+def test_any_unknown_device_makes_the_prediction_unknown():
+    tracked = tracker(APPS[1:10] + ["a0"], cycle=10)
+    assert tracked.next_showing("a1", ["pi", "kitchen"], now=0) is None
@@ -0,0 +1,97 @@
+import threading
+
+import pytest
+
+from render_pool import PixletWorker, RenderPool
+
+pytest.importorskip("PIL")  # The fake pixlet draws its WebPs with Pillow
+
+WEBP_MAGIC = b"RIFF"
+
+
+@pytest.fixture
+def app_path(tmp_path):
+    path = tmp_path / "clock.star"
+    path.write_text("def main():\n    pass\n")
+    return str(path)
+
+
+@pytest.fixture
+def pool(fake_pixlet):
+    pool = RenderPool(max_workers=2, max_renders=3)
+    yield pool
+    pool.close()
+
+
+def render(pool, app_path, tmp_path):
+    output_path = tmp_path / "out.webp"
+    assert pool.render(app_path, str(output_path), timeout=10) == str(output_path)
+    return output_path.read_bytes()
+
+
+def test_warm_render_reuses_worker(pool, app_path, tmp_path):
+    assert render(pool, app_path, tmp_path).startswith(WEBP_MAGIC)
+    assert render(pool, app_path, tmp_path).startswith(WEBP_MAGIC)
+    assert pool.stats() == {"workers": 1, "warm_renders": 2, "cold_renders": 0, "recycled": 0}
+
+
+def test_worker_recycled_after_max_renders(pool, app_path, tmp_path):
+    for _ in range(3):
+        render(pool, app_path, tmp_path)
+    stats = pool.stats()
+    assert stats["recycled"] == 1
+    assert stats["workers"] == 0
+
+    render(pool, app_path, tmp_path)  # A fresh worker takes over
+    assert pool.stats()["workers"] == 1
+    assert pool.stats()["warm_renders"] == 4
+
+
+def test_crashed_worker_falls_back_and_is_replaced(pool, app_path, tmp_path):
+    render(pool, app_path, tmp_path)
+    worker = pool._workers[app_path]
+    worker.proc.kill()
+    worker.proc.wait()
+
+    assert render(pool, app_path, tmp_path).startswith(WEBP_MAGIC)
+    stats = pool.stats()
+    assert stats["cold_renders"] == 1
+    assert stats["workers"] == 0
+
+    render(pool, app_path, tmp_path)
+    assert pool._workers[app_path] is not worker
+
+
+def test_health_check_recycles_dead_worker(pool, app_path, tmp_path):
+    render(pool, app_path, tmp_path)
+    pool._workers[app_path].proc.kill()
+    pool._workers[app_path].proc.wait()
+    pool.health_check()
+    assert pool.stats()["workers"] == 0
+    assert pool.stats()["recycled"] == 1
+
+
+def test_falls_back_to_pixlet_render_when_worker_never_starts(pool, app_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(PixletWorker, "wait_ready", lambda self, timeout=None: False)
+    assert render(pool, app_path, tmp_path).startswith(WEBP_MAGIC)
+    assert pool.stats() == {"workers": 0, "warm_renders": 0, "cold_renders": 1, "recycled": 0}
+
+
+def test_concurrent_first_renders_share_the_starting_worker(pool, app_path, tmp_path):
+    errors = []
+
+    def render_one(i):
+        try:
+            assert pool.render(app_path, str(tmp_path / f"out{i}.webp"), timeout=10)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=render_one, args=(i,)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    stats = pool.stats()
+    assert (stats["warm_renders"], stats["cold_renders"]) == (3, 0)
@@ -0,0 +1,196 @@
+import email.message
+import threading
+import time
+import urllib.request
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from render_proxy import RenderProxy, freshness
+
+
+class Upstream:
+    """Stand-in HTTP server. `routes` maps a path to a function returning (status, headers)
+    for a request's headers; every request is recorded."""
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        self.delay = 0
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                upstream.requests.append((self.path, dict(self.headers)))
+                time.sleep(upstream.delay)
+                status, headers = upstream.routes[self.path](self.headers)
+                body = b"" if status == 304 else f"{self.path} #{len(upstream.requests)}".encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def hits(self, path):
+        return sum(1 for requested, _ in self.requests if requested == path)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def upstream():
+    server = Upstream()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def ttls():
+    return {}
+
+
+@pytest.fixture
+def proxy(ttls):
+    proxy = RenderProxy(1 << 20, ttls.get).start()
+    yield proxy
+    proxy.close()
+
+
+def fetch(proxy, url, app="app"):
+    """GETs `url` through the proxy as pixlet would, returning (body, X-Cache)."""
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({"http": proxy.env(app)["HTTP_PROXY"]}))
+    with opener.open(url, timeout=10) as response:
+        return response.read(), response.headers["X-Cache"]
+
+
+def headers(**values):
+    message = email.message.Message()
+    for name, value in values.items():
+        message[name.replace("_", "-")] = value
+    return message
+
+
+def test_freshness_from_headers():
+    assert freshness(headers(Cache_Control="max-age=60")) == 60
+    assert freshness(headers(Cache_Control="max-age=60, s-maxage=10")) == 10
+    assert freshness(headers(Cache_Control="max-age=60", Age="15")) == 45
+    assert freshness(headers(Cache_Control="no-cache")) == 0
+    assert freshness(headers(Cache_Control="no-store")) is None
+    assert freshness(headers(Cache_Control="private, max-age=60")) is None
+    now = time.time()
+    assert freshness(headers(Date=formatdate(now, usegmt=True), Expires=formatdate(now + 120, usegmt=True))) == 120
+    assert freshness(headers(Expires="0")) == 0
+    assert freshness(headers()) == 0
+
+
+def test_max_age_is_served_from_cache(proxy, upstream):
+    upstream.routes["/scores"] = lambda request: (200, {"Cache-Control": "max-age=60"})
+    first = fetch(proxy, upstream.url + "/scores")
+    assert first[1] == "MISS"
+    assert fetch(proxy, upstream.url + "/scores") == (first[0], "HIT")
+    assert upstream.hits("/scores") == 1
+    stats = proxy.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+
+def test_no_store_and_expired_responses_are_not_reused(proxy, upstream):
+    upstream.routes["/live"] = lambda request: (200, {"Cache-Control": "no-store"})
+    upstream.routes["/expired"] = lambda request: (200, {"Expires": formatdate(time.time() - 60, usegmt=True)})
+    for path in ("/live", "/expired"):
+        assert fetch(proxy, upstream.url + path)[1] == "MISS"
+        assert fetch(proxy, upstream.url + path)[1] == "MISS"
+        assert upstream.hits(path) == 2
+    stats = proxy.stats()
+    assert (stats["hits"], stats["uncacheable"], stats["entries"]) == (0, 4, 0)
+
+
+def test_future_expires_is_served_from_cache(proxy, upstream):
+    upstream.routes["/schedule"] = lambda request: (200, {"Expires": formatdate(time.time() + 300, usegmt=True)})
+    fetch(proxy, upstream.url + "/schedule")
+    assert fetch(proxy, upstream.url + "/schedule")[1] == "HIT"
+    assert upstream.hits("/schedule") == 1
+
+
+def test_etag_is_revalidated(proxy, upstream):
+    def route(request):
+        if request.get("If-None-Match") == '"v1"':
+            return 304, {"Cache-Control": "no-cache"}
+        return 200, {"Cache-Control": "no-cache", "ETag": '"v1"'}
+
+    upstream.routes["/feed"] = route
+    body, _ = fetch(proxy, upstream.url + "/feed")
+    assert fetch(proxy, upstream.url + "/feed") == (body, "HIT")
+    assert upstream.hits("/feed") == 2
+    assert upstream.requests[-1][1].get("If-None-Match") == '"v1"'
+    assert proxy.stats()["revalidated"] == 1
+
+
+def test_last_modified_is_revalidated(proxy, upstream):
+    modified = formatdate(time.time() - 3600, usegmt=True)
+
+    def route(request):
+        if request.get("If-Modified-Since") == modified:
+            return 304, {}
+        return 200, {"Last-Modified": modified}
+
+    upstream.routes["/logo"] = route
+    body, _ = fetch(proxy, upstream.url + "/logo")
+    assert fetch(proxy, upstream.url + "/logo") == (body, "HIT")
+    assert upstream.requests[-1][1].get("If-Modified-Since") == modified
+    assert proxy.stats()["revalidated"] == 1
+
+
+def test_concurrent_misses_share_one_fetch(proxy, upstream):
+    upstream.routes["/standings"] = lambda request: (200, {"Cache-Control": "max-age=60"})
+    upstream.delay = 0.3
+    results = []
+    threads = [
+        threading.Thread(target=lambda i=i: results.append(fetch(proxy, upstream.url + "/standings", f"app{i}")[0]))
+        for i in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert upstream.hits("/standings") == 1
+    assert len(results) == 8 and len(set(results)) == 1
+    stats = proxy.stats()
+    assert (stats["misses"], stats["coalesced"]) == (1, 7)
+
+
+def test_per_app_ttl_overrides_headers(proxy, upstream, ttls):
+    upstream.routes["/quote"] = lambda request: (200, {"Cache-Control": "no-store"})
+    ttls["pinned"] = 60
+    fetch(proxy, upstream.url + "/quote", "pinned")
+    assert fetch(proxy, upstream.url + "/quote", "pinned")[1] == "HIT"
+    assert upstream.hits("/quote") == 1
+
+    upstream.routes["/weather"] = lambda request: (200, {"Cache-Control": "max-age=60"})
+    ttls["uncached"] = 0
+    fetch(proxy, upstream.url + "/weather", "uncached")
+    assert fetch(proxy, upstream.url + "/weather", "uncached")[1] == "MISS"
+    assert fetch(proxy, upstream.url + "/weather", "other")[1] == "HIT"  # Others still follow the headers
+    assert upstream.hits("/weather") == 2
+
+
+def test_stale_copy_served_when_upstream_is_down(proxy, upstream):
+    upstream.routes["/news"] = lambda request: (200, {"Cache-Control": "max-age=0", "ETag": '"a"'})
+    body, _ = fetch(proxy, upstream.url + "/news")
+    upstream.close()
+    assert fetch(proxy, upstream.url + "/news") == (body, "HIT")
+    assert proxy.stats()["stale"] == 1
@@ -1,6 +1,10 @@
 import os
+import ast
 import json
 import re
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from config_store import ConfigStore
 
 # Base directory where apps are stored
 APPS_BASE_DIR = "/home/ali/AliByt/alibyt-apps/tidbyt-community/apps"
@@ -8,8 +12,20 @@ APPS_BASE_DIR = "/home/ali/AliByt/alibyt-apps/tidbyt-community/apps"
 # Path to the apps_config.json file
 CONFIG_PATH = "/home/ali/AliByt/alibyt-server/apps_config.json"
 
+# Per-app index of .star file mtime/size/hash and parsed config, so unchanged apps aren't re-parsed
+INDEX_PATH = "/home/ali/AliByt/alibyt-server/apps_index.json"
+PARSER_VERSION = 2  # Bump when extraction changes, so every app is re-parsed once
+OPTIONS_SOURCE = "options_source"  # Unresolved options text; index only, apps_config.json keeps its shape
+
 # Default refresh rate
-DEFAULT_REFRESH_RATE = 60  # Default refresh rate in seconds
+DEFAULT_REFRESH_RATE = 60  # Starting refresh interval in seconds; the publisher adapts it to each app
+
+# Fallback scanner for files Python's parser rejects
+SCHEMA_CALL = re.compile(r'schema\.(\w+)\(')
+KWARG = re.compile(r'\b(id|name|default|options)\s*=\s*("(?:[^"\\]|\\.)*"|[^,]+)')
+LIST_ASSIGNMENT = re.compile(r'^\s*(\w+)\s*=\s*\[', re.MULTILINE)
+OPTION_REF = re.compile(r'^(\w+)\s*\[\s*(-?\d+)\s*\]\s*\.\s*value$')  # e.g. options[0].value
+QUOTED = re.compile(r'"((?:[^"\\]|\\.)*)"')
 
 def find_star_file(directory):
     """Finds the .star file inside the given app directory."""
@@ -18,41 +34,202 @@ def find_star_file(directory):
             return file  # Return the full filename (e.g., "nba_standings.star")
     return None  # No .star file found
 
+def _literal(node, content):
+    """Returns a constant's value, or the source text of any other expression."""
+    try:
+        value = ast.literal_eval(node)
+        return value if isinstance(value, str) else ast.get_source_segment(content, node)
+    except (ValueError, TypeError):
+        return ast.get_source_segment(content, node)
+
+def _options(node, content, lists):
+    """Returns the values of an options list (schema.Option(...) or plain literals), inline or
+    through a variable assigned a list literal; None if it is built some other way."""
+    if isinstance(node, ast.Name):
+        node = lists.get(node.id)
+    if not isinstance(node, ast.List):
+        return None
+    options = []
+    for element in node.elts:
+        if isinstance(element, ast.Call):
+            kwargs = {kw.arg: kw.value for kw in element.keywords}
+            value = kwargs.get("value", kwargs.get("display"))
+            options.append(_literal(value, content) if value is not None else None)
+        else:
+            options.append(_literal(element, content))
+    return options
+
+def _default(node, content, lists):
+    """Returns a field's default, resolving `options[0].value` against an options variable."""
+    if (isinstance(node, ast.Attribute) and node.attr == "value" and isinstance(node.value, ast.Subscript)
+            and isinstance(node.value.value, ast.Name)):
+        values = _options(node.value.value, content, lists)
+        try:
+            return values[ast.literal_eval(node.value.slice)]
+        except (TypeError, ValueError, IndexError):
+            pass
+    return _literal(node, content)
+
+def _option_fields(field, options, source):
+    """Adds the option values to a field, keeping the source text when they can't be resolved."""
+    field["options"] = options
+    if options is None and source is not None:
+        field[OPTIONS_SOURCE] = source  # Unresolved, e.g. built by a function call; kept in the index only
+    return field
+
+def _extract_with_ast(content):
+    """Walks the Starlark source as a Python AST (Starlark's syntax is a Python subset)."""
+    tree = ast.parse(content)
+    # Variables assigned a list literal, so `options = OPTIONS` can be resolved
+    lists = {
+        node.targets[0].id: node.value for node in ast.walk(tree)
+        if isinstance(node, ast.Assign) and len(node.targets) == 1
+        and isinstance(node.targets[0], ast.Name) and isinstance(node.value, ast.List)
+    }
+    config_options = []
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                and isinstance(node.func.value, ast.Name) and node.func.value.id == "schema"):
+            continue
+        kwargs = {kw.arg: kw.value for kw in node.keywords if kw.arg}
+        if "id" not in kwargs:
+            continue  # schema.Schema, schema.Option, ...
+
+        options = kwargs.get("options")
+        config_options.append(_option_fields({
+            "label": _literal(kwargs["name"], content) if "name" in kwargs else None,
+            "type": node.func.attr,
+            "id": _literal(kwargs["id"], content),
+            "default_value": _default(kwargs["default"], content, lists) if "default" in kwargs else None,
+            "selected_value": None,
+            "_pos": (node.lineno, node.col_offset),
+        }, _options(options, content, lists) if options is not None else None,
+           ast.get_source_segment(content, options) if options is not None else None))
+    # ast.walk is breadth-first; report fields in source order
+    config_options.sort(key=lambda option: option.pop("_pos"))
+    return config_options
+
+def _call_body(content, start):
+    """Returns the text between the parenthesis opened just before `start` and its match."""
+    depth = 1
+    i = start
+    in_string = None
+    while i < len(content) and depth:
+        char = content[i]
+        if in_string:
+            if char == "\\":
+                i += 1
+            elif char == in_string:
+                in_string = None
+        elif char in "\"'":
+            in_string = char
+        elif char == "#":
+            newline = content.find("\n", i)
+            i = len(content) if newline == -1 else newline
+        elif char in "([{":
+            depth += 1
+        elif char in ")]}":
+            depth -= 1
+        i += 1
+    return content[start:i - 1]
+
+def _top_level(body):
+    """Blanks out everything nested inside brackets so only a call's own arguments remain."""
+    depth = 0
+    in_string = None
+    chars = []
+    for char in body:
+        keep = depth == 0
+        if in_string:
+            if char == in_string:
+                in_string = None
+        elif char in "\"'":
+            in_string = char
+        elif char in "([{":
+            depth += 1
+        elif char in ")]}":
+            depth -= 1
+            keep = depth == 0
+        chars.append(char if keep else " ")
+    return "".join(chars)
+
+def _scan_options(options_text):
+    """Option values in the text of a list: the value= of each schema.Option, or plain strings."""
+    values = re.findall(r'value\s*=\s*"((?:[^"\\]|\\.)*)"', options_text)
+    return values or QUOTED.findall(options_text)
+
+def _extract_with_scanner(content):
+    """Single pass over the schema calls, for sources the AST parser can't handle."""
+    lists = {}  # Variables assigned a list literal -> their option values
+    for assignment in LIST_ASSIGNMENT.finditer(content):
+        lists[assignment.group(1)] = _scan_options(_call_body(content, assignment.end()))
+
+    config_options = []
+    for match in SCHEMA_CALL.finditer(content):
+        body = _call_body(content, match.end())
+        arguments = _top_level(body)  # Same offsets as `body`, with nested brackets blanked
+        kwargs = {}
+        for kwarg in KWARG.finditer(arguments):
+            kwargs.setdefault(kwarg.group(1), body[kwarg.start(2):kwarg.end(2)].strip())
+        if "id" not in kwargs:
+            continue
+
+        options = None
+        options_text = kwargs.get("options")
+        if options_text and options_text.startswith("["):
+            options = _scan_options(options_text)
+        elif options_text in lists:
+            options = lists[options_text]
+
+        default = kwargs.get("default")
+        reference = OPTION_REF.match(default or "")
+        if reference and reference.group(1) in lists:
+            try:
+                default = lists[reference.group(1)][int(reference.group(2))]
+            except IndexError:
+                pass
+
+        unquote = lambda text: text[1:-1] if text and text.startswith('"') else text
+        config_options.append(_option_fields({
+            "label": unquote(kwargs.get("name")),
+            "type": match.group(1),
+            "id": unquote(kwargs["id"]),
+            "default_value": unquote(default),
+            "selected_value": None,
+        }, options, options_text))
+    return config_options
+
 def extract_config_options(star_file_path):
-    """Extracts configuration options from the .star file by scanning for schema definitions."""
+    """Extracts configuration options from the .star file by walking its schema definitions."""
     config_options = []
     try:
         with open(star_file_path, "r", encoding="utf-8") as file:
             content = file.read()
-            
-            # Match schema configuration definitions
-            matches = re.findall(r'schema\.(\w+)\(\s*id\s*=\s*"(.*?)".*?name\s*=\s*"(.*?)"', content)
-            for match in matches:
-                option_type, option_id, label = match
-                
-                # Extract default value
-                default_match = re.search(rf'id\s*=\s*"{option_id}".*?default\s*=\s*(.*?),', content, re.DOTALL)
-                default_value = default_match.group(1) if default_match else None
-                
-                # Extract dropdown options
-                options_match = re.search(rf'id\s*=\s*"{option_id}".*?options\s*=\s*\[(.*?)\]', content, re.DOTALL)
-                options = [opt.strip('" ') for opt in options_match.group(1).split(',')] if options_match else None
-                
-                config_options.append({
-                    "label": label,
-                    "type": option_type,
-                    "id": option_id,
-                    "default_value": default_value,
-                    "selected_value": None,
-                    "options": options
-                })
+        try:
+            config_options = _extract_with_ast(content)
+        except SyntaxError:
+            config_options = _extract_with_scanner(content)
     except Exception as e:
         print(f"Error reading {star_file_path}: {e}")
-    
+
     return config_options
 
+def parse_star_file(star_file_path):
+    """Hashes and parses one .star file. Runs in a worker process."""
+    with open(star_file_path, "rb") as file:
+        digest = hashlib.blake2b(file.read(), digest_size=16).hexdigest()
+    return digest, extract_config_options(star_file_path)
+
+def load_index():
+    """Loads the per-app index written by the previous run."""
+    try:
+        with open(INDEX_PATH, "r", encoding="utf-8") as index_file:
+            return json.load(index_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
 def update_apps_config():
-    """Scans the apps directory and updates the apps_config.json file."""
+    """Scans the apps directory and updates the apps_config.json file, re-parsing only changed apps."""
     apps_config = {}
 
     # Check if the base directory exists
@@ -60,8 +237,13 @@ def update_apps_config():
         print(f"Error: Apps directory {APPS_BASE_DIR} does not exist!")
         return
 
+    old_index = load_index()
+    old_config = ConfigStore(CONFIG_PATH).snapshot()
+    index = {}
+    changed = {}  # app_name -> star_file_path
+
     # Loop through all app directories
-    for app_name in os.listdir(APPS_BASE_DIR):
+    for app_name in sorted(os.listdir(APPS_BASE_DIR)):
         app_dir = os.path.join(APPS_BASE_DIR, app_name)
 
         # Ensure it's a directory
@@ -76,27 +258,57 @@ def update_apps_config():
 
         # Full path to .star file
         star_file_path = os.path.join(app_dir, star_filename)
+        stat = os.stat(star_file_path)
 
-        # Extract config settings from the .star file
-        config_settings = extract_config_options(star_file_path)
+        entry = old_index.get(app_name)
+        if (entry and entry["star"] == star_filename and entry.get("parser") == PARSER_VERSION
+                and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size):
+            index[app_name] = entry
+        else:
+            changed[app_name] = star_file_path
+            index[app_name] = {
+                "star": star_filename, "mtime": stat.st_mtime, "size": stat.st_size, "parser": PARSER_VERSION
+            }
+
+    # Hash and parse changed .star files in parallel
+    if changed:
+        with ProcessPoolExecutor() as pool:
+            results = pool.map(parse_star_file, changed.values(), chunksize=16)
+            for app_name, (digest, config_settings) in zip(changed, results):
+                entry = old_index.get(app_name)
+                if entry and entry.get("hash") == digest and entry.get("parser") == PARSER_VERSION:
+                    config_settings = entry["config_settings"]  # Touched but not modified
+                index[app_name].update({"hash": digest, "config_settings": config_settings})
+
+    for app_name, entry in index.items():
+        star_filename = entry["star"]
 
         # Generate the .webp filename (same name as the .star file, but with .webp)
         webp_filename = star_filename.replace(".star", ".webp")
 
         # Add to config
         apps_config[app_name] = {
-            "path": app_dir,
+            "path": os.path.join(APPS_BASE_DIR, app_name),
             "app_name": star_filename,
             "photo_name": webp_filename,
             "refresh_rate": DEFAULT_REFRESH_RATE,
-            "config_settings": config_settings  # New field for available configurations
+            "config_settings": [  # New field for available configurations
+                {key: value for key, value in field.items() if key != OPTIONS_SOURCE}
+                for field in entry["config_settings"]
+            ]
         }
+        # Hand-set per-app overrides survive a rescan
+        cache_ttl = old_config.get(app_name, {}).get("cache_ttl")
+        if cache_ttl is not None:
+            apps_config[app_name]["cache_ttl"] = cache_ttl
+
+    # Save updated config (atomically, so the server and publisher never read a partial file)
+    ConfigStore(CONFIG_PATH).write(apps_config)
 
-    # Save updated config
-    with open(CONFIG_PATH, "w", encoding="utf-8") as config_file:
-        json.dump(apps_config, config_file, indent=4)
+    with open(INDEX_PATH, "w", encoding="utf-8") as index_file:
+        json.dump(index, index_file)
 
-    print(f"✅ Updated {CONFIG_PATH} with {len(apps_config)} apps.")
+    print(f"✅ Updated {CONFIG_PATH} with {len(apps_config)} apps ({len(changed)} re-parsed).")
 
 if __name__ == "__main__":
     update_apps_config()
@@ -1,7 +1,10 @@
-import json
+from config_store import ConfigStore
+
+CONFIG_PATH = "/home/ali/AliByt/alibyt-server/apps_config.json"
+
+# Shared, mtime-aware view of the catalog
+apps_config_store = ConfigStore(CONFIG_PATH)
 
 def load_apps_config():
-    """ Loads the apps_config.json file and returns available apps. """
-    CONFIG_PATH = "/home/ali/AliByt/alibyt-server/apps_config.json"
-    with open(CONFIG_PATH, "r") as file:
-        return json.load(file)
+    """ Returns a read-only snapshot of apps_config.json, re-parsed only when the file changes. """
+    return apps_config_store.snapshot()